@@ -17,7 +17,7 @@ from api.services.knowledge import (
     get_json_items,
     add_kb_items
 )
-from task.task import process_json_data
+from task.task import process_json_data, reindex_knowledge_base
 
 bp = Blueprint("knowledge", __name__, url_prefix='/api/knowledge_base')
 
@@ -312,3 +312,40 @@ def vectorize_items():
     except Exception as e:
         res.update(code=ResponseCode.Fail, msg=str(e))
         return res.data
+
+
+@route(bp, '/reindex', methods=['POST'])
+def reindex_kb():
+    """Re-embed the changed knowledge base items, optionally with another embedding model"""
+    res = ResMsg()
+    try:
+        data = request.get_json()
+        kb_name = data.get('kb_name')
+        embedding_model_name = data.get('embedding_model_name')  # Optional parameter
+
+        if not kb_name:
+            res.update(code=ResponseCode.InvalidParameter, msg="Missing knowledge base name")
+            return res.data
+
+        # Call the reindexing task
+        job_id = f"reindex_{kb_name}"
+        scheduler.add_job(
+            func=reindex_knowledge_base,
+            args=[kb_name, embedding_model_name],
+            trigger='date',
+            run_date=datetime.datetime.now(),
+            id=job_id,
+            replace_existing=True,
+            misfire_grace_time=3600,
+            coalesce=True
+        )
+
+        res.update(data={
+            "status": True,
+            "job_id": job_id
+        })
+        return res.data
+
+    except Exception as e:
+        res.update(code=ResponseCode.Fail, msg=str(e))
+        return res.data
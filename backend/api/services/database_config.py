@@ -2,6 +2,7 @@ from config.db_config import db
 from models import DatabaseConfig, DatabaseType
 from config.cache import cache
 from config.logging_config import logger
+from utils.db_connector import invalidate_validation_cache
 
 
 @cache.memoize(timeout=864000, make_name="support_database_options")
@@ -93,6 +94,9 @@ def update_database_config(id: int, host: str, port: int, database: str,
             logger.error(f"update_database_config error: config id {id} not found")
             return False
 
+        # The schema behind the old configuration may differ from the new one
+        invalidate_validation_cache({"host": config.host, "port": config.port, "db_name": config.database})
+
         config.host = host
         config.port = port
         config.database = database
@@ -119,6 +123,7 @@ def delete_database_config(id: int) -> bool:
             logger.error(f"delete_database_config error: config id {id} not found")
             return False
 
+        invalidate_validation_cache({"host": config.host, "port": config.port, "db_name": config.database})
         db.session.delete(config)
         db.session.commit()
         cache.delete_memoized(database_config_list)
@@ -1,16 +1,17 @@
 from models import KnowledgeBase, JSONContent, LLMModel
 from config.db_config import db
 from config.logging_config import logger
-from typing import List, Dict
+from typing import List, Dict, Iterable, Callable
 import os
-import asyncio
 import json
 from flask import current_app
 import time
-from llm_model.embeddings import get_embeddings
-from vector_store.chroma_store import ChromaStore
+from llm_model.embeddings import embedding_service
+from vector_store.base import get_vector_store
 import hashlib
 import tiktoken
+from itertools import islice
+from utils.constants import KB_IMPORT_CHUNK_SIZE
 
 
 def get_knowledge_base_list() -> List[Dict]:
@@ -124,10 +125,10 @@ def search_knowledge_base(kb_name: str, query: str, top_k: int = 5) -> List[Dict
             raise ValueError(f"Knowledge base does not exist: {kb_name}")
 
         # Get the vector representation of the query text
-        query_embedding = asyncio.run(get_embeddings([query], kb.embedding_model_name))[0]
+        query_embedding = embedding_service.embed([query], kb.embedding_model_name)[0]
 
         # Use Chroma to search
-        store = ChromaStore()
+        store = get_vector_store()
         results = store.search(
             kb_name=kb_name,
             query_embedding=query_embedding,
@@ -233,6 +234,17 @@ def get_json_items(kb_name: str, page: int = 1, page_size: int = 10, all_item: b
         }
 
 
+def get_json_items_version(kb_name: str) -> str:
+    """Cheap version of the JSON records of the knowledge base, changed by any insert, update or delete"""
+    kb = KnowledgeBase.query.filter_by(kb_name=kb_name).first()
+    if not kb:
+        raise ValueError(f"Knowledge base does not exist: {kb_name}")
+    count, max_id, max_updated_at = db.session.query(
+        db.func.count(JSONContent.id), db.func.max(JSONContent.id), db.func.max(JSONContent.updated_at)
+    ).filter(JSONContent.knowledge_base_id == kb.id).one()
+    return f"{kb.id}:{count}:{max_id}:{max_updated_at}"
+
+
 def secure_filename_with_unicode(filename: str) -> str:
     """Handle filenames containing Unicode characters"""
     # Separate filename and extension
@@ -249,6 +261,116 @@ def secure_filename_with_unicode(filename: str) -> str:
     return name + ext
 
 
+def get_content_fields(kb_id: int, item: Dict) -> Dict:
+    """Validate a knowledge item and return the column values of its JSONContent record"""
+    # Validate data format
+    if not isinstance(item, dict):
+        raise ValueError("Data item must be a dictionary type")
+    # Validate if has keyword, detail, description
+    if 'keyword' not in item.keys():
+        raise ValueError("Data item must contain keyword field")
+
+    if 'detail' not in item.keys():
+        raise ValueError("Data item must contain detail field")
+
+    if 'description' not in item.keys():
+        raise ValueError("Data item must contain description field")
+
+    if 'type' not in item.keys():
+        raise ValueError("Data item must contain type field")
+
+    if 'tree' not in item.keys():
+        raise ValueError("Data item must contain tree field")
+
+    # Get and verify embedding text keyword--separator--detail description
+    embedding_text = f"{item.get('keyword')}--separator--{item.get('detail')}{item.get('description')}"
+
+    # Calculate content hash
+    content_str = json.dumps(item, sort_keys=True)
+    content_hash = hashlib.sha256(content_str.encode('utf-8')).hexdigest()
+
+    return {
+        "knowledge_base_id": kb_id,
+        "content": content_str,
+        "content_type": item.get('type'),
+        "content_hash": content_hash,
+        "embedding_text": embedding_text,
+        "token_count": len(tiktoken.get_encoding("cl100k_base").encode(embedding_text)),
+        "status": "pending"  # Explicitly set initial status
+    }
+
+
+def import_kb_items(kb_name: str, items: Iterable[Dict], chunk_size: int = KB_IMPORT_CHUNK_SIZE,
+                    progress: Callable[[int, int], None] = None) -> Dict:
+    """
+    Import knowledge base items (without vectorization) from an iterable, chunk by chunk.
+
+    Items already in the knowledge base or repeated in the input (same content hash) are skipped,
+    each chunk costs one indexed lookup, one bulk insert and one commit.
+
+    Args:
+        kb_name: Knowledge base name
+        items: Items to import, e.g., a stream from utils.json_stream.iter_json_array
+        chunk_size: Items deduplicated and inserted per commit
+        progress: Called with the numbers of imported and skipped items after each chunk
+
+    Returns:
+        Dict: {'status', 'message', 'data': {'added', 'skipped'}}, the chunks committed before a failure are kept
+    """
+    added, skipped = 0, 0
+    try:
+        kb = KnowledgeBase.query.filter_by(kb_name=kb_name).first()
+        if not kb:
+            raise ValueError(f"Knowledge base does not exist: {kb_name}")
+        # Knowledge bases created before the index existed get it on their first import
+        for index in JSONContent.__table__.indexes:
+            index.create(bind=db.engine, checkfirst=True)
+
+        seen = set()
+        items = iter(items)
+        while True:
+            chunk = list(islice(items, chunk_size))
+            if len(chunk) == 0:
+                break
+
+            rows = [get_content_fields(kb.id, item) for item in chunk]
+            existing = {content_hash for content_hash, in db.session.query(JSONContent.content_hash).filter(
+                JSONContent.knowledge_base_id == kb.id,
+                JSONContent.content_hash.in_({row["content_hash"] for row in rows})
+            )}
+            new_rows = list()
+            for row in rows:
+                if row["content_hash"] in existing or row["content_hash"] in seen:
+                    skipped += 1
+                    continue
+                seen.add(row["content_hash"])
+                new_rows.append(row)
+
+            if len(new_rows) != 0:
+                db.session.bulk_insert_mappings(JSONContent, new_rows)
+            db.session.commit()
+            added += len(new_rows)
+
+            logger.info(f"Imported {added} items into {kb_name}, skipped {skipped} duplicates")
+            if progress is not None:
+                progress(added, skipped)
+
+        return {
+            'status': True,
+            'message': f'Successfully added {added} records, skipped {skipped} duplicates',
+            'data': {'added': added, 'skipped': skipped}
+        }
+
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Import knowledge base items failed: {str(e)}")
+        return {
+            'status': False,
+            'message': f'Import failed: {str(e)}',
+            'data': {'added': added, 'skipped': skipped}
+        }
+
+
 def add_kb_items(kb_name: str, items: List[Dict]) -> Dict:
     """Add knowledge base items (without vectorization)"""
     try:
@@ -262,42 +384,8 @@ def add_kb_items(kb_name: str, items: List[Dict]) -> Dict:
         contents = []
 
         for item in items:
-            # Validate data format
-            if not isinstance(item, dict):
-                raise ValueError("Data item must be a dictionary type")
-            # Validate if has keyword, detail, description
-            if 'keyword' not in item.keys():
-                raise ValueError("Data item must contain keyword field")
-            
-            if 'detail' not in item.keys():
-                raise ValueError("Data item must contain detail field")
-
-            if 'description' not in item.keys():
-                raise ValueError("Data item must contain description field")
-
-            if 'type' not in item.keys():
-                raise ValueError("Data item must contain type field")
-
-            if 'tree' not in item.keys():
-                raise ValueError("Data item must contain tree field")
-            
-            # Get and verify embedding text keyword--separator--detail description
-            embedding_text = f"{item.get('keyword')}--separator--{item.get('detail')}{item.get('description')}"
-
-            # Calculate content hash
-            content_str = json.dumps(item, sort_keys=True)
-            content_hash = hashlib.sha256(content_str.encode('utf-8')).hexdigest()
-
             # Create content object
-            content = JSONContent(
-                knowledge_base_id=kb.id,
-                content=content_str,
-                content_type=item.get('type'),
-                content_hash=content_hash,
-                embedding_text=embedding_text,
-                token_count=len(tiktoken.get_encoding("cl100k_base").encode(embedding_text)),
-                status="pending"  # Explicitly set initial status
-            )
+            content = JSONContent(**get_content_fields(kb.id, item))
             contents.append(content)
 
         # If there is no valid data
@@ -367,7 +455,7 @@ def delete_kb_items(kb_name: str, item_ids: List[int] = None) -> Dict:
         try:
             # Delete vectors from Chroma
             if vector_type_ids:
-                store = ChromaStore()
+                store = get_vector_store()
                 for content_type, vector_ids in vector_type_ids.items():
                     store.delete_by_ids(kb.kb_name, content_type, vector_ids)
 
@@ -441,7 +529,7 @@ def delete_knowledge_base(kb_name: str) -> Dict:
             JSONContent.query.filter_by(knowledge_base_id=kb.id).delete()
 
             # 2. Delete Chroma collection (will automatically delete all vectors in the collection)
-            store = ChromaStore()
+            store = get_vector_store()
             store.delete_collection(kb.kb_name)
 
         except Exception as e:
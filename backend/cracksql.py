@@ -1,10 +1,25 @@
-from init_knowledge_base import initialize_kb
-from translate import Translator
-from app_factory import create_app
+import threading
 from typing import Dict, List, Tuple, Union, Optional
-from api.services.llm_model import LLMModelService
 from utils.constants import DIALECT_LIST, DIALECT_LIST_RULE
 
+# The Flask application (database, services) is created on first use and shared by all calls,
+# the heavy modules (models, vector store, parsers) are only imported by the code paths needing them
+app = None
+app_lock = threading.Lock()
+
+
+def get_app():
+    """Create the application once and return it"""
+    global app
+    if app is None:
+        with app_lock:
+            if app is None:
+                from app_factory import create_app
+                new_app = create_app("PRODUCTION")
+                new_app.config["SCHEDULER_OPEN"] = False
+                app = new_app
+    return app
+
 
 def add_llm_model(name: str, deployment_type: str, path: str, api_base: str, api_key: str, temperature: float,
                   max_tokens: int, description: str, is_active: bool = True):
@@ -50,6 +65,7 @@ def add_llm_model(name: str, deployment_type: str, path: str, api_base: str, api
             "dimension": 0,
             "is_active": is_active
         }
+        from api.services.llm_model import LLMModelService
         res = LLMModelService.create_model(data)
         if res:
             return True
@@ -104,6 +120,7 @@ def add_embedding_model(name: str, deployment_type: str, path: str, api_base: st
             "dimension": dimension,
             "is_active": is_active
         }
+        from api.services.llm_model import LLMModelService
         res = LLMModelService.create_model(data)
         if res:
             return True
@@ -156,10 +173,18 @@ def translate(
     if not tgt_dialect:
         raise ValueError("tgt_dialect is required")
 
-    app = create_app("PRODUCTION")
-    app.config["SCHEDULER_OPEN"] = False
+    from translate import Translator
+
+    if not target_db_config or (not vector_config or not vector_config.get("src_kb_name", None) or
+                                not vector_config.get("tgt_kb_name", None)):
+        if not model_name and (src_dialect in DIALECT_LIST_RULE or tgt_dialect not in DIALECT_LIST_RULE):
+            mode = "rule"
+        else:
+            mode = "direct"
+    else:
+        mode = "local_to_global"
 
-    with app.app_context():
+    def run():
         translator = Translator(
             model_name=model_name,
             src_sql=src_sql,
@@ -174,14 +199,21 @@ def translate(
             top_k=top_k
         )
 
-        if not target_db_config or (not vector_config or not vector_config.get("src_kb_name", None) or
-                                    not vector_config.get("tgt_kb_name", None)):
-            if not model_name and (src_dialect in DIALECT_LIST_RULE or tgt_dialect not in DIALECT_LIST_RULE):
+        try:
+            if mode == "rule":
                 return translator.rule_rewrite()
-            else:
+            elif mode == "direct":
                 return translator.direct_rewrite()
-        else:
-            return translator.local_to_global_rewrite(max_retry_time=max_retry_time)
+            else:
+                return translator.local_to_global_rewrite(max_retry_time=max_retry_time)
+        finally:
+            translator.close_out_file()
+
+    # Rule translation only needs sqlglot, neither the application nor the models are loaded
+    if mode == "rule" and not vector_config:
+        return run()
+    with get_app().app_context():
+        return run()
 
 
 def initkb(config_file_path: Optional[str] = None) -> bool:
@@ -198,6 +230,7 @@ def initkb(config_file_path: Optional[str] = None) -> bool:
         if config_file_path is None:
             raise ValueError("config_file_path is required")
 
+        from init_knowledge_base import initialize_kb
         initialize_kb(config_file_path)
         return True
     except Exception as e:
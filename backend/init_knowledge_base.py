@@ -6,21 +6,26 @@ Used to create knowledge base and import knowledge files
 """
 
 import os
-import json
 import yaml
 import time
 import argparse
 import subprocess
 import sys
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
 # Import application context
 from app_factory import create_app
 from config.db_config import db, db_session_manager
 from models import KnowledgeBase, JSONContent, LLMModel
-from api.services.knowledge import create_knowledge_base, add_kb_items
+from api.services.knowledge import create_knowledge_base, import_kb_items
 from config.logging_config import logger
-from llm_model.embeddings import get_embeddings
-from vector_store.chroma_store import ChromaStore
-import asyncio
+from llm_model.embeddings import embedding_manager, embedding_service
+from utils.columnar_kb import is_columnar_kb, open_columnar_kb
+from utils.json_stream import iter_json_array
+from utils.constants import VECTORIZE_CHUNK_SIZE, VECTORIZE_WORKERS, VECTORIZE_MAX_IN_FLIGHT
+from vector_store.base import get_vector_store, make_vector_metadata
 from sqlalchemy.exc import OperationalError, ProgrammingError
 from sqlalchemy import text, inspect
 
@@ -281,26 +286,20 @@ def import_knowledge_file(kb_name, file_path):
         return False
 
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            try:
-                items = json.load(f)
-            except json.JSONDecodeError as e:
-                logger.error(f"JSON parsing error: {str(e)}")
-                return False
-
-        if not isinstance(items, list):
-            logger.error(f"JSON content must be in array format, current format: {type(items).__name__}")
-            return False
-
-        if len(items) == 0:
-            logger.warning(f"No knowledge entries in file {file_path}")
-            return True
-
-        # Add knowledge entries
-        result = add_kb_items(kb_name, items)
+        # Either a JSON array, streamed item by item, or its columnar conversion (see utils/columnar_kb.py)
+        if is_columnar_kb(file_path):
+            result = import_kb_items(kb_name, iter(open_columnar_kb(file_path)))
+        else:
+            with open(file_path, "r", encoding="utf-8") as rf:
+                result = import_kb_items(kb_name, iter_json_array(rf))
 
         if result.get('status'):
-            logger.info(f"Successfully imported {len(items)} knowledge entries")
+            data = result.get('data', {})
+            if data.get('added', 0) + data.get('skipped', 0) == 0:
+                logger.warning(f"No knowledge entries in file {file_path}")
+            else:
+                logger.info(f"Successfully imported {data.get('added')} knowledge entries, "
+                            f"skipped {data.get('skipped')} duplicates")
             return True
         else:
             logger.error(f"Import failed: {result.get('message', 'Unknown error')}")
@@ -311,113 +310,133 @@ def import_knowledge_file(kb_name, file_path):
         return False
 
 
+def read_pending_chunks(kb_id, chunk_size):
+    """Yield the pending entries of the knowledge base in chunks of rows, ordered by id"""
+    last_id = 0
+    while True:
+        # Keyset pagination, the entries of earlier chunks may still be pending while they are embedded
+        chunk = db.session.query(
+            JSONContent.id, JSONContent.content_type, JSONContent.embedding_text, JSONContent.content,
+            JSONContent.content_hash
+        ).filter(
+            JSONContent.knowledge_base_id == kb_id,
+            JSONContent.status == "pending",
+            JSONContent.id > last_id
+        ).order_by(JSONContent.id).limit(chunk_size).all()
+        if len(chunk) == 0:
+            return
+        last_id = chunk[-1].id
+        yield chunk
+
+
+def mark_chunk_failed(chunk, error_msg):
+    db.session.bulk_update_mappings(JSONContent, [
+        {"id": row.id, "status": "failed", "error_msg": error_msg} for row in chunk
+    ])
+    db.session.commit()
+
+
+def write_chunk(store, kb, chunk, embeddings, model_version):
+    """Write one embedded chunk to the vector database and checkpoint its entries as completed"""
+    if len(embeddings) != len(chunk):
+        raise ValueError(f"Got {len(embeddings)} vectors for {len(chunk)} knowledge entries")
+    embeddings = embeddings.tolist()
+    rows_by_type = {}
+    for row, embedding in zip(chunk, embeddings):
+        rows_by_type.setdefault(row.content_type, []).append((row, embedding))
+
+    for content_type, rows in rows_by_type.items():
+        # Upsert so that a chunk written before an interruption but not yet checkpointed is rewritten
+        store.add_texts(
+            kb_name=kb.kb_name,
+            content_type=content_type,
+            texts=[row.embedding_text for row, _ in rows],
+            embeddings=[embedding for _, embedding in rows],
+            metadatas=[make_vector_metadata(row.id, kb.id, row.content_type, row.content, row.content_hash,
+                                            model_version) for row, _ in rows],
+            ids=[f"{row.id}_{content_type}" for row, _ in rows],
+            upsert=True
+        )
+
+    db.session.bulk_update_mappings(JSONContent, [
+        {"id": row.id, "vector_id": f"{row.id}_{row.content_type}", "status": "completed", "error_msg": None}
+        for row in chunk
+    ])
+    db.session.commit()
+
+
 @db_session_manager
-def vectorize_pending_items(kb_name):
-    """Vectorize pending knowledge entries"""
+def vectorize_pending_items(kb_name, chunk_size=VECTORIZE_CHUNK_SIZE, max_workers=VECTORIZE_WORKERS,
+                            max_in_flight=VECTORIZE_MAX_IN_FLIGHT):
+    """
+    Vectorize pending knowledge entries
+
+    Chunks of pending entries are embedded concurrently by a pool of worker threads, while the
+    embedded chunks are written to the vector database in order and checkpointed as completed,
+    so that an interrupted run resumes with the entries still pending.
+    """
     # Get knowledge base
     kb = db.session.query(KnowledgeBase).filter_by(kb_name=kb_name).first()
     if not kb:
         logger.error(f"Knowledge base does not exist: {kb_name}")
         return False
 
-    # Get pending entries
-    pending_items = db.session.query(JSONContent).filter_by(
-        knowledge_base_id=kb.id,
-        status="pending"
-    ).all()
-
-    if not pending_items:
+    pending_cnt = db.session.query(JSONContent).filter_by(knowledge_base_id=kb.id, status="pending").count()
+    if pending_cnt == 0:
         logger.info("No pending knowledge entries")
         return True
 
-    logger.info(f"Starting vectorization of {len(pending_items)} knowledge entries")
+    logger.info(f"Starting vectorization of {pending_cnt} knowledge entries")
 
-    # Group by content type
-    items_by_type = {}
-    for item in pending_items:
-        if item.content_type not in items_by_type:
-            items_by_type[item.content_type] = []
-        items_by_type[item.content_type].append(item)
+    # Load the model in the application context, the workers only run the embedding
+    embedding_manager.get_embedding(kb.embedding_model_name)
+    model_version = embedding_manager.get_model_version(kb.embedding_model_name)
+    store = get_vector_store()
 
-    # Create Chroma storage
-    store = ChromaStore()
+    def embed_chunk(chunk):
+        return embedding_service.embed([row.embedding_text for row in chunk], kb.embedding_model_name)
 
-    # Process each type of entry
-    for content_type, items in items_by_type.items():
-        try:
-            # Get embedding text
-            texts = [item.embedding_text for item in items]
-
-            # Generate vectors
-            try:
-                embeddings = asyncio.run(get_embeddings(texts, kb.embedding_model_name))
-            except Exception as e:
-                logger.error(f"Failed to generate vectors: {str(e)}")
-                # Update failure status
-                for item in items:
-                    item.status = "failed"
-                    item.error_msg = f"Failed to generate vectors: {str(e)}"
-                db.session.commit()
-                continue
-
-            # Prepare metadata
-            metadatas = []
-            ids = []
-
-            for i, item in enumerate(items):
-                # Generate vector ID
-                vector_id = f"{item.id}_{content_type}"
-
-                # Update database record
-                item.vector_id = vector_id
-                item.status = "completed"
-
-                # Prepare metadata
-                metadata = {
-                    'content_id': str(item.id),
-                    'knowledge_base_id': str(kb.id),
-                    'content_type': item.content_type,
-                    'content': json.dumps(item.content)
-                }
-                metadatas.append(metadata)
-                ids.append(vector_id)
-
-            # Add to vector database
-            try:
-                store.add_texts(
-                    kb_name=kb_name,
-                    content_type=content_type,
-                    texts=texts,
-                    embeddings=embeddings,
-                    metadatas=metadatas,
-                    ids=ids
-                )
-            except Exception as e:
-                logger.error(f"Failed to add vectors to vector database: {str(e)}")
-                # Update failure status
-                for item in items:
-                    item.status = "failed"
-                    item.error_msg = f"Failed to add vectors to vector database: {str(e)}"
-                db.session.commit()
-                continue
-
-            # Commit database changes
-            db.session.commit()
-
-            logger.info(f"Successfully vectorized {len(items)} knowledge entries of type {content_type}")
+    completed, failed = 0, 0
 
+    def write_next(futures):
+        nonlocal completed, failed
+        chunk, future = futures.popleft()
+        try:
+            embeddings = future.result()
+        except Exception as e:
+            logger.error(f"Failed to generate vectors: {str(e)}")
+            mark_chunk_failed(chunk, f"Failed to generate vectors: {str(e)}")
+            failed += len(chunk)
+            return
+        try:
+            write_chunk(store, kb, chunk, embeddings, model_version)
         except Exception as e:
             db.session.rollback()
-            logger.error(f"Failed to vectorize knowledge entries of type {content_type}: {str(e)}")
-
-            # Update failure status
-            for item in items:
-                item.status = "failed"
-                item.error_msg = str(e)
-            db.session.commit()
-
-            return False
+            logger.error(f"Failed to add vectors to vector database: {str(e)}")
+            mark_chunk_failed(chunk, f"Failed to add vectors to vector database: {str(e)}")
+            failed += len(chunk)
+            return
+        completed += len(chunk)
+        logger.info(f"Vectorized {completed}/{pending_cnt} knowledge entries of {kb_name}")
+
+    max_in_flight = max(max_in_flight, max_workers)
+    futures = deque()
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="vectorize") as executor:
+            for chunk in read_pending_chunks(kb.id, chunk_size):
+                # Writing the oldest chunk overlaps with the embedding of the chunks in flight
+                if len(futures) >= max_in_flight:
+                    write_next(futures)
+                futures.append((chunk, executor.submit(embed_chunk, chunk)))
+            while futures:
+                write_next(futures)
+    except Exception as e:
+        db.session.rollback()
+        # The checkpointed chunks are kept, the other entries stay pending for the next run
+        logger.error(f"Failed to vectorize knowledge entries of {kb_name}: {str(e)}")
+        return False
 
+    logger.info(f"Vectorization of {kb_name} finished: {completed} completed, {failed} failed")
     return True
 
 
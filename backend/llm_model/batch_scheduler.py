@@ -0,0 +1,139 @@
+import time
+import queue
+import threading
+
+from concurrent.futures import Future
+from typing import Any, Callable, Hashable, List
+
+from config.logging_config import logger
+from utils.constants import LLM_BATCH_MAX_SIZE, LLM_BATCH_WINDOW
+
+
+class BatchScheduler:
+    """Collect concurrent requests into batches run one after another by a worker thread"""
+
+    def __init__(self, run_batch: Callable[[Hashable, List[Any]], List[Any]],
+                 max_batch_size: int = LLM_BATCH_MAX_SIZE, batch_window: float = LLM_BATCH_WINDOW,
+                 name: str = "batch-scheduler"):
+        """
+        Initialize BatchScheduler
+
+        Args:
+            run_batch: Function called with a batch key and the requests of the batch, returning one result per request
+            max_batch_size: Maximal number of requests in one batch
+            batch_window: Time (seconds) waited for more requests once the first request of a batch arrived
+            name: Name of the worker thread
+        """
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.batch_window = batch_window
+        self.name = name
+        self.batch_cnt = 0
+        self.request_cnt = 0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def submit(self, request: Any, key: Hashable = None) -> Future:
+        """
+        Queue one request, only requests with the same key (e.g., the same generation parameters) share a batch
+
+        :return: Future resolved with the result of the request
+        """
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError(f"{self.name} is closed")
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._work, name=self.name, daemon=True)
+                self._thread.start()
+            self._queue.put((key, request, future))
+        return future
+
+    def _collect(self) -> list:
+        item = self._queue.get()
+        if item is None:
+            return []
+        items = [item]
+        deadline = time.monotonic() + self.batch_window
+        while len(items) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is None:
+                # Close after the collected requests are served
+                self._queue.put(None)
+                break
+            items.append(item)
+        return items
+
+    def _work(self):
+        while True:
+            items = self._collect()
+            if len(items) == 0:
+                return
+            # Requests arriving while a batch runs are queued and form the next batch
+            groups = {}
+            for key, request, future in items:
+                if future.set_running_or_notify_cancel():
+                    groups.setdefault(key, []).append((request, future))
+            for key, group in groups.items():
+                self._run_group(key, group)
+
+    def _run_group(self, key: Hashable, group: list):
+        self.batch_cnt += 1
+        self.request_cnt += len(group)
+        try:
+            results = self.run_batch(key, [request for request, _ in group])
+        except Exception as e:
+            logger.error(f"{self.name} batch of {len(group)} requests failed: {str(e)}")
+            for _, future in group:
+                future.set_exception(e)
+            return
+        if len(results) != len(group):
+            e = RuntimeError(f"{self.name} got {len(results)} results for a batch of {len(group)} requests")
+            for _, future in group:
+                future.set_exception(e)
+            return
+        for (_, future), result in zip(group, results):
+            future.set_result(result)
+
+    def close(self):
+        """Stop the worker thread once the queued requests are served"""
+        with self._lock:
+            self._closed = True
+            if self._thread is not None:
+                self._queue.put(None)
+                self._thread.join()
+                self._thread = None
+
+    def stats(self) -> dict:
+        return {"batches": self.batch_cnt, "requests": self.request_cnt,
+                "avg_batch_size": self.request_cnt / self.batch_cnt if self.batch_cnt else 0.0}
+
+
+def enable_pipeline_batching(pipeline):
+    """Pad the prompts of a text-generation pipeline on the left so that they can be generated in one batch"""
+    tokenizer = pipeline.tokenizer
+    if tokenizer.pad_token_id is None:
+        eos_token_id = pipeline.model.config.eos_token_id
+        tokenizer.pad_token_id = eos_token_id[0] if isinstance(eos_token_id, list) else eos_token_id
+    tokenizer.padding_side = "left"
+    return pipeline
+
+
+def run_pipeline_batch(pipeline, conversations: List[list], **generate_kwargs) -> List[dict]:
+    """Generate the conversations as one padded batch, return the generated message of each conversation"""
+    outputs = pipeline(conversations, batch_size=len(conversations), **generate_kwargs)
+    res = []
+    for output in outputs:
+        # One list of generated sequences per conversation
+        if isinstance(output, list):
+            output = output[0]
+        res.append(output["generated_text"][-1])
+    return res
@@ -0,0 +1,205 @@
+import os
+import re
+import json
+import fcntl
+import hashlib
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+from typing import List, Optional
+
+from config.logging_config import logger
+from utils.constants import EMBEDDING_CACHE_DIR, EMBEDDING_CACHE_SIZE
+from utils.lru_cache import LRUCache
+
+
+def get_text_hash(text: str) -> str:
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+class EmbeddingDiskStore:
+    """Append-only on-disk embeddings of one model, vectors are float32 rows of a memory-mapped file
+
+    The store is shared by the processes using the cache directory: appends are serialized by a file
+    lock, each key record names the row of its vector, and the records appended by the other processes
+    are read when a key is missing.
+    """
+
+    def __init__(self, path: str):
+        """
+        Initialize EmbeddingDiskStore
+
+        Args:
+            path: Directory of the store, holding meta.json, vectors.f32, keys.txt ("<text hash> <row>" lines)
+                and the lock file of the appends
+        """
+        self.path = path
+        self.meta_file = os.path.join(path, "meta.json")
+        self.vector_file = os.path.join(path, "vectors.f32")
+        self.key_file = os.path.join(path, "keys.txt")
+        self.lock_file = os.path.join(path, "append.lock")
+        self.dimension = None
+        # text hash -> row in vector_file
+        self.rows = {}
+        # Bytes of key_file already read
+        self._key_offset = 0
+        self._vectors = None
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        self._load()
+
+    @contextmanager
+    def _file_lock(self):
+        with open(self.lock_file, "a") as lf:
+            fcntl.flock(lf, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lf, fcntl.LOCK_UN)
+
+    def _row_cnt(self) -> int:
+        return os.path.getsize(self.vector_file) // (4 * self.dimension) if os.path.isfile(self.vector_file) else 0
+
+    def _load(self):
+        """Read the key records appended since the last call, by this or another process"""
+        if self.dimension is None:
+            if not os.path.isfile(self.meta_file):
+                return
+            with open(self.meta_file, "r") as rf:
+                self.dimension = json.load(rf)["dimension"]
+        if not os.path.isfile(self.key_file) or os.path.getsize(self.key_file) == self._key_offset:
+            return
+        with open(self.key_file, "rb") as rf:
+            rf.seek(self._key_offset)
+            data = rf.read()
+        # A record is complete once its newline is written
+        end = data.rfind(b"\n") + 1
+        # The vectors are written before their keys, so the rows of the complete records exist
+        row_cnt = self._row_cnt()
+        for line in data[:end].decode("utf-8", errors="ignore").splitlines():
+            fields = line.split()
+            # Records torn by a crash are skipped
+            if len(fields) == 2 and fields[1].isdigit() and int(fields[1]) < row_cnt:
+                self.rows[fields[0]] = int(fields[1])
+        self._key_offset += end
+
+    def _map(self):
+        row_cnt = self._row_cnt()
+        if row_cnt == 0:
+            self._vectors = None
+        else:
+            self._vectors = np.memmap(self.vector_file, dtype=np.float32, mode="r", shape=(row_cnt, self.dimension))
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        with self._lock:
+            row = self.rows.get(key)
+            if row is None:
+                # The key may have been written by another process
+                self._load()
+                row = self.rows.get(key)
+                if row is None:
+                    return None
+            if self._vectors is None or row >= self._vectors.shape[0]:
+                self._map()
+            return np.array(self._vectors[row])
+
+    def put_many(self, keys: List[str], vectors: np.ndarray):
+        with self._lock, self._file_lock():
+            self._load()
+            if self.dimension is None:
+                self.dimension = int(vectors.shape[1])
+                tmp_file = f"{self.meta_file}.{os.getpid()}.tmp"
+                with open(tmp_file, "w") as wf:
+                    json.dump({"dimension": self.dimension}, wf)
+                os.replace(tmp_file, self.meta_file)
+            if vectors.shape[1] != self.dimension:
+                logger.error(f"Embedding dimension {vectors.shape[1]} does not match the cache of {self.path}")
+                return
+            new_keys, new_vectors = [], []
+            seen = set()
+            for key, vector in zip(keys, vectors):
+                if key not in self.rows and key not in seen:
+                    seen.add(key)
+                    new_keys.append(key)
+                    new_vectors.append(vector)
+            if len(new_keys) == 0:
+                return
+
+            # The rows are numbered by the vector file, which every process appends to
+            row_size = 4 * self.dimension
+            size = os.path.getsize(self.vector_file) if os.path.isfile(self.vector_file) else 0
+            with open(self.vector_file, "ab") as wf:
+                # A row torn by a crash is padded, the new rows start at the next row boundary
+                wf.write(b"\x00" * (-size % row_size))
+                wf.write(np.asarray(new_vectors, dtype=np.float32).tobytes())
+            first_row = (size + row_size - 1) // row_size
+
+            # The vectors are written before their keys, a key is only valid once its vector exists
+            with open(self.key_file, "ab") as wf:
+                if wf.tell() != 0:
+                    with open(self.key_file, "rb") as rf:
+                        rf.seek(-1, os.SEEK_END)
+                        if rf.read(1) != b"\n":
+                            # End the record torn by a crash, it is skipped when read
+                            wf.write(b"\n")
+                wf.write("".join(f"{key} {first_row + i}\n" for i, key in enumerate(new_keys)).encode("utf-8"))
+            for i, key in enumerate(new_keys):
+                self.rows[key] = first_row + i
+
+
+class EmbeddingCache:
+    """Two-level embedding cache keyed by (model name, text hash): an in-memory LRU over on-disk stores"""
+
+    def __init__(self, cache_dir: str = EMBEDDING_CACHE_DIR, memory_size: int = EMBEDDING_CACHE_SIZE):
+        self.cache_dir = cache_dir
+        self.memory = LRUCache(maxsize=memory_size)
+        self.disk_hits = 0
+        self._stores = {}
+        self._lock = threading.Lock()
+
+    def _get_store(self, model_name: str) -> EmbeddingDiskStore:
+        store = self._stores.get(model_name)
+        if store is None:
+            with self._lock:
+                store = self._stores.get(model_name)
+                if store is None:
+                    name_hash = hashlib.md5(model_name.encode('utf-8')).hexdigest()[:8]
+                    safe_name = re.sub(r'[^a-zA-Z0-9]', '_', model_name)
+                    store = EmbeddingDiskStore(os.path.join(self.cache_dir, f"{safe_name}_{name_hash}"))
+                    self._stores[model_name] = store
+        return store
+
+    def get_many(self, model_name: str, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """Return the cached vector of each text, None if it is not cached"""
+        store = self._get_store(model_name)
+        res = []
+        for text in texts:
+            key = get_text_hash(text)
+            vector = self.memory.get((model_name, key))
+            if vector is None:
+                vector = store.get(key)
+                if vector is not None:
+                    self.disk_hits += 1
+                    self.memory.put((model_name, key), vector)
+            res.append(vector)
+        return res
+
+    def put_many(self, model_name: str, texts: List[str], vectors: np.ndarray):
+        keys = [get_text_hash(text) for text in texts]
+        vectors = np.asarray(vectors, dtype=np.float32)
+        for key, vector in zip(keys, vectors):
+            self.memory.put((model_name, key), vector)
+        try:
+            self._get_store(model_name).put_many(keys, vectors)
+        except OSError as e:
+            logger.error(f"Failed to write embedding cache: {str(e)}")
+
+    def stats(self) -> dict:
+        res = self.memory.stats()
+        res["disk_hits"] = self.disk_hits
+        return res
+
+
+# Global embedding cache instance
+embedding_cache = EmbeddingCache()
@@ -1,3 +1,4 @@
+import hashlib
 import numpy as np
 from typing import List, Union, Optional, Dict
 from langchain_openai import OpenAIEmbeddings
@@ -7,6 +8,18 @@ from tenacity import retry, stop_after_attempt, wait_random_exponential
 from models import LLMModel
 from config.db_config import db, db_session_manager
 from config.logging_config import logger
+from llm_model.embedding_cache import embedding_cache
+from utils.async_runner import AsyncLoopRunner
+from utils.constants import EMBEDDING_CACHE_ON
+
+
+def get_config_version(model_config: Dict) -> str:
+    """Model name and a digest of the configuration the vectors of the model depend on"""
+    source = model_config.get('api_base') if model_config.get('deployment_type') == 'cloud' \
+        else model_config.get('model_path')
+    digest = hashlib.md5(f"{model_config.get('deployment_type')}|{source}|{model_config.get('dimension')}"
+                         .encode('utf-8')).hexdigest()
+    return f"{model_config['name']}@{digest[:8]}"
 
 
 class EmbeddingManager:
@@ -14,6 +27,8 @@ class EmbeddingManager:
 
     def __init__(self):
         self._embeddings = {}
+        # model name -> version of the configuration the loaded instance was built from
+        self._versions = {}
 
     @db_session_manager
     def get_embedding_config_from_db(self, model_name: str):
@@ -23,6 +38,8 @@ class EmbeddingManager:
         config = db.session.query(LLMModel).filter_by(name=model_name,
                                                       category='embedding',
                                                       is_active=True).first()
+        if config is None:
+            raise ValueError(f"Embedding model does not exist or is not enabled: {model_name}")
 
         return {
             'name': config.name,
@@ -33,6 +50,20 @@ class EmbeddingManager:
             'dimension': config.dimension
         }
     
+    def get_model_version(self, model_name: str) -> str:
+        """
+        Version of the vectors of the model, stored with them to tell which ones must be re-embedded
+        Args:
+            model_name: Model name
+        Returns:
+            str: Model name and a digest of the configuration the vectors depend on
+        """
+        return get_config_version(self.get_embedding_config_from_db(model_name))
+
+    def get_loaded_version(self, model_name: str) -> Optional[str]:
+        """Version of the loaded instance of the model, None if it is not loaded"""
+        return self._versions.get(model_name)
+
     def release_embedding(self, model_name: str):
         """Release Embedding model"""
         if model_name in self._embeddings:
@@ -48,6 +79,7 @@ class EmbeddingManager:
                 
                 # OpenAI models don't need special release operations
                 del self._embeddings[model_name]
+                self._versions.pop(model_name, None)
                 
             except Exception as e:
                 logger.error(f"Failed to release Embedding model {model_name}: {str(e)}")
@@ -104,6 +136,7 @@ class EmbeddingManager:
                     encode_kwargs={'normalize_embeddings': True}
                 )
             self._embeddings[model_config['name']] = embedding
+            self._versions[model_config['name']] = get_config_version(model_config)
             logger.info(f"Successfully loaded Embedding model: {model_config['name']}")
         except Exception as e:
             logger.error(f"Failed to load Embedding model {model_config['name']}: {str(e)}")
@@ -140,6 +173,21 @@ async def _get_embeddings_with_context(text: Union[str, List[str]], model_name:
     if not embedding_model:
         raise ValueError(f"Embedding model does not exist or is not enabled: {model_name}")
     try:
+        if EMBEDDING_CACHE_ON:
+            # Keyed by the version of the loaded model, a model reconfigured under the same name gets a new cache
+            cache_name = embedding_manager.get_loaded_version(model_name) or model_name
+            texts = [text] if isinstance(text, str) else text
+            embeddings = embedding_cache.get_many(cache_name, texts)
+            miss_texts = list(dict.fromkeys(t for t, e in zip(texts, embeddings) if e is None))
+            if len(miss_texts) != 0:
+                miss_embeddings = await embedding_model.aembed_documents(miss_texts)
+                embedding_cache.put_many(cache_name, miss_texts, miss_embeddings)
+                miss_map = dict(zip(miss_texts, np.asarray(miss_embeddings, dtype=np.float32)))
+                embeddings = [e if e is not None else miss_map[t] for t, e in zip(texts, embeddings)]
+            if isinstance(text, str):
+                return embeddings[0]
+            return np.array(embeddings)
+
         # Use LangChain's embed_query/embed_documents methods
         if isinstance(text, str):
             embedding = await embedding_model.aembed_query(text)
@@ -149,3 +197,28 @@ async def _get_embeddings_with_context(text: Union[str, List[str]], model_name:
     except Exception as e:
         logger.error(f"Failed to generate Embedding: {str(e)}")
         raise
+
+
+class EmbeddingService(AsyncLoopRunner):
+    """Run the embedding coroutines on one event loop living in a background thread"""
+
+    def __init__(self):
+        super().__init__(name="embedding-loop")
+
+    def embed(self, text: Union[str, List[str]], model_name: str,
+              model_config: Optional[Dict] = None) -> np.ndarray:
+        """
+        Synchronous counterpart of get_embeddings, a list of texts is embedded in one batch
+        Args:
+            text: Input text or list of texts
+            model_name: Model name
+        Returns:
+            numpy.ndarray: Vector or list of vectors
+        """
+        # Load the model in the application context of the caller
+        embedding_manager.get_embedding(model_name, model_config)
+        return self.run(get_embeddings(text, model_name, model_config=model_config))
+
+
+# Global embedding service instance
+embedding_service = EmbeddingService()
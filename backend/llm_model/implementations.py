@@ -1,15 +1,53 @@
 # backend/llm_model/implementations.py
 
 import json
+import time
+import random
+import asyncio
+import httpx
 import openai
 from threading import Thread
 from typing import Dict, Any, List, Union, AsyncGenerator
 from langchain.schema import SystemMessage, HumanMessage
-from transformers import pipeline
 
 from llm_model.base import BaseLLM
+from llm_model.batch_scheduler import BatchScheduler, enable_pipeline_batching, run_pipeline_batch
 from config.logging_config import logger
-from utils.constants import MAX_TOKENS_DEFAULT, TEMPERATURE_DEFAULT
+from utils.async_runner import AsyncLoopRunner
+from utils.constants import MAX_TOKENS_DEFAULT, TEMPERATURE_DEFAULT, CLOUD_LLM_ASYNC, CLOUD_LLM_MAX_CONCURRENCY, \
+    CLOUD_LLM_RPM, CLOUD_LLM_MAX_CONNECTIONS
+
+# Event loop shared by the synchronous callers of CloudLLM.chat
+llm_runner = AsyncLoopRunner(name="llm-loop")
+
+
+class TokenBucket:
+    """Asynchronous token bucket limiting the request rate"""
+
+    def __init__(self, rate: float, capacity: float):
+        """
+        Initialize TokenBucket
+
+        Args:
+            rate: Tokens added per second
+            capacity: Maximal number of tokens, i.e., the allowed burst
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, tokens: float = 1):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self.tokens) / self.rate)
 
 
 class CloudLLM(BaseLLM):
@@ -19,6 +57,24 @@ class CloudLLM(BaseLLM):
         super().__init__(model_config)  # Call parent constructor first
         self.llm = openai.OpenAI(api_key=self.model_config.get('api_key'),
                                  base_url=self.model_config.get('api_base'))
+        # event loop -> (async client, in-flight semaphore, rate limiter) of the model
+        self._async_states = {}
+
+    def _get_async_state(self):
+        loop = asyncio.get_running_loop()
+        state = self._async_states.get(loop)
+        if state is None:
+            rpm = self.model_config.get('rpm') or CLOUD_LLM_RPM
+            max_concurrency = self.model_config.get('max_concurrency') or CLOUD_LLM_MAX_CONCURRENCY
+            client = openai.AsyncOpenAI(
+                api_key=self.model_config.get('api_key'),
+                base_url=self.model_config.get('api_base'),
+                http_client=httpx.AsyncClient(limits=httpx.Limits(max_connections=CLOUD_LLM_MAX_CONNECTIONS,
+                                                                  max_keepalive_connections=CLOUD_LLM_MAX_CONNECTIONS))
+            )
+            state = (client, asyncio.Semaphore(max_concurrency), TokenBucket(rpm / 60, max_concurrency))
+            self._async_states[loop] = state
+        return state
 
     def validate_config(self) -> bool:
         """Validate model configuration"""
@@ -28,14 +84,8 @@ class CloudLLM(BaseLLM):
                 raise ValueError(f"Missing required configuration item: {field}")
         return True
 
-    def chat(self, messages: List[Union[SystemMessage, HumanMessage]], **kwargs) -> str:
-        """Chat with the model using OpenAI API"""
-        import time
-        import random
-
-        max_retries = kwargs.get('max_retries', 5)
-        base_delay = kwargs.get('base_delay', 3)  # 基础延迟时间（秒）
-
+    @staticmethod
+    def _to_openai_messages(messages: List[Union[SystemMessage, HumanMessage]]) -> List[Dict]:
         # 将LangChain消息格式转换为OpenAI格式
         openai_messages = []
         for msg in messages:
@@ -47,6 +97,64 @@ class CloudLLM(BaseLLM):
                 openai_messages.append(msg)
             else:
                 openai_messages.append({"role": "assistant", "content": msg.content})
+        return openai_messages
+
+    async def achat(self, messages: List[Union[SystemMessage, HumanMessage]], **kwargs) -> Dict:
+        """Chat with the model using the asynchronous OpenAI API
+
+        The requests of the model share one connection pool, at most max_concurrency of them are in flight
+        and they are started at no more than rpm per minute. Rate-limited requests back off without blocking
+        the event loop.
+        """
+        max_retries = kwargs.get('max_retries', 5)
+        base_delay = kwargs.get('base_delay', 3)  # 基础延迟时间（秒）
+
+        openai_messages = self._to_openai_messages(messages)
+        client, semaphore, bucket = self._get_async_state()
+
+        for attempt in range(max_retries):
+            if attempt > 0:
+                delay = base_delay * (2 ** attempt) + random.uniform(0, 1)
+                logger.info(
+                    f"Rate limit reached, retrying in {delay:.2f} seconds (attempt {attempt + 1}/{max_retries})...")
+                await asyncio.sleep(delay)
+            try:
+                async with semaphore:
+                    await bucket.acquire()
+                    completion = await client.chat.completions.create(
+                        model=self.model_config.get('name'),
+                        messages=openai_messages,
+                        max_tokens=self.model_config.get('max_tokens', MAX_TOKENS_DEFAULT),
+                        temperature=self.model_config.get('temperature', TEMPERATURE_DEFAULT)
+                    )
+                response = json.loads(completion.to_json())
+                response_format = {
+                    "role": response['choices'][0]['message']['role'],
+                    "content": response['choices'][0]['message']['content'],
+                    "raw": response
+                }
+                logger.info(f"Cloud LLM chat response: {response_format['content'][:100]}...")
+                return response_format
+
+            except openai.RateLimitError as e:
+                logger.warning(f"Rate limit error (attempt {attempt + 1}/{max_retries}): {str(e)}")
+                if attempt == max_retries - 1:  # 最后一次尝试
+                    logger.error(f"Max retries reached. Cloud LLM chat error: {str(e)}")
+                    raise
+            except Exception as e:
+                logger.error(f"Cloud LLM chat error: {str(e)}")
+                raise
+
+    def chat(self, messages: List[Union[SystemMessage, HumanMessage]], **kwargs) -> str:
+        """Chat with the model using OpenAI API"""
+        if CLOUD_LLM_ASYNC:
+            # Share the connection pool and the limits of the model with the other callers
+            return llm_runner.run(self.achat(messages, **kwargs))
+
+        max_retries = kwargs.get('max_retries', 5)
+        base_delay = kwargs.get('base_delay', 3)  # 基础延迟时间（秒）
+
+        openai_messages = self._to_openai_messages(messages)
 
         # 重试机制
         for attempt in range(max_retries):
@@ -85,9 +193,6 @@ class CloudLLM(BaseLLM):
 
     def generate(self, prompt: str, **kwargs) -> str:
         """Generate text"""
-        import time
-        import random
-
         max_retries = kwargs.get('max_retries', 3)
         base_delay = kwargs.get('base_delay', 2)  # 基础延迟时间（秒）
 
@@ -140,7 +245,7 @@ class LocalLLM(BaseLLM):
     def __init__(self, model_config: Dict[str, Any]):
         super().__init__(model_config)
         import torch
-        from transformers import AutoModelForCausalLM, AutoTokenizer, TextIteratorStreamer
+        from transformers import AutoModelForCausalLM, AutoTokenizer, TextIteratorStreamer, pipeline
         # Determine device
         if torch.cuda.is_available():
             device = "cuda"
@@ -167,11 +272,14 @@ class LocalLLM(BaseLLM):
                 torch_dtype=torch_dtype,
                 device_map="auto",
             )
+            enable_pipeline_batching(self.model)
 
             # Save configuration
             self.device = device
             self.max_tokens = self.model_config.get('max_tokens', MAX_TOKENS_DEFAULT)
             self.temperature = self.model_config.get('temperature', TEMPERATURE_DEFAULT)
+            # Concurrent chat requests are generated together in padded batches
+            self.scheduler = BatchScheduler(self._run_batch, name="local-llm-batch")
 
         except Exception as e:
             logger.error(f"Failed to load local model: {str(e)}")
@@ -179,6 +287,10 @@ class LocalLLM(BaseLLM):
 
     def release(self):
         """Release model resources"""
+        if getattr(self, 'scheduler', None) is not None:
+            self.scheduler.close()
+            self.scheduler = None
+
         if hasattr(self, 'model'):
             # Release CUDA memory
             import torch
@@ -207,11 +319,7 @@ class LocalLLM(BaseLLM):
             # Convert messages to format acceptable by the model
             prompt = self._format_messages(messages)
 
-            full_response = self.model(
-                messages,
-                max_new_tokens=self.max_tokens,
-            )
-            assistant_response = full_response[0]["generated_text"][-1]
+            assistant_response = self.scheduler.submit(messages, key=self.max_tokens).result()
             # logger.info(f"Local LLM chat response: {assistant_response['content'][:100]}...")
 
             # 构造与CloudLLM相同的返回格式
@@ -219,7 +327,7 @@ class LocalLLM(BaseLLM):
                 "role": "assistant",
                 "content": assistant_response['content'],
                 "raw": {
-                    "full_response": full_response,
+                    "full_response": assistant_response,
                     "model": self.model_config.get('model_path'),
                     "prompt": prompt
                 }
@@ -230,6 +338,9 @@ class LocalLLM(BaseLLM):
             logger.error(f"Local LLM chat error: {str(e)}")
             raise
 
+    def _run_batch(self, max_new_tokens: int, batch: List[list]) -> List[dict]:
+        return run_pipeline_batch(self.model, batch, max_new_tokens=max_new_tokens)
+
     def generate(self, prompt: str, **kwargs) -> str:
         """Generate text"""
         try:
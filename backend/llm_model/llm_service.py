@@ -6,17 +6,16 @@
 
 import time
 import uuid
+import asyncio
 import argparse
 
-import torch
-import transformers
-
 import uvicorn
 import tiktoken
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
 
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+from llm_model.batch_scheduler import BatchScheduler, enable_pipeline_batching, run_pipeline_batch
+from utils.constants import LLM_BATCH_MAX_SIZE, LLM_BATCH_WINDOW
 
 app = FastAPI()
 
@@ -39,6 +38,10 @@ class CompletionResponse(BaseModel):
 
 
 def init_model(model_id):
+    # torch and transformers are only needed once a model is served
+    import torch
+    import transformers
+
     pipeline = transformers.pipeline(
         "text-generation",
         model=model_id,
@@ -46,20 +49,24 @@ def init_model(model_id):
         device_map="auto"
     )
 
-    return pipeline
+    return enable_pipeline_batching(pipeline)
 
 
 def invoke_model(messages, max_new_tokens, do_sample, temperature):
+    return invoke_batch((max_new_tokens, do_sample, temperature), [messages])[0]
+
+
+def invoke_batch(params, batch):
+    """Generate a batch of conversations sharing the generation parameters in one padded forward pass"""
     global pipeline
 
-    outputs = pipeline(
-        messages,
-        max_new_tokens=max_new_tokens,
-        do_sample=do_sample,
-        temperature=temperature
-    )
+    max_new_tokens, do_sample, temperature = params
+    return run_pipeline_batch(pipeline, batch, max_new_tokens=max_new_tokens,
+                              do_sample=do_sample, temperature=temperature)
+
 
-    return outputs[0]["generated_text"][-1]
+# Concurrent requests are collected into batches generated by one worker thread off the event loop
+scheduler = None
 
 
 def calculate_usage(prompt: str, completion: str, model: str = "gpt-4o"):
@@ -78,8 +85,9 @@ def calculate_usage(prompt: str, completion: str, model: str = "gpt-4o"):
 @app.post("/v1/chat/completions", response_model=CompletionResponse)
 async def chat_completions_create(request: CompletionRequest):
     try:
-        output_message = invoke_model(request.messages, request.max_tokens,
-                                      request.do_sample, request.temperature)
+        future = scheduler.submit(request.messages,
+                                  key=(request.max_tokens, request.do_sample, request.temperature))
+        output_message = await asyncio.wrap_future(future)
 
         input_text = " ".join([msg["content"] for msg in request.messages if msg["content"]])
         output_text = output_message["content"]
@@ -114,6 +122,10 @@ def parse_args():
                         default='localhost', help='IP address of LLM service')
     parser.add_argument('--port', type=int,
                         help='Port of LLM service')
+    parser.add_argument('--max_batch_size', type=int,
+                        default=LLM_BATCH_MAX_SIZE, help='Maximal requests generated in one batch')
+    parser.add_argument('--batch_window', type=float,
+                        default=LLM_BATCH_WINDOW, help='Seconds waited for a batch to fill')
 
     return parser.parse_args()
 
@@ -122,5 +134,7 @@ if __name__ == "__main__":
     args = parse_args()
 
     pipeline = init_model(args.model_path)
+    scheduler = BatchScheduler(invoke_batch, max_batch_size=args.max_batch_size,
+                               batch_window=args.batch_window, name="llm-service-batch")
 
     uvicorn.run(app, host=args.host, port=args.port)
@@ -0,0 +1,145 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+from typing import Dict, List, Optional
+
+from config.logging_config import logger
+from utils.constants import LLM_CACHE_PATH, LLM_CACHE_TTL, LLM_CACHE_MAX_ENTRIES
+
+# Expired and surplus responses are evicted once every EVICT_INTERVAL stores
+EVICT_INTERVAL = 100
+
+
+def get_response_cache_key(messages: List[Dict], **params) -> str:
+    """Content address of a chat request: the role and content of the messages and the sampling parameters"""
+    # History messages may carry bookkeeping fields (e.g., time, raw response) that the model ignores
+    messages = [{"role": msg.get("role"), "content": msg.get("content")} if isinstance(msg, dict) else str(msg)
+                for msg in messages]
+    request = json.dumps({"messages": messages, "params": params}, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(request.encode('utf-8')).hexdigest()
+
+
+def get_cache_namespace(model_config: Dict) -> str:
+    """Model name and a digest of the configuration its responses depend on, a reconfigured model gets a new one"""
+    source = model_config.get('api_base') if model_config.get('deployment_type') == 'cloud' \
+        else model_config.get('model_path')
+    digest = hashlib.md5(f"{model_config.get('deployment_type')}|{source}".encode('utf-8')).hexdigest()
+    return f"{model_config.get('name')}@{digest[:8]}"
+
+
+class LLMResponseCache:
+    """On-disk cache of LLM chat responses, namespaced by model, with TTL and size-based eviction"""
+
+    def __init__(self, path: str = LLM_CACHE_PATH, ttl: float = LLM_CACHE_TTL,
+                 max_entries: int = LLM_CACHE_MAX_ENTRIES):
+        """
+        Initialize LLMResponseCache
+
+        Args:
+            path: SQLite file of the cache, created on first use
+            ttl: Time to live (seconds) of a response, responses never expire if None
+            max_entries: Maximum number of responses kept, the least recently used ones are evicted first
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # namespace -> {"hits": int, "misses": int, "stores": int}
+        self.metrics = {}
+        self._store_cnt = 0
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _get_conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS llm_response (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    response TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL,
+                    PRIMARY KEY (namespace, key)
+                )""")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_response_accessed_at "
+                               "ON llm_response (accessed_at)")
+            self._conn.commit()
+        return self._conn
+
+    def _count(self, namespace: str, name: str):
+        metric = self.metrics.setdefault(namespace, {"hits": 0, "misses": 0, "stores": 0})
+        metric[name] += 1
+
+    def get(self, namespace: str, key: str) -> Optional[Dict]:
+        """Return the cached response, None on miss or expiry"""
+        now = time.time()
+        with self._lock:
+            try:
+                conn = self._get_conn()
+                row = conn.execute("SELECT response, created_at FROM llm_response WHERE namespace = ? AND key = ?",
+                                   (namespace, key)).fetchone()
+                if row is not None and (self.ttl is None or row[1] + self.ttl > now):
+                    conn.execute("UPDATE llm_response SET accessed_at = ? WHERE namespace = ? AND key = ?",
+                                 (now, namespace, key))
+                    conn.commit()
+                    self._count(namespace, "hits")
+                    return json.loads(row[0])
+                if row is not None:
+                    conn.execute("DELETE FROM llm_response WHERE namespace = ? AND key = ?", (namespace, key))
+                    conn.commit()
+            except sqlite3.Error as e:
+                logger.error(f"Failed to read LLM response cache: {str(e)}")
+            self._count(namespace, "misses")
+            return None
+
+    def put(self, namespace: str, key: str, response: Dict):
+        now = time.time()
+        with self._lock:
+            try:
+                conn = self._get_conn()
+                conn.execute("INSERT OR REPLACE INTO llm_response VALUES (?, ?, ?, ?, ?)",
+                             (namespace, key, json.dumps(response, ensure_ascii=False, default=str), now, now))
+                self._count(namespace, "stores")
+                self._store_cnt += 1
+                if self._store_cnt % EVICT_INTERVAL == 0:
+                    self._evict(conn, now)
+                conn.commit()
+            except sqlite3.Error as e:
+                logger.error(f"Failed to write LLM response cache: {str(e)}")
+
+    def _evict(self, conn: sqlite3.Connection, now: float):
+        if self.ttl is not None:
+            conn.execute("DELETE FROM llm_response WHERE created_at <= ?", (now - self.ttl,))
+        conn.execute("""
+            DELETE FROM llm_response WHERE rowid IN (
+                SELECT rowid FROM llm_response ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+            )""", (self.max_entries,))
+
+    def clear(self, namespace: str = None):
+        """Remove the responses of namespace, all responses if namespace is None"""
+        with self._lock:
+            conn = self._get_conn()
+            if namespace is None:
+                conn.execute("DELETE FROM llm_response")
+            else:
+                conn.execute("DELETE FROM llm_response WHERE namespace = ?", (namespace,))
+            conn.commit()
+
+    def stats(self) -> dict:
+        """Return the hit/miss counters of each namespace"""
+        with self._lock:
+            res = {}
+            for namespace, metric in self.metrics.items():
+                total = metric["hits"] + metric["misses"]
+                res[namespace] = dict(metric, hit_rate=metric["hits"] / total if total else 0.0)
+            return res
+
+
+# Global LLM response cache instance
+llm_response_cache = LLMResponseCache()
@@ -103,6 +103,10 @@ class KnowledgeBase(db.Model, BaseModel):
 class JSONContent(db.Model, BaseModel):
     """JSON content table"""
     __tablename__ = 'json_contents'
+    __table_args__ = (
+        # Duplicate lookup of knowledge base imports
+        db.Index('idx_json_contents_kb_hash', 'knowledge_base_id', 'content_hash'),
+    )
 
     content = db.Column(db.Text, nullable=False, comment="JSON content")
     content_type = db.Column(db.String(32), nullable=False, comment="Content type: function/keyword/type/operator")
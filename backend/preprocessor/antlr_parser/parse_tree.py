@@ -1,19 +1,16 @@
+import hashlib
 import logging
 import sys
 
 from antlr4 import *
 from antlr4.error.ErrorListener import ErrorListener
 
-from preprocessor.antlr_parser.pg_parser.PostgreSQLParser import PostgreSQLParser
-from preprocessor.antlr_parser.pg_parser.PostgreSQLLexer import PostgreSQLLexer
+from utils.constants import DIALECT_LIST, PARSE_CACHE_SIZE
+from utils.lru_cache import LRUCache
 
-from preprocessor.antlr_parser.mysql_parser.MySqlParser import MySqlParser
-from preprocessor.antlr_parser.mysql_parser.MySqlLexer import MySqlLexer
-
-from preprocessor.antlr_parser.oracle_parser.PlSqlParser import PlSqlParser
-from preprocessor.antlr_parser.oracle_parser.PlSqlLexer import PlSqlLexer
-
-from utils.constants import DIALECT_LIST
+# Plain-data parse outcome filled by TreeNode.parse_sql, ANTLR trees keep their parser,
+# token stream and lexer alive so they are never cached themselves
+parse_cache = LRUCache(maxsize=PARSE_CACHE_SIZE)
 
 
 class CustomErrorListener(ErrorListener):
@@ -21,6 +18,33 @@ class CustomErrorListener(ErrorListener):
         raise SelfParseError(line, column, msg)
 
 
+def load_grammar(dialect: str):
+    """Import the generated (lexer, parser) of dialect on first use, each grammar takes seconds to load"""
+    if dialect == 'pg':
+        from preprocessor.antlr_parser.pg_parser.PostgreSQLParser import PostgreSQLParser
+        from preprocessor.antlr_parser.pg_parser.PostgreSQLLexer import PostgreSQLLexer
+        return PostgreSQLLexer, PostgreSQLParser
+    elif dialect == 'mysql':
+        from preprocessor.antlr_parser.mysql_parser.MySqlParser import MySqlParser
+        from preprocessor.antlr_parser.mysql_parser.MySqlLexer import MySqlLexer
+        return MySqlLexer, MySqlParser
+    elif dialect == 'oracle':
+        from preprocessor.antlr_parser.oracle_parser.PlSqlParser import PlSqlParser
+        from preprocessor.antlr_parser.oracle_parser.PlSqlLexer import PlSqlLexer
+        return PlSqlLexer, PlSqlParser
+    else:
+        raise ValueError(f"Only support {DIALECT_LIST}")
+
+
+def get_parse_cache_key(src_sql: str, dialect: str, *extra) -> str:
+    key = '\x00'.join([dialect, *[str(item) for item in extra], src_sql])
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def get_parse_cache_stats() -> dict:
+    return parse_cache.stats()
+
+
 def parse_tree(src_sql: str, dialect: str) -> (str, int, int, str):
     if dialect == 'pg':
         return parse_pg_tree(src_sql)
@@ -33,6 +57,7 @@ def parse_tree(src_sql: str, dialect: str) -> (str, int, int, str):
 
 
 def parse_pg_tree(src_sql: str) -> (str, int, int, str):
+    PostgreSQLLexer, PostgreSQLParser = load_grammar('pg')
     try:
         input_stream = InputStream(src_sql)
         lexer = PostgreSQLLexer(input_stream)
@@ -50,6 +75,7 @@ def parse_pg_tree(src_sql: str) -> (str, int, int, str):
 
 
 def parse_mysql_tree(src_sql: str):
+    MySqlLexer, MySqlParser = load_grammar('mysql')
     try:
         input_stream = InputStream(src_sql)
         lexer = MySqlLexer(input_stream)
@@ -67,6 +93,7 @@ def parse_mysql_tree(src_sql: str):
 
 
 def parse_oracle_tree(src_sql: str):
+    PlSqlLexer, PlSqlParser = load_grammar('oracle')
     try:
         input_stream = InputStream(src_sql)
         lexer = PlSqlLexer(input_stream)
@@ -84,21 +111,11 @@ def parse_oracle_tree(src_sql: str):
 
 
 def get_parser(dialect: str):
+    lexer_class, parser_class = load_grammar(dialect)
     input_stream = InputStream('')
-    if dialect == 'pg':
-        lexer = PostgreSQLLexer(input_stream)
-        stream = CommonTokenStream(lexer)
-        return PostgreSQLParser(stream)
-    elif dialect == 'mysql':
-        lexer = MySqlLexer(input_stream)
-        stream = CommonTokenStream(lexer)
-        return MySqlParser(stream)
-    elif dialect == 'oracle':
-        lexer = PlSqlLexer(input_stream)
-        stream = CommonTokenStream(lexer)
-        return PlSqlParser(stream)
-    else:
-        raise ValueError(f"Only support {DIALECT_LIST}")
+    lexer = lexer_class(input_stream)
+    stream = CommonTokenStream(lexer)
+    return parser_class(stream)
 
 
 class SelfParseError(Exception):
@@ -1,15 +1,69 @@
 import logging
 import sys
+from bisect import bisect_right
 
 from antlr4.tree.Tree import TerminalNodeImpl
 
-from utils.tools import self_split, remove_all_space
-from preprocessor.antlr_parser.parse_tree import get_parser
+from utils.tools import self_split
+from preprocessor.antlr_parser.parse_tree import get_parser, parse_tree, parse_cache, get_parse_cache_key
 
 parser_map = {}
 
 
+class SpanIndex:
+    """Source spans of the terminal leaves of a tree in a rendered SQL, sorted by offset"""
+
+    def __init__(self, root_node, sql: str):
+        """
+        Align the characters of the leaves with the non-space characters of sql
+        :param root_node: the root of the tree
+        :param sql: a rendering of the tree, which may differ from str(root_node) in whitespace only
+        """
+        self.sql = sql
+        # offsets of the non-space characters of sql
+        char_pos = [i for i, c in enumerate(sql) if not c.isspace()]
+        self.nodes = []
+        self.starts = []
+        self.ends = []
+        # offsets of the leaves in the sql without space, see remove_all_space
+        self.no_space_starts = []
+        leaf_strs = []
+        cur = 0
+        for leaf in TreeNode.get_leaves(root_node):
+            leaf_str = ''.join(leaf.value.split())
+            leaf_len = len(leaf_str)
+            if leaf_len == 0:
+                continue
+            assert cur + leaf_len <= len(char_pos)
+            leaf_strs.append(leaf_str)
+            self.nodes.append(leaf)
+            self.starts.append(char_pos[cur])
+            self.ends.append(char_pos[cur + leaf_len - 1] + 1)
+            self.no_space_starts.append(cur)
+            cur = cur + leaf_len
+        assert ''.join(leaf_strs) == ''.join(sql.split())
+
+    def locate(self, column: int):
+        """
+        Return the index of the leaf covering column of the sql,
+        the next leaf if column falls into the space between two leaves
+        """
+        i = bisect_right(self.starts, column) - 1
+        if i < 0:
+            return 0
+        if column >= self.ends[i] and i + 1 < len(self.nodes):
+            return i + 1
+        return i
+
+    def locate_no_space(self, column: int):
+        """Return the index of the leaf covering column of the sql without space"""
+        return max(bisect_right(self.no_space_starts, column) - 1, 0)
+
+
 class TreeNode:
+    __slots__ = ('_value', 'children', 'father', 'father_child_index', 'dialect', '_is_terminal', 'model_get',
+                 '_str_cache', '_span_index')
+
     def __init__(self, value: str, dialect: str, is_terminal: bool, father=None,
                  father_child_index=None, children=None, model_get=False):
         """
@@ -19,17 +73,45 @@ class TreeNode:
         :param father: the parent node
         :param children: the child node list (empty list by default)
         """
-        self.value = value.strip()
+        self._str_cache = None
+        self._span_index = None
+        self._value = value.strip()
         self.children = children if children is not None else []
-        self.child_link = {}
         self.father = father
         self.father_child_index = father_child_index
-        self.link = None
-        self.father_link = {}
         self.dialect = dialect
-        self.is_terminal = is_terminal
+        self._is_terminal = is_terminal
         self.model_get = model_get
 
+    @property
+    def value(self):
+        return self._value
+
+    @value.setter
+    def value(self, value: str):
+        self._value = value
+        self.invalidate_str()
+
+    @property
+    def is_terminal(self):
+        return self._is_terminal
+
+    @is_terminal.setter
+    def is_terminal(self, is_terminal: bool):
+        self._is_terminal = is_terminal
+        self.invalidate_str()
+
+    def invalidate_str(self):
+        """
+        Drop the cached rendering and source spans of this node and its ancestors,
+        to be called whenever the subtree is modified in place
+        """
+        node = self
+        while node is not None:
+            node._str_cache = None
+            node._span_index = None
+            node = node.father
+
     def to_tree_rep(self):
         if len(self.children) != 0:
             res = '(' + self.value
@@ -41,20 +123,23 @@ class TreeNode:
         return res
 
     def __str__(self):
+        if self._str_cache is None:
+            self._str_cache = self.render()
+        return self._str_cache
+
+    def render(self):
         if self.value == '<EOF>':
             return ''
-        res = ''
+        if self.is_terminal:
+            return self.value
+        res = []
         flag = False
         flag_paren = True
-        if self.is_terminal:
-            res = self.value
-            return res
         if self.dialect == 'mysql':
             if self.value in ['comparisonOperator', 'logicalOperator', 'bitOperator', 'multOperator', 'jsonOperator']:
                 for child in self.children:
-                    sub_str = str(child)
-                    res = res + sub_str.strip()
-                return res
+                    res.append(str(child).strip())
+                return ''.join(res)
             if (self.value == 'functionCall' and len(self.children) != 0
                     and (self.children[0].value == 'scalarFunctionName' or self.children[0].value == 'fullId')):
                 flag_paren = False
@@ -62,95 +147,73 @@ class TreeNode:
                   self.value == 'aggregateWindowedFunction' or self.value == 'nonAggregateWindowedFunction'):
                 flag_paren = False
             if not flag_paren:
-                for child in self.children:
-                    if child.is_terminal and child.value == '(':
-                        res = res + child.value
-                        flag = True
-                    else:
-                        sub_str = str(child)
-                        if sub_str.startswith('.') or res.endswith('.'):
-                            flag = False
-                        if sub_str != '':
-                            if flag:
-                                res = res + " " + sub_str.strip()
-                            else:
-                                res = res + sub_str
-                                flag = True
-                return res
+                return self.render_function()
         elif self.dialect == 'pg':
             if ((self.value == 'func_application' or self.value == 'func_expr_common_subexpr')
                     and len(self.children) != 0):
                 flag_paren = False
             if not flag_paren:
-                for child in self.children:
-                    if child.is_terminal and child.value == '(':
-                        res = res + child.value
-                        flag = True
-                    else:
-                        sub_str = str(child)
-                        if sub_str.startswith('.') or res.endswith('.'):
-                            flag = False
-                        if sub_str != '':
-                            if flag:
-                                res = res + " " + sub_str.strip()
-                            else:
-                                res = res + sub_str
-                                flag = True
-                return res
+                return self.render_function()
         elif self.dialect == 'oracle':
             if self.value in ['relational_operator']:
                 for child in self.children:
-                    sub_str = str(child)
-                    res = res + sub_str.strip()
-                return res
+                    res.append(str(child).strip())
+                return ''.join(res)
             if (self.value == 'string_function' or self.value == 'json_function'
                     or self.value == 'other_function' or self.value == 'numeric_function'):
                 flag_paren = False
             if not flag_paren:
-                for child in self.children:
-                    if child.is_terminal and child.value == '(':
-                        res = res + child.value
-                        flag = True
-                    else:
-                        sub_str = str(child)
-                        if sub_str.startswith('.') or res.endswith('.'):
-                            flag = False
-                        if sub_str != '':
-                            if flag:
-                                res = res + " " + sub_str.strip()
-                            else:
-                                res = res + sub_str
-                                flag = True
-                return res
+                return self.render_function()
             for child in self.children:
                 sub_str = str(child)
                 if sub_str.startswith('.'):
                     flag = False
                 if sub_str != '':
-                    if (flag and not res.endswith('.')
+                    if (flag and not res[-1].endswith('.')
                             and not child.value == 'function_argument'
                             and not child.value == 'function_argument_analytic'
                             and not child.value == 'function_argument_modeling'):
-                        res = res + " " + sub_str.strip()
+                        res.append(" " + sub_str.strip())
                     else:
-                        res = res + sub_str
+                        res.append(sub_str)
                         flag = True
-            return res
+            return ''.join(res)
         for child in self.children:
             sub_str = str(child)
             if sub_str.startswith('.'):
                 flag = False
             if sub_str != '':
-                if flag and not res.endswith('.'):
-                    res = res + " " + sub_str.strip()
+                if flag and not res[-1].endswith('.'):
+                    res.append(" " + sub_str.strip())
                 else:
-                    res = res + sub_str
+                    res.append(sub_str)
                     flag = True
-        return res
+        return ''.join(res)
+
+    def render_function(self):
+        # No space is put between the function name and the opening parenthesis
+        res = []
+        flag = False
+        for child in self.children:
+            if child.is_terminal and child.value == '(':
+                res.append(child.value)
+                flag = True
+            else:
+                sub_str = str(child)
+                if sub_str.startswith('.') or (len(res) != 0 and res[-1].endswith('.')):
+                    flag = False
+                if sub_str != '':
+                    if flag:
+                        res.append(" " + sub_str.strip())
+                    else:
+                        res.append(sub_str)
+                        flag = True
+        return ''.join(res)
 
     def add_child(self, node):
         self.children.append(node)
         node.father = self
+        self.invalidate_str()
 
     def replace_child(self, ori_child, new_child):
         i = 0
@@ -158,6 +221,7 @@ class TreeNode:
             if self.children[i] == ori_child:
                 self.children[i] = new_child
                 new_child.father = self
+                self.invalidate_str()
                 return
             i = i + 1
         assert False
@@ -184,6 +248,26 @@ class TreeNode:
                 return None
         return node
 
+    @staticmethod
+    def parse_sql(src_sql: str, dialect: str):
+        """
+        Parse src_sql into a TreeNode tree, return (root_node, line, column, msg) like parse_tree.
+        The outcome is cached in to_flat form, so every call gets a tree of its own that may be modified
+        """
+        key = get_parse_cache_key(src_sql, dialect)
+        res = parse_cache.get(key)
+        if res is None:
+            antlr_node, line, column, msg = parse_tree(src_sql, dialect)
+            root_node = None
+            if antlr_node is not None:
+                root_node = TreeNode.make_g4_tree_by_node(antlr_node, dialect)
+            flat = root_node.to_flat() if root_node is not None else None
+            parse_cache.put(key, (flat, line, column, msg))
+            return root_node, line, column, msg
+        flat, line, column, msg = res
+        root_node = TreeNode.from_flat(flat, dialect) if flat is not None else None
+        return root_node, line, column, msg
+
     @staticmethod
     def make_g4_tree(str_tree: str, dialect: str):
         node_stack = []
@@ -243,80 +327,94 @@ class TreeNode:
         while i >= 0:
             if len(root_node.children[i].children) == 0 and not root_node.children[i].is_terminal:
                 root_node.children.pop(i)
+                root_node.invalidate_str()
             i = i - 1
 
-    @staticmethod
-    def locate_node_exec(root_node, column: int, ori_sql: str, now_str: str):
-        cur_str = now_str
-        if len(root_node.children) != 0:
-            for child in root_node.children:
-                node, cur_str = TreeNode.locate_node_exec(child, column, ori_sql, cur_str)
-                if node is not None:
-                    return node, cur_str
-            return None, cur_str
-        elif not root_node.is_terminal:
-            return None, now_str
-        else:
-            i = len(now_str)
-            while ori_sql[i] == ' ':
-                i = i + 1
-            j, k = 0, 0
-            while j < len(root_node.value):
-                while (root_node.value[j] == ' '
-                       or root_node.value[j] == '\n' or root_node.value[j] == '\t'):
-                    j = j + 1
-                while (ori_sql[i + k] == ' '
-                       or ori_sql[i + k] == '\n' or ori_sql[i + k] == '\t'):
-                    k = k + 1
-                assert root_node.value[j] == ori_sql[i + k]
-                j = j + 1
-                k = k + 1
-            if i <= column < i + j:
-                return root_node, ori_sql[:i + j]
-            else:
-                return None, ori_sql[:i + j]
-
-    def clone(self):
+    def clone(self, node_map: dict = None):
+        """
+        Deep copy the subtree
+        :param node_map: if given, filled with the mapping from each original node to its copy
+        """
         new_node = TreeNode(self.value, self.dialect, self.is_terminal)
         new_node.model_get = self.model_get
+        if node_map is not None:
+            node_map[self] = new_node
         for child in self.children:
-            new_node.add_child(child.clone())
+            new_node.add_child(child.clone(node_map))
         return new_node
 
+    def to_flat(self) -> list:
+        """
+        Plain-data form of the subtree, [value, is_terminal, number of children] of each node in pre-order,
+        flat so that deep trees need no recursion
+        """
+        flat = []
+        stack = [self]
+        while len(stack) != 0:
+            node = stack.pop()
+            flat.append([node.value, node.is_terminal, len(node.children)])
+            stack.extend(reversed(node.children))
+        return flat
+
+    @staticmethod
+    def from_flat(flat: list, dialect: str):
+        """Rebuild the subtree from to_flat"""
+        root_node = None
+        # [node, children still to be read]
+        stack = []
+        for value, is_terminal, child_count in flat:
+            if len(stack) == 0:
+                node = root_node = TreeNode(value, dialect, is_terminal)
+            else:
+                father = stack[-1][0]
+                node = TreeNode(value, dialect, is_terminal, father, len(father.children))
+                father.children.append(node)
+                stack[-1][1] -= 1
+                if stack[-1][1] == 0:
+                    stack.pop()
+            if child_count != 0:
+                stack.append([node, child_count])
+        return root_node
+
+    @staticmethod
+    def get_leaves(root_node):
+        """Return the terminal leaves of the tree from left to right"""
+        leaves = []
+        stack = [root_node]
+        while len(stack) != 0:
+            node = stack.pop()
+            if len(node.children) != 0:
+                stack.extend(reversed(node.children))
+            elif node.is_terminal and node.value != '<EOF>':
+                leaves.append(node)
+        return leaves
+
+    @staticmethod
+    def get_span_index(root_node, sql: str) -> SpanIndex:
+        """Return the source spans of the tree in sql, built once until the tree or sql changes"""
+        if root_node._span_index is None or root_node._span_index.sql != sql:
+            root_node._span_index = SpanIndex(root_node, sql)
+        return root_node._span_index
+
     @staticmethod
     def locate_node(root_node, column: int, ori_sql: str):
-        node_str = str(root_node)
-        node_res = ''
-        for split_piece in node_str.split():
-            node_res = node_res + split_piece
-        ori_res = ''
-        for split_piece in ori_sql.split():
-            ori_res = ori_res + split_piece
-        assert ori_res == node_res
-        return TreeNode.locate_node_exec(root_node, column, ori_sql, '')
+        """
+        Find the terminal node covering column of ori_sql
+        :return: the node and ori_sql up to the end of the node
+        """
+        span_index = TreeNode.get_span_index(root_node, ori_sql)
+        i = span_index.locate(column)
+        return span_index.nodes[i], ori_sql[:span_index.ends[i]]
 
     @staticmethod
-    def no_space_loc(root_node, column: int, ori_sql: str, now_str: str):
-        cur_str = now_str
-        if len(root_node.children) != 0:
-            for child in root_node.children:
-                node, cur_str = TreeNode.no_space_loc(child, column, ori_sql, cur_str)
-                if node is not None:
-                    return node, cur_str
-            return None, cur_str
-        elif not root_node.is_terminal:
-            return None, now_str
-        else:
-            i = len(now_str)
-            j = 0
-            node_value = remove_all_space(root_node.value)
-            while j < len(node_value):
-                assert node_value[j] == ori_sql[i + j]
-                j = j + 1
-            if i <= column < i + j:
-                return root_node, ori_sql[:i + j]
-            else:
-                return None, ori_sql[:i + j]
+    def no_space_loc(root_node, column: int, ori_sql: str):
+        """
+        Find the terminal node covering column of ori_sql with all the space removed
+        :return: the node and its start in ori_sql
+        """
+        span_index = TreeNode.get_span_index(root_node, ori_sql)
+        i = span_index.locate_no_space(column)
+        return span_index.nodes[i], span_index.starts[i]
 
 
 def merge_tree(sub_tree_node: TreeNode, father_tree_node: TreeNode,
@@ -341,6 +439,7 @@ def merge_tree(sub_tree_node: TreeNode, father_tree_node: TreeNode,
     else:
         father_tree_node.children.insert(j, sub_tree_node)
         sub_tree_node.father = father_tree_node
+        father_tree_node.invalidate_str()
     return i + 1, j + 1
 
 
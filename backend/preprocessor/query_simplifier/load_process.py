@@ -1,23 +1,86 @@
 import os
+import re
 import json
+import hashlib
 
-from api.services.knowledge import get_json_items
 from config.db_config import db_session_manager
+from config.logging_config import logger
 from preprocessor.query_simplifier.Tree import TreeNode
+from utils.columnar_kb import get_kb_file_hash, read_kb_items
+from utils.constants import PATTERN_CACHE_DIR, PATTERN_CACHE_VERSION
+
+
+def get_compiled_file(kb_name: str, dialect: str) -> str:
+    name = os.path.abspath(kb_name) if os.path.isfile(kb_name) else kb_name
+    name_hash = hashlib.md5(name.encode('utf-8')).hexdigest()[:8]
+    safe_name = re.sub(r'[^a-zA-Z0-9]', '_', os.path.basename(name))
+    return os.path.join(PATTERN_CACHE_DIR, f"{safe_name}_{dialect}_{name_hash}.json")
+
+
+def load_compiled_patterns(compiled_file: str, kb_hash: str, dialect: str):
+    """
+    Load the pattern trees compiled from the knowledge base with content hash kb_hash.
+    The file holds plain JSON only (see dump_compiled_patterns), the trees are rebuilt from their flat form.
+
+    :return: (keyword_table_json, function_table_json), None if the file is missing or stale
+    """
+    if not os.path.isfile(compiled_file):
+        return None
+    try:
+        with open(compiled_file, "r", encoding="utf-8") as rf:
+            # The header line is read first so that a stale payload is never parsed
+            header = json.loads(rf.readline())
+            if header.get("version") != PATTERN_CACHE_VERSION or header.get("kb_hash") != kb_hash:
+                return None
+            tables = json.loads(rf.readline())
+        for table in tables:
+            for item in table:
+                item["tree"] = TreeNode.from_flat(item["tree"], dialect)
+        return tables[0], tables[1]
+    except Exception as e:
+        logger.warning(f"Failed to load compiled patterns {compiled_file}: {str(e)}")
+        return None
+
+
+def dump_compiled_patterns(compiled_file: str, kb_hash: str, keyword_table_json: list, function_table_json: list):
+    tmp_file = f"{compiled_file}.{os.getpid()}.tmp"
+    tables = [[dict(item, tree=item["tree"].to_flat()) for item in table]
+              for table in (keyword_table_json, function_table_json)]
+    try:
+        os.makedirs(os.path.dirname(compiled_file), exist_ok=True)
+        with open(tmp_file, "w", encoding="utf-8") as wf:
+            wf.write(json.dumps({"version": PATTERN_CACHE_VERSION, "kb_hash": kb_hash}) + "\n")
+            wf.write(json.dumps(tables, ensure_ascii=False) + "\n")
+        os.replace(tmp_file, compiled_file)
+    except (OSError, TypeError, ValueError) as e:
+        logger.warning(f"Failed to write compiled patterns {compiled_file}: {str(e)}")
+        if os.path.isfile(tmp_file):
+            os.remove(tmp_file)
 
 
 @db_session_manager
 def load_json_keywords(kb_name: str, dialect: str):
+    # The pattern trees are compiled once per knowledge base content and reloaded from the compiled file
+    if os.path.isfile(kb_name):
+        kb_hash = get_kb_file_hash(kb_name)
+    else:
+        # The knowledge service loads the embedding models and the vector store
+        from api.services.knowledge import get_json_items, get_json_items_version
+        # Only the row count and the last ids / update times are read unless the patterns are recompiled
+        kb_hash = get_json_items_version(kb_name)
+
+    compiled_file = get_compiled_file(kb_name, dialect)
+    tables = load_compiled_patterns(compiled_file, kb_hash, dialect)
+    if tables is not None:
+        return tables
+
     if os.path.isfile(kb_name):
-        with open(kb_name, "r") as rf:
-            items = json.load(rf)
+        items = read_kb_items(kb_name)
     else:
-        items = get_json_items(kb_name, all_item=True)
+        items = [json.loads(item.content) for item in get_json_items(kb_name, all_item=True)]
 
     keyword_table_json, function_table_json = list(), list()
     for item in items:
-        if not os.path.isfile(kb_name):
-            item = json.loads(item.content)
         if item['tree'] == "Parse error" or item['tree'] == "Found error":
             continue
         item["tree"] = TreeNode.make_g4_tree(item['tree'], dialect)
@@ -27,6 +90,7 @@ def load_json_keywords(kb_name: str, dialect: str):
         else:
             keyword_table_json.append(item)
 
+    dump_compiled_patterns(compiled_file, kb_hash, keyword_table_json, function_table_json)
     return keyword_table_json, function_table_json
 
 
@@ -9,12 +9,11 @@ import json
 import os.path
 from typing import List, Dict
 
-from api.services.knowledge import get_json_items
 from config.db_config import db_session_manager
-from preprocessor.antlr_parser.parse_tree import parse_tree
 from preprocessor.query_simplifier.Tree import TreeNode
+from utils.columnar_kb import is_columnar_kb, open_columnar_kb
 from utils.constants import ORACLE_COMMAND_OPEN
-from utils.db_connector import sql_execute
+from utils.db_connector import sql_validate
 from utils.tools import remove_all_space
 
 pg_func_name = set()
@@ -24,10 +23,22 @@ pg_func_name = set()
 def load_pg_func_name(kb_name):
     global pg_func_name
 
+    if os.path.isfile(kb_name) and is_columnar_kb(kb_name):
+        # Only the type, tree and keyword columns of the mapped file are read
+        kb = open_columnar_kb(kb_name)
+        for i in range(len(kb)):
+            if kb.get("type", i) != "function" or kb.get("tree", i) in ("Parse error", "Found error"):
+                continue
+            keyword = kb.get("keyword", i)
+            pg_func_name.add(keyword[:keyword.find('(')].upper())
+        return
+
     if os.path.isfile(kb_name):
         with open(kb_name, "r") as rf:
             items = json.load(rf)
     else:
+        # The knowledge service loads the embedding models and the vector store
+        from api.services.knowledge import get_json_items
         items = get_json_items(kb_name, all_item=True)
 
     for item in items:
@@ -184,7 +195,7 @@ def find_function(func_name, all_pieces, root_node, sql, location=None):
 
 
 def locate_node_piece(sql, tgt_dialect, all_pieces, root_node, tgt_db_config, tgt_kb_name):
-    flag, error_info = sql_execute(tgt_dialect, tgt_db_config, sql)
+    flag, error_info = sql_validate(tgt_dialect, tgt_db_config, sql)
     if flag:
         return None, "no execute error"
     else:
@@ -216,7 +227,7 @@ def locate_node_piece(sql, tgt_dialect, all_pieces, root_node, tgt_db_config, tg
 
             return find_piece(all_pieces, node), error_type
 
-        tree_node, line, column, msg = parse_tree(sql, tgt_dialect)
+        tree_node, line, column, msg = TreeNode.parse_sql(sql, tgt_dialect)
         if tree_node is not None:
             return None, "no parser error"
 
@@ -291,8 +302,8 @@ def locate_by_segment(ori_sql: str, segment: str, all_pieces: List[Dict], node2p
     assert segment_no_space in ori_sql_no_space
     first_loc = ori_sql_no_space.find(segment_no_space)
     last_loc = first_loc + len(segment_no_space) - 1
-    start_node, _ = TreeNode.no_space_loc(root_node, first_loc, ori_sql_no_space, '')
-    end_node, _ = TreeNode.no_space_loc(root_node, last_loc, ori_sql_no_space, '')
+    start_node, _ = TreeNode.no_space_loc(root_node, first_loc, ori_sql)
+    end_node, _ = TreeNode.no_space_loc(root_node, last_loc, ori_sql)
 
     node_set = set()
 
@@ -6,7 +6,6 @@
 
 from typing import List
 
-from preprocessor.antlr_parser.parse_tree import parse_tree
 from preprocessor.query_simplifier.Tree import TreeNode
 
 
@@ -18,6 +17,7 @@ def remove_as_mysql(root_node: TreeNode):
                 remove_children.append(child)
         for child in remove_children:
             root_node.children.remove(child)
+        root_node.invalidate_str()
     for child in root_node.children:
         if not child.is_terminal:
             remove_as_mysql(child)
@@ -31,6 +31,7 @@ def remove_as_pg(root_node: TreeNode):
                 remove_children.append(child)
         for child in remove_children:
             root_node.children.remove(child)
+        root_node.invalidate_str()
     for child in root_node.children:
         if not child.is_terminal:
             remove_as_pg(child)
@@ -256,9 +257,8 @@ def normalize(root_node: TreeNode, src_dialect: str, tgt_dialect: str):
 
 
 def normalize_sql(sql: str, src_dialect: str, tgt_dialect: str):
-    tree_node, _, _, _ = parse_tree(sql, src_dialect)
-    if tree_node is not None:
-        node = TreeNode.make_g4_tree_by_node(tree_node, src_dialect)
+    node, _, _, _ = TreeNode.parse_sql(sql, src_dialect)
+    if node is not None:
         normalize(node, src_dialect, tgt_dialect)
         return node
     else:
@@ -1,27 +1,49 @@
+import threading
 from typing import List, Dict
 
-from preprocessor.antlr_parser.parse_tree import parse_tree
+from preprocessor.antlr_parser.parse_tree import get_parse_cache_key
 from preprocessor.query_simplifier.load_process import load_json_keywords
 from preprocessor.query_simplifier.locate import locate_by_segment
 from preprocessor.query_simplifier.tree_matcher import *
+from utils.constants import PARSE_CACHE_SIZE
+from utils.lru_cache import LRUCache
 from utils.tools import print_err
 
 rewrite_keyword_map = {}
 rewrite_function_map = {}
+# dialect -> pattern index of the keywords / functions, see build_pattern_index
+rewrite_keyword_index = {}
+rewrite_function_index = {}
+# Serializes the loading, rewrite_keyword_index is published last and tells that the dialect is loaded
+rewrite_map_lock = threading.Lock()
 
+# (dialect, kb, sql) -> (all_pieces, root_node), only copies are handed out
+piece_cache = LRUCache(maxsize=PARSE_CACHE_SIZE)
 
-def function_rewrite(node: TreeNode, src_kb_name: str, src_dialect: str):
-    # Considering the written format of function in the antlr grams, 
-    # it is needed to check whether there are difference in Function call
-    if src_dialect not in rewrite_keyword_map:
+
+def load_rewrite_map(src_kb_name: str, src_dialect: str):
+    """
+    Load the keywords and functions of the knowledge base and index their pattern trees once per dialect.
+    """
+    if src_dialect in rewrite_keyword_index:
+        return
+    with rewrite_map_lock:
+        if src_dialect in rewrite_keyword_index:
+            return
         keyword_table_json, function_table_json = load_json_keywords(src_kb_name, src_dialect)
+        function_index = build_pattern_index(function_table_json)
+        keyword_index = build_pattern_index(keyword_table_json)
         rewrite_keyword_map[src_dialect] = keyword_table_json
         rewrite_function_map[src_dialect] = function_table_json
-    else:
-        function_table_json = rewrite_function_map[src_dialect]
-    for function in function_table_json:
-        if function['tree'] is None:
-            continue
+        rewrite_function_index[src_dialect] = function_index
+        rewrite_keyword_index[src_dialect] = keyword_index
+
+
+def function_rewrite(node: TreeNode, src_kb_name: str, src_dialect: str):
+    # Considering the written format of function in the antlr grams, 
+    # it is needed to check whether there are difference in Function call
+    load_rewrite_map(src_kb_name, src_dialect)
+    for function in get_candidate_patterns(rewrite_function_index[src_dialect], node):
         if check_for_root_node(node, function['keyword'], function['tree'], src_dialect):
             return {
                 "Node": node,
@@ -37,26 +59,10 @@ def function_rewrite(node: TreeNode, src_kb_name: str, src_dialect: str):
 def keyword_rewrite(node: TreeNode, src_kb_name: str, src_dialect: str):
     # Considering the written format of function in the antlr grams, 
     # it is needed to check whether there are difference in Function call
-    if src_dialect not in rewrite_keyword_map:
-        keyword_table_json, function_table_json = load_json_keywords(src_kb_name, src_dialect)
-        rewrite_keyword_map[src_dialect] = keyword_table_json
-        rewrite_function_map[src_dialect] = function_table_json
-    else:
-        keyword_table_json = rewrite_keyword_map[src_dialect]
+    load_rewrite_map(src_kb_name, src_dialect)
     to_pick_up_list = []
     cnt_flag = False
-    for keyword_list in keyword_table_json:
-        if keyword_list['tree'] is None:
-            continue
-        try:
-            if keyword_list['tree'] == 'Found error' or keyword_list['tree'] == "Parse error":
-                continue
-        except Exception as e:
-            print(str(e))
-            print("keyword_list['tree']", keyword_list['tree'])
-            print("keyword_list['keyword']", keyword_list['keyword'])
-            raise NotImplementedError
-
+    for keyword_list in get_candidate_patterns(rewrite_keyword_index[src_dialect], node):
         if check_for_root_node(node, keyword_list['keyword'], keyword_list['tree'], src_dialect):
             if 'Count' in keyword_list:
                 cnt_flag = True
@@ -85,7 +91,7 @@ def keyword_rewrite(node: TreeNode, src_kb_name: str, src_dialect: str):
             "Description": to_pick_up_list[0]['Description'],
             "Keyword": to_pick_up_list[0]['Keyword'],
             "Type": to_pick_up_list[0]['Type'],
-            "Detail": keyword_list['detail']
+            "Detail": to_pick_up_list[0]['Detail']
         }
     return None
 
@@ -106,7 +112,6 @@ def slice_all(node: TreeNode, src_kb_name, src_dialect, only_func) -> List[Dict]
     for i in range(len(node.children)):
         child_res = slice_all(node.children[i], src_kb_name, src_dialect, only_func)
         res = res + child_res
-    global rewrite_keyword_map
     rewrite_dict = function_rewrite(node, src_kb_name, src_dialect)
     if rewrite_dict is not None:
         res.append(rewrite_dict)
@@ -141,8 +146,7 @@ def search_upward(piece, node2piece: Dict):
 
 
 # directly slice all the pieces and then sort using the error info
-def get_all_piece(tree_node: TreeNode, src_kb_name, src_dialect) -> tuple[List[Dict], TreeNode]:
-    root_node = TreeNode.make_g4_tree_by_node(tree_node, src_dialect)
+def get_all_piece(root_node: TreeNode, src_kb_name, src_dialect) -> tuple[List[Dict], TreeNode]:
     res = slice_all(root_node, src_kb_name, src_dialect, False)
     node2piece = {}
     for piece in res:
@@ -157,6 +161,51 @@ def get_all_piece(tree_node: TreeNode, src_kb_name, src_dialect) -> tuple[List[D
     return res, root_node
 
 
+def copy_all_piece(all_pieces: List[Dict], root_node: TreeNode) -> tuple[List[Dict], TreeNode]:
+    """
+    Copy the converted tree together with its pieces, so that the copy can be mutated
+    without touching the original. The knowledge trees in piece['Tree'] are copied as well,
+    lift_node merges into them and they are shared by all the translations of the process.
+    """
+    node_map = {}
+    new_root_node = root_node.clone(node_map)
+    # Pieces matching the same knowledge entry keep sharing one copy of its tree
+    tree_map = {}
+    piece_map = {id(piece): dict(piece) for piece in all_pieces}
+    for new_piece in piece_map.values():
+        new_piece['Node'] = node_map[new_piece['Node']]
+        if new_piece['Tree'] is not None:
+            if id(new_piece['Tree']) not in tree_map:
+                tree_map[id(new_piece['Tree'])] = new_piece['Tree'].clone()
+            new_piece['Tree'] = tree_map[id(new_piece['Tree'])]
+        if 'SubPieces' in new_piece:
+            new_piece['SubPieces'] = [piece_map[id(sub_piece)] for sub_piece in new_piece['SubPieces']]
+        if new_piece['FatherPiece'] is not None:
+            new_piece['FatherPiece'] = piece_map[id(new_piece['FatherPiece'])]
+        new_piece['TrackPieces'] = list(new_piece['TrackPieces'])
+    return [piece_map[id(piece)] for piece in all_pieces], new_root_node
+
+
+def get_all_piece_by_sql(sql: str, src_kb_name, src_dialect) -> tuple[List[Dict], TreeNode]:
+    """
+    Parse the sql and slice all the pieces, the result is cached by (dialect, kb, sql).
+    Return (None, None) if the sql cannot be parsed.
+    """
+    key = get_parse_cache_key(sql, src_dialect, src_kb_name)
+    res = piece_cache.get(key)
+    if res is None:
+        root_node, _, _, _ = TreeNode.parse_sql(sql, src_dialect)
+        if root_node is None:
+            return None, None
+        res = get_all_piece(root_node, src_kb_name, src_dialect)
+        piece_cache.put(key, res)
+    return copy_all_piece(*res)
+
+
+def get_piece_cache_stats() -> dict:
+    return piece_cache.stats()
+
+
 def get_all_model_ans_nodes(root_node: TreeNode) -> List[TreeNode]:
     res = []
     for child in root_node.children:
@@ -176,7 +225,7 @@ def get_all_tgt_used_piece(now_sql, tgt_dialect, src_root_node):
     else:
         raise ValueError(f"{tgt_dialect} is not supported yet")
     try:
-        tree_node, line, col, msg = parse_tree(now_sql, tgt_dialect)
+        tree_node, line, col, msg = TreeNode.parse_sql(now_sql, tgt_dialect)
         if tree_node is None:
             raise ValueError(f"Parse error when executing ANTLR parser of {tgt_dialect}.\n"
                              f"The sql is {now_sql}")
@@ -19,3 +19,40 @@ def check_for_root_node(root_node: TreeNode, keyword_seq: str, keyword_tree_root
     if root_node.value.lower() != keyword_tree_root.value.lower():
         return False
     return dual_dfs_on_tree(root_node, keyword_tree_root)
+
+
+def build_pattern_index(patterns: list) -> dict:
+    """
+    Index the knowledge patterns by the lowercase value of their root and first child,
+    so that a node is only checked against the patterns that can match it.
+    :param patterns: list of knowledge items whose 'tree' is the pattern tree
+    :return: {root value: {first child value or None: [(order, child values, item)]}}
+    """
+    index = {}
+    for order, item in enumerate(patterns):
+        tree = item['tree']
+        if not isinstance(tree, TreeNode):
+            continue
+        child_values = frozenset(child.value.lower() for child in tree.children)
+        first_child = tree.children[0].value.lower() if len(tree.children) != 0 else None
+        index.setdefault(tree.value.lower(), {}).setdefault(first_child, []).append((order, child_values, item))
+    return index
+
+
+def get_candidate_patterns(index: dict, node: TreeNode) -> list:
+    """
+    Return the patterns of the index that may match node, in their original order.
+    dual_dfs_on_tree matches the children of a pattern as a subsequence of the children of node,
+    so every child value of a candidate pattern has to appear among the children of node.
+    """
+    root_index = index.get(node.value.lower())
+    if root_index is None:
+        return []
+    node_values = set(child.value.lower() for child in node.children)
+    candidates = list(root_index.get(None, []))
+    for value in node_values:
+        for entry in root_index.get(value, []):
+            if entry[1] <= node_values:
+                candidates.append(entry)
+    candidates.sort(key=lambda x: x[0])
+    return [entry[2] for entry in candidates]
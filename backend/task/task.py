@@ -1,9 +1,10 @@
 import asyncio
 from config.logging_config import logger
 from models import KnowledgeBase, JSONContent
-from llm_model.embeddings import get_embeddings
-from vector_store.chroma_store import ChromaStore
+from llm_model.embeddings import get_embeddings, embedding_manager, embedding_service
+from vector_store.base import get_vector_store, make_vector_metadata, CONTENT_TYPES
 from config.db_config import db, db_session_manager
+from utils.constants import VECTORIZE_CHUNK_SIZE
 import uuid
 import json
 from typing import List
@@ -33,6 +34,7 @@ def process_json_data(kb_name: str, item_ids: List[int]):
                 }
 
             try:
+                model_version = embedding_manager.get_model_version(kb.embedding_model_name)
                 # Generate vectors
                 embedding_type_texts = {}
                 for c in contents:
@@ -44,12 +46,9 @@ def process_json_data(kb_name: str, item_ids: List[int]):
                         }
                     embedding_type_texts[c.content_type]['original_contents'].append(c)
                     embedding_type_texts[c.content_type]['texts'].append(c.embedding_text)
-                    embedding_type_texts[c.content_type]['metadatas'].append({
-                        'content_id': str(c.id),
-                        'knowledge_base_id': str(kb.id),
-                        'content_type': c.content_type,
-                        'content': json.dumps(c.content)
-                    })
+                    embedding_type_texts[c.content_type]['metadatas'].append(make_vector_metadata(
+                        c.id, kb.id, c.content_type, c.content, c.content_hash, model_version
+                    ))
 
                 for embedding_type in embedding_type_texts.keys():
                     texts = embedding_type_texts[embedding_type]['texts']
@@ -61,7 +60,7 @@ def process_json_data(kb_name: str, item_ids: List[int]):
                     vector_ids = [str(uuid.uuid4()) for _ in texts]
                     original_contents = embedding_type_texts[embedding_type]['original_contents']
                     # Save to Chroma
-                    store = ChromaStore()
+                    store = get_vector_store()
                     store.add_texts(
                         kb_name=kb.kb_name,
                         content_type=embedding_type,
@@ -107,3 +106,141 @@ def process_json_data(kb_name: str, item_ids: List[int]):
 
     # Run asynchronous function
     return asyncio.run(_async_process_json_data())
+
+
+def is_vector_current(metadata: dict, content, model_version: str, live_version: str) -> bool:
+    """Whether the vector stored with metadata was embedded from content by the model of model_version"""
+    if 'content_hash' not in metadata:
+        # Vectors written before the hash was stored were embedded by the model of the knowledge base
+        return metadata.get('content') == json.dumps(content.content) and live_version == model_version
+    return metadata['content_hash'] == content.content_hash and metadata.get('embedding_model') == model_version
+
+
+@db_session_manager
+def reindex_knowledge_base(kb_name: str, embedding_model_name: str = None, chunk_size: int = VECTORIZE_CHUNK_SIZE):
+    """
+    Bring the vectors of a knowledge base up to date with its entries, re-embedding only what changed
+
+    The content hash and the model version stored in the vector metadata tell which entries are missing
+    or stale. If the vectors stay with the same model, the stale ones are upserted in place and the
+    vectors of deleted entries are removed. Otherwise (embedding_model_name differs from the model of
+    the knowledge base, or the model was reconfigured) new shadow collections are filled and swapped in
+    all at once, so that the searches keep running on the old vectors meanwhile.
+
+    Args:
+        kb_name: Knowledge base name
+        embedding_model_name: Embedding model of the new vectors, the model of the knowledge base if None
+        chunk_size: Entries embedded at once
+    """
+    kb = KnowledgeBase.query.filter_by(kb_name=kb_name).first()
+    if not kb:
+        return {'status': False, 'message': f'Knowledge base does not exist: {kb_name}'}
+
+    model_name = embedding_model_name or kb.embedding_model_name
+    model_version = embedding_manager.get_model_version(model_name)
+    live_version = embedding_manager.get_model_version(kb.embedding_model_name)
+    # An instance loaded before the model was reconfigured would embed with the old configuration
+    if embedding_manager.get_loaded_version(model_name) not in (None, model_version):
+        embedding_manager.release_embedding(model_name)
+    embedding_manager.get_embedding(model_name)
+    if embedding_manager.get_loaded_version(model_name) != model_version:
+        return {'status': False, 'message': f'Failed to reload embedding model {model_name} with its new configuration'}
+    store = get_vector_store()
+
+    contents = db.session.query(
+        JSONContent.id, JSONContent.content_type, JSONContent.content, JSONContent.content_hash,
+        JSONContent.embedding_text, JSONContent.vector_id
+    ).filter(JSONContent.knowledge_base_id == kb.id).all()
+    contents_by_type = {content_type: [] for content_type in CONTENT_TYPES}
+    for content in contents:
+        contents_by_type.setdefault(content.content_type, []).append(content)
+
+    # content type -> content id -> (vector id, metadata), and the vectors no entry can keep
+    vectors_by_type, extra_ids_by_type = {}, {}
+    for content_type in contents_by_type.keys():
+        vectors = store.get_vectors(kb_name, content_type)
+        vectors_by_type[content_type], extra_ids_by_type[content_type] = {}, []
+        for vector_id, metadata in zip(vectors['ids'], vectors['metadatas']):
+            if not metadata or metadata.get('content_id') in vectors_by_type[content_type]:
+                extra_ids_by_type[content_type].append(vector_id)
+            else:
+                vectors_by_type[content_type][metadata['content_id']] = (vector_id, metadata)
+    shadow = model_version != live_version or any(
+        metadata.get('embedding_model', live_version) != model_version
+        for vectors in vectors_by_type.values() for _, metadata in vectors.values()
+    )
+
+    shadows, updates, swapped = {}, [], False
+    reused_cnt, embedded_cnt, removed_cnt = 0, 0, 0
+    try:
+        for content_type, type_contents in contents_by_type.items():
+            vectors = vectors_by_type[content_type]
+            reused, stale = [], []
+            for content in type_contents:
+                vector_id, metadata = vectors.pop(str(content.id), (None, None))
+                if vector_id is not None and is_vector_current(metadata, content, model_version, live_version):
+                    reused.append((content, vector_id))
+                else:
+                    stale.append((content, vector_id or content.vector_id or f"{content.id}_{content_type}"))
+            # Vectors of the entries deleted or retyped since they were embedded
+            removed_ids = [vector_id for vector_id, _ in vectors.values()] + extra_ids_by_type[content_type]
+            reused_cnt += len(reused)
+            embedded_cnt += len(stale)
+            removed_cnt += len(removed_ids)
+
+            collection = None
+            if shadow and (len(type_contents) != 0 or len(removed_ids) != 0):
+                collection = store.create_shadow_collection(kb_name, content_type)
+                shadows[content_type] = collection
+                # Copy the vectors still current, their entries are not re-embedded
+                for i in range(0, len(reused), chunk_size):
+                    chunk = reused[i:i + chunk_size]
+                    copied = store.get_vectors(kb_name, content_type, ids=[vector_id for _, vector_id in chunk],
+                                               include=["embeddings", "documents", "metadatas"])
+                    store.write_collection(collection, copied["documents"], copied["embeddings"],
+                                           copied["metadatas"], copied["ids"])
+
+            for i in range(0, len(stale), chunk_size):
+                chunk = stale[i:i + chunk_size]
+                texts = [content.embedding_text for content, _ in chunk]
+                embeddings = embedding_service.embed(texts, model_name).tolist()
+                metadatas = [make_vector_metadata(content.id, kb.id, content_type, content.content,
+                                                  content.content_hash, model_version) for content, _ in chunk]
+                ids = [vector_id for _, vector_id in chunk]
+                if collection is not None:
+                    store.write_collection(collection, texts, embeddings, metadatas, ids)
+                else:
+                    store.add_texts(kb_name=kb_name, content_type=content_type, texts=texts,
+                                    embeddings=embeddings, metadatas=metadatas, ids=ids, upsert=True)
+                updates.extend({"id": content.id, "vector_id": vector_id, "status": "completed", "error_msg": None}
+                               for content, vector_id in chunk)
+
+            if not shadow and len(removed_ids) != 0:
+                store.delete_by_ids(kb_name, content_type, removed_ids)
+            logger.info(f"Reindexed {content_type} entries of {kb_name}: {len(reused)} kept, "
+                        f"{len(stale)} embedded, {len(removed_ids)} removed")
+
+        if shadow:
+            store.swap_collections(kb_name, shadows)
+            swapped = True
+            kb.embedding_model_name = model_name
+        db.session.bulk_update_mappings(JSONContent, updates)
+        db.session.commit()
+
+    except Exception as e:
+        db.session.rollback()
+        # Once swapped in, the shadow collections serve the searches
+        if not swapped:
+            for collection in shadows.values():
+                store.drop_shadow_collection(collection)
+        logger.error(f"Failed to reindex knowledge base {kb_name}: {str(e)}")
+        return {
+            'status': False,
+            'message': f'Failed to reindex knowledge base: {str(e)}'
+        }
+
+    return {
+        'status': True,
+        'message': f'Reindexing completed: {reused_cnt} kept, {embedded_cnt} embedded, {removed_cnt} removed',
+        'data': {'kept': reused_cnt, 'embedded': embedded_cnt, 'removed': removed_cnt, 'swapped': shadow}
+    }
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The backend directory is the import root of the application
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
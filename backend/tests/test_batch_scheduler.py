@@ -0,0 +1,47 @@
+import threading
+
+import pytest
+
+from llm_model.batch_scheduler import BatchScheduler
+
+
+def test_concurrent_requests_share_batches():
+    batches = []
+    release = threading.Event()
+
+    def run_batch(key, requests):
+        # Hold the first batch so that the following requests queue up
+        release.wait(5)
+        batches.append((key, list(requests)))
+        return [f"{key}:{request}" for request in requests]
+
+    scheduler = BatchScheduler(run_batch, max_batch_size=4, batch_window=0.05)
+    keys = ["a", "a", "b", "a", "b", "a", "b"]
+    futures = [scheduler.submit(i, key=key) for i, key in enumerate(keys)]
+    release.set()
+    assert [future.result(5) for future in futures] == [f"{key}:{i}" for i, key in enumerate(keys)]
+    scheduler.close()
+
+    assert sum(len(requests) for _, requests in batches) == len(keys)
+    assert all(len(requests) <= 4 for _, requests in batches)
+    # Requests of different keys never share a batch
+    for key, requests in batches:
+        assert all(keys[request] == key for request in requests)
+    assert scheduler.stats()["requests"] == 7
+    assert scheduler.stats()["batches"] < 7
+
+
+def test_batch_failure_and_result_count():
+    def run_batch(key, requests):
+        if key == "fail":
+            raise ValueError("boom")
+        return requests[:-1]
+
+    scheduler = BatchScheduler(run_batch, batch_window=0)
+    with pytest.raises(ValueError):
+        scheduler.submit(1, key="fail").result(5)
+    with pytest.raises(RuntimeError):
+        scheduler.submit(1, key="short").result(5)
+    scheduler.close()
+    with pytest.raises(RuntimeError):
+        scheduler.submit(1)
@@ -0,0 +1,125 @@
+import pytest
+
+for module in ["func_timeout", "paramiko", "pymysql", "psycopg2", "oracledb"]:
+    pytest.importorskip(module)
+
+from utils import db_connector
+from utils.db_connector import ConnectionPool
+
+DB_CONFIG = {"host": "localhost", "port": 5432, "user": "u", "password": "p", "db_name": "db"}
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = 0
+
+    def close(self):
+        self.closed = 1
+
+
+class FakePool(ConnectionPool):
+    """Pool of fake connections, no database is contacted"""
+
+    def __init__(self, **kwargs):
+        super().__init__("pg", DB_CONFIG, **kwargs)
+        self.opened = []
+
+    def _connect(self):
+        connection = FakeConnection()
+        self.opened.append(connection)
+        return connection
+
+    def is_alive(self, connection, ping: bool = True) -> bool:
+        return not connection.closed
+
+
+def test_pool_reuses_released_connections():
+    pool = FakePool(max_size=2)
+    first = pool.acquire()
+    pool.release(first)
+    assert pool.acquire() is first
+    second = pool.acquire()
+    assert second is not first and len(pool.opened) == 2
+    with pytest.raises(TimeoutError):
+        FakePool(max_size=0, checkout_timeout=0.01).acquire()
+
+
+def test_pool_discards_broken_connections():
+    pool = FakePool(max_size=1)
+    with pytest.raises(RuntimeError):
+        with pool.connection() as connection:
+            connection.close()
+            raise RuntimeError()
+    # The broken connection freed its slot
+    assert pool.acquire() is not connection
+
+
+def test_close_drains_pool():
+    pool = FakePool(max_size=2)
+    idle, in_use = pool.acquire(), pool.acquire()
+    pool.release(idle)
+    pool.close()
+    assert idle.closed and not in_use.closed
+    pool.release(in_use)
+    assert in_use.closed
+    assert pool._size == 0 and pool._idle == []
+
+
+def test_close_pools_forgets_pools():
+    pool = db_connector.get_pool("pg", DB_CONFIG)
+    assert db_connector.get_pool("pg", DB_CONFIG) is pool
+    db_connector.close_pools("pg", "db")
+    assert db_connector.get_pool("pg", DB_CONFIG) is not pool
+    db_connector.close_pools()
+
+
+@pytest.fixture
+def executed(monkeypatch):
+    executed = []
+
+    def sql_execute(dialect, tgt_db_config, sql, validate_only=False, max_rows=None):
+        executed.append((sql, validate_only))
+        return not sql.startswith("bad"), None if not sql.startswith("bad") else "syntax error"
+
+    monkeypatch.setattr(db_connector, "sql_execute", sql_execute)
+    db_connector.invalidate_validation_cache()
+    yield executed
+    db_connector.invalidate_validation_cache()
+
+
+def test_sql_validate_memoized(executed):
+    assert db_connector.sql_validate("pg", DB_CONFIG, "SELECT 1;") == (True, None)
+    assert db_connector.sql_validate("pg", DB_CONFIG, " SELECT 1 ") == (True, None)
+    assert db_connector.sql_validate("pg", DB_CONFIG, "bad sql") == (False, "syntax error")
+    assert db_connector.sql_validate("pg", DB_CONFIG, "bad sql") == (False, "syntax error")
+    assert executed == [("SELECT 1;", False), ("bad sql", False)]
+    # Another user of the database may lack privileges
+    db_connector.sql_validate("pg", dict(DB_CONFIG, user="v"), "SELECT 1")
+    assert len(executed) == 3
+
+
+def test_sql_validate_generations(executed):
+    db_connector.sql_validate("pg", DB_CONFIG, "SELECT 1")
+    other_db = dict(DB_CONFIG, db_name="other")
+    db_connector.sql_validate("pg", other_db, "SELECT 1")
+    # A schema change of the database invalidates the results of all its users
+    db_connector.invalidate_validation_cache(dict(DB_CONFIG, user="v"))
+    db_connector.sql_validate("pg", DB_CONFIG, "SELECT 1")
+    db_connector.sql_validate("pg", other_db, "SELECT 1")
+    assert len(executed) == 3
+
+
+def test_sql_validate_mode(executed, monkeypatch):
+    db_connector.sql_validate("pg", DB_CONFIG, "SELECT 1")
+    monkeypatch.setattr(db_connector, "validate_only", False)
+    db_connector.set_validate_only(True)
+    db_connector.sql_validate("pg", DB_CONFIG, "SELECT 1")
+    assert executed == [("SELECT 1", False), ("SELECT 1", True)]
+
+
+def test_sql_validate_timeouts_not_memoized(executed, monkeypatch):
+    monkeypatch.setattr(db_connector, "sql_execute", lambda *args, **kwargs: executed.append(args) or
+                        (False, "canceling statement due to statement timeout"))
+    db_connector.sql_validate("pg", DB_CONFIG, "SELECT pg_sleep(100)")
+    db_connector.sql_validate("pg", DB_CONFIG, "SELECT pg_sleep(100)")
+    assert len(executed) == 2
@@ -0,0 +1,57 @@
+import os
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from llm_model.embedding_cache import EmbeddingCache, EmbeddingDiskStore
+
+
+def test_disk_store_shared_between_instances(tmp_path):
+    writer = EmbeddingDiskStore(str(tmp_path))
+    reader = EmbeddingDiskStore(str(tmp_path))
+    vectors = np.arange(12, dtype=np.float32).reshape(3, 4)
+    writer.put_many(["a", "b", "a"], vectors)
+    assert reader.get("c") is None
+    # Appended by another instance after this one was loaded
+    assert np.array_equal(reader.get("b"), vectors[1])
+    assert np.array_equal(reader.get("a"), vectors[0])
+    writer.put_many(["c"], vectors[2:])
+    assert np.array_equal(reader.get("c"), vectors[2])
+    # Keys already stored are not appended again
+    writer.put_many(["a"], vectors[2:])
+    assert os.path.getsize(writer.vector_file) == 3 * 4 * 4
+
+
+def test_disk_store_skips_torn_records(tmp_path):
+    store = EmbeddingDiskStore(str(tmp_path))
+    vectors = np.ones((2, 4), dtype=np.float32)
+    store.put_many(["a", "b"], vectors)
+    # A crash while appending a vector and its key
+    with open(store.vector_file, "ab") as wf:
+        wf.write(b"\x00" * 6)
+    with open(store.key_file, "ab") as wf:
+        wf.write(b"torn 2")
+    reopened = EmbeddingDiskStore(str(tmp_path))
+    assert reopened.get("torn") is None
+    reopened.put_many(["c"], 2 * vectors[:1])
+    assert np.array_equal(EmbeddingDiskStore(str(tmp_path)).get("c"), 2 * vectors[0])
+    assert np.array_equal(EmbeddingDiskStore(str(tmp_path)).get("b"), vectors[1])
+
+
+def test_dimension_mismatch_ignored(tmp_path):
+    store = EmbeddingDiskStore(str(tmp_path))
+    store.put_many(["a"], np.ones((1, 4), dtype=np.float32))
+    store.put_many(["b"], np.ones((1, 3), dtype=np.float32))
+    assert store.get("b") is None
+
+
+def test_cache_namespaced_by_model(tmp_path):
+    cache = EmbeddingCache(cache_dir=str(tmp_path), memory_size=8)
+    cache.put_many("model-a", ["text"], np.ones((1, 4)))
+    assert cache.get_many("model-b", ["text"]) == [None]
+    assert np.array_equal(cache.get_many("model-a", ["text"])[0], np.ones(4, dtype=np.float32))
+    # A new process reads the vector from disk
+    cold = EmbeddingCache(cache_dir=str(tmp_path), memory_size=8)
+    assert np.array_equal(cold.get_many("model-a", ["text"])[0], np.ones(4, dtype=np.float32))
+    assert cold.stats()["disk_hits"] == 1
@@ -0,0 +1,31 @@
+import io
+import json
+
+import pytest
+
+from utils.json_stream import iter_json_array
+
+DOCUMENT = [1.5, -20, "a, b]", {"k": [1, 2, {"x": None}]}, [], True, 1e-3, "中文"]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 64, 4096])
+def test_chunk_boundaries(chunk_size):
+    # Every element is cut by a chunk boundary with the small chunk sizes
+    text = "﻿  " + json.dumps(DOCUMENT, ensure_ascii=False, indent=1)
+    assert list(iter_json_array(io.StringIO(text), chunk_size=chunk_size)) == DOCUMENT
+
+
+@pytest.mark.parametrize("chunk_size", [1, 5])
+def test_empty_array(chunk_size):
+    assert list(iter_json_array(io.StringIO(" [ \n ] "), chunk_size=chunk_size)) == []
+
+
+def test_not_an_array():
+    with pytest.raises(ValueError):
+        list(iter_json_array(io.StringIO('{"a": 1}'), chunk_size=2))
+
+
+@pytest.mark.parametrize("text", ["[1, 2", "[1 2]", "[1, {]"])
+def test_malformed(text):
+    with pytest.raises(json.JSONDecodeError):
+        list(iter_json_array(io.StringIO(text), chunk_size=2))
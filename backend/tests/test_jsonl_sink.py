@@ -0,0 +1,42 @@
+import json
+import os
+
+import pytest
+
+from utils.jsonl_sink import JsonlSink, compact_process_file, read_jsonl, unique_sink_path
+
+
+def test_write_and_compact(tmp_path):
+    out_path = str(tmp_path / "process.json")
+    jsonl_path = unique_sink_path(out_path)
+    sink = JsonlSink(jsonl_path, flush_interval=2)
+    sink.write({"info": {"model": "m"}})
+    for i in range(3):
+        sink.write({"step": i})
+    sink.close()
+    # Closing twice is harmless
+    sink.close()
+
+    assert compact_process_file(jsonl_path, out_path)
+    with open(out_path) as rf:
+        assert json.load(rf) == {"info": {"model": "m"}, "process_data": [{"step": i} for i in range(3)]}
+    assert not os.path.exists(jsonl_path)
+    # Already compacted, e.g., by another exit path
+    assert not compact_process_file(jsonl_path, out_path)
+
+
+def test_unique_paths_never_shared(tmp_path):
+    out_path = str(tmp_path / "process.json")
+    paths = {unique_sink_path(out_path) for _ in range(100)}
+    assert len(paths) == 100
+    path = paths.pop()
+    JsonlSink(path).close()
+    with pytest.raises(FileExistsError):
+        JsonlSink(path)
+
+
+def test_torn_last_line_skipped(tmp_path):
+    path = str(tmp_path / "torn.jsonl")
+    with open(path, "w") as wf:
+        wf.write('{"a": 1}\n\n{"b": 2}\n{"c": ')
+    assert read_jsonl(path) == [{"a": 1}, {"b": 2}]
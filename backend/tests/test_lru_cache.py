@@ -0,0 +1,41 @@
+from utils.lru_cache import LRUCache
+
+
+def test_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert "b" not in cache
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert len(cache) == 2
+
+
+def test_ttl_expiry(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("utils.lru_cache.time.time", lambda: now[0])
+    cache = LRUCache(maxsize=4, ttl=10)
+    cache.put("a", 1)
+    now[0] += 9
+    assert "a" in cache
+    assert cache.get("a") == 1
+    now[0] += 2
+    # Expired entries are reported missing before they are evicted
+    assert "a" not in cache
+    assert len(cache) == 1
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_stats_and_zero_size():
+    cache = LRUCache(maxsize=0)
+    cache.put("a", 1)
+    assert cache.get("a") is None
+    cache = LRUCache(maxsize=2)
+    cache.put("a", 1)
+    cache.get("a")
+    cache.get("b")
+    assert cache.stats() == {"hits": 1, "misses": 1, "size": 1, "maxsize": 2, "hit_rate": 0.5}
+    cache.clear()
+    assert cache.stats()["hits"] == 0 and len(cache) == 0
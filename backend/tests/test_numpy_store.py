@@ -0,0 +1,109 @@
+import os
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from vector_store.base import generate_collection_id
+from vector_store.numpy_store import NumpyStore, VectorCollection, normalize, quantize
+
+DIMENSION = 16
+
+
+def random_vectors(count, seed=0):
+    return np.random.default_rng(seed).standard_normal((count, DIMENSION)).astype(np.float32)
+
+
+def fill(store, vectors, ids=None, chunk=None, content_type="function"):
+    ids = ids or [f"id{i}" for i in range(len(vectors))]
+    chunk = chunk or len(vectors)
+    for start in range(0, len(vectors), chunk):
+        store.add_texts("kb", content_type, [f"doc {id_}" for id_ in ids[start:start + chunk]],
+                        vectors[start:start + chunk].tolist(),
+                        [{"content_type": content_type, "n": i} for i in range(start, min(start + chunk, len(ids)))],
+                        ids[start:start + chunk], upsert=True)
+
+
+def test_quantize_error_bound():
+    matrix = normalize(random_vectors(50))
+    quantized, scales = quantize(matrix)
+    assert quantized.dtype == np.int8
+    # Rounding to the nearest step of each vector
+    assert np.abs(quantized * scales[:, None] - matrix).max() <= scales.max() / 2 + 1e-6
+    zero, zero_scales = quantize(np.zeros((1, DIMENSION), dtype=np.float32))
+    assert not zero.any() and zero_scales[0] == 1
+
+
+@pytest.mark.parametrize("dtype", ["float32", "int8"])
+def test_search_matches_brute_force(tmp_path, dtype):
+    store = NumpyStore(str(tmp_path), dtype=dtype)
+    vectors = random_vectors(200)
+    fill(store, vectors, chunk=64)
+    queries = random_vectors(5, seed=1)
+    expected = np.argsort(-(normalize(queries) @ normalize(vectors).T), axis=1)[:, :3]
+    results = store.search_batch("kb", queries.tolist(), "function", top_k=3)
+    for result, rows in zip(results, expected):
+        if dtype == "float32":
+            assert [item["id"] for item in result] == [f"id{row}" for row in rows]
+        else:
+            # Approximate scores, the best match still ranks high
+            assert f"id{rows[0]}" in [item["id"] for item in result]
+        assert [item["score"] for item in result] == sorted([item["score"] for item in result], reverse=True)
+    # The query of a stored vector finds it first
+    assert store.search("kb", vectors[7].tolist(), top_k=1)[0]["id"] == "id7"
+    assert store.search("kb", vectors[7].tolist(), top_k=5, where={"n": {"$eq": 8}})[0]["id"] == "id8"
+
+
+def test_upsert_delete_and_compaction(tmp_path):
+    store = NumpyStore(str(tmp_path))
+    path = store._path(generate_collection_id("kb", "function"))
+    vectors = random_vectors(40)
+    fill(store, vectors, chunk=10)
+    size = os.path.getsize(path)
+    fill(store, vectors[:10][::-1].copy(), ids=[f"id{i}" for i in range(10)])
+    # Appended, the earlier segments are not rewritten
+    assert os.path.getsize(path) > size
+    store.delete_by_ids("kb", "function", ["id0", "id1", "missing"])
+
+    # Another process reads the collection from the file
+    reader = NumpyStore(str(tmp_path))
+    res = reader.get_vectors("kb", "function", include=["embeddings", "documents"])
+    assert sorted(res["ids"]) == sorted(f"id{i}" for i in range(2, 40))
+    embeddings = dict(zip(res["ids"], res["embeddings"]))
+    assert np.allclose(embeddings["id2"], normalize(vectors[7:8])[0], atol=1e-6)
+    assert np.allclose(embeddings["id30"], normalize(vectors[30:31])[0], atol=1e-6)
+
+    # Once the dead rows outnumber the live ones, the file is compacted
+    inode = os.stat(path).st_ino
+    for _ in range(3):
+        fill(store, vectors[2:40], ids=[f"id{i}" for i in range(2, 40)])
+    assert os.stat(path).st_ino != inode
+    collection = reader._get_collection(generate_collection_id("kb", "function"))
+    assert collection.count() == 38 and collection.dead_count() <= collection.count()
+
+
+def test_torn_append_ignored(tmp_path):
+    store = NumpyStore(str(tmp_path))
+    fill(store, random_vectors(10))
+    path = store._path(generate_collection_id("kb", "function"))
+    with open(path, "ab") as wf:
+        # Left by a writer killed before committing
+        wf.write(b"\x07" * 100)
+    reader = NumpyStore(str(tmp_path))
+    assert len(reader.get_vectors("kb", "function")["ids"]) == 10
+    fill(store, random_vectors(5, seed=2), ids=[f"new{i}" for i in range(5)])
+    collection, _, _ = VectorCollection.load(path, "c", "float32")
+    assert collection.count() == 15
+
+
+def test_swap_and_delete_collection(tmp_path):
+    store = NumpyStore(str(tmp_path))
+    fill(store, random_vectors(10))
+    fill(store, random_vectors(3), content_type="keyword")
+    shadow = store.create_shadow_collection("kb", "function")
+    store.write_collection(shadow, ["x"], random_vectors(1).tolist(), None, ["only"])
+    store.swap_collections("kb", {"function": shadow})
+    assert store.get_vectors("kb", "function")["ids"] == ["only"]
+    assert len(store.get_vectors("kb", "keyword")["ids"]) == 3
+    store.delete_collection("kb")
+    assert store.search("kb", random_vectors(1)[0].tolist()) == []
@@ -0,0 +1,83 @@
+import pytest
+
+pytest.importorskip("antlr4")
+
+from preprocessor.query_simplifier import Tree
+from preprocessor.query_simplifier.Tree import TreeNode
+
+
+def make_tree(dialect="pg"):
+    # (root (select SELECT (list a , b) FROM t) ;)
+    root = TreeNode("root", dialect, False)
+    select = TreeNode("select", dialect, False)
+    root.add_child(select)
+    select.add_child(TreeNode("SELECT", dialect, True))
+    target_list = TreeNode("list", dialect, False)
+    select.add_child(target_list)
+    for value in ["a", ",", "b"]:
+        target_list.add_child(TreeNode(value, dialect, True))
+    select.add_child(TreeNode("FROM", dialect, True))
+    select.add_child(TreeNode("t", dialect, True))
+    root.add_child(TreeNode(";", dialect, True))
+    return root
+
+
+def test_span_index():
+    sql = "SELECT  a,b\nFROM t ;"
+    span_index = Tree.SpanIndex(make_tree(), sql)
+    assert [sql[start:end] for start, end in zip(span_index.starts, span_index.ends)] == \
+           ["SELECT", "a", ",", "b", "FROM", "t", ";"]
+    assert span_index.nodes[span_index.locate(8)].value == "a"
+    # Columns in the space between two leaves belong to the next leaf
+    assert span_index.nodes[span_index.locate(6)].value == "a"
+    assert span_index.nodes[span_index.locate(len(sql) - 1)].value == ";"
+    # "SELECTa,bFROMt;"
+    assert span_index.nodes[span_index.locate_no_space(9)].value == "FROM"
+    with pytest.raises(AssertionError):
+        Tree.SpanIndex(make_tree(), "SELECT a, c FROM t;")
+
+
+def test_span_index_invalidated_by_modification():
+    root = make_tree()
+    sql = "SELECT a, b FROM t;"
+    node, prefix = TreeNode.locate_node(root, 7, sql)
+    assert node.value == "a" and prefix == "SELECT a"
+    node.value = "col_a"
+    assert root._span_index is None
+    sql = "SELECT col_a, b FROM t;"
+    node, start = TreeNode.no_space_loc(root, 11, sql)
+    assert node.value == "," and start == 12
+
+
+def test_flat_round_trip():
+    root = make_tree()
+    copy = TreeNode.from_flat(root.to_flat(), "pg")
+    assert copy.to_tree_rep() == root.to_tree_rep()
+    target_list = copy.children[0].children[1]
+    assert target_list.father is copy.children[0] and target_list.father_child_index == 1
+    assert [child.father_child_index for child in target_list.children] == [0, 1, 2]
+
+
+def test_parse_sql_returns_private_trees(monkeypatch):
+    parsed = []
+
+    def parse_tree(src_sql, dialect):
+        parsed.append(src_sql)
+        if src_sql == "bad":
+            return None, 1, 2, "syntax error"
+        return object(), None, None, None
+
+    monkeypatch.setattr(Tree, "parse_tree", parse_tree)
+    monkeypatch.setattr(TreeNode, "make_g4_tree_by_node", staticmethod(lambda antlr_node, dialect: make_tree()))
+    Tree.parse_cache.clear()
+
+    first, _, _, _ = TreeNode.parse_sql("SELECT a, b FROM t;", "pg")
+    first.children[0].children[1].children[0].value = "c"
+    second, line, column, msg = TreeNode.parse_sql("SELECT a, b FROM t;", "pg")
+    assert (line, column, msg) == (None, None, None)
+    # The cached outcome is not affected by the modification of a returned tree
+    assert second.to_tree_rep() == make_tree().to_tree_rep() != first.to_tree_rep()
+    assert TreeNode.parse_sql("bad", "pg") == (None, 1, 2, "syntax error")
+    assert TreeNode.parse_sql("bad", "pg") == (None, 1, 2, "syntax error")
+    assert parsed == ["SELECT a, b FROM t;", "bad"]
+    Tree.parse_cache.clear()
@@ -1,34 +1,43 @@
 import argparse
-import asyncio
-import copy
 import json
 import os
 import re
 import sys
+import time
+import threading
 import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Dict
+from typing import Dict, TYPE_CHECKING
 
 import sqlglot
 from tqdm import tqdm
 
-from app_factory import create_app
+from flask import current_app
+
 from config.db_config import db_session_manager
-from llm_model.embeddings import get_embeddings
+from config.logging_config import logger
 from models import DatabaseConfig, KnowledgeBase
-from preprocessor.antlr_parser.parse_tree import parse_tree
 from preprocessor.query_simplifier.Tree import TreeNode, lift_node
 from preprocessor.query_simplifier.locate import locate_node_piece, replace_piece, get_func_name, find_piece
 from preprocessor.query_simplifier.normalize import normalize
-from preprocessor.query_simplifier.rewrite import get_all_piece
+from preprocessor.query_simplifier.rewrite import get_all_piece_by_sql
 from translator.judge_prompt import SYSTEM_PROMPT_JUDGE, USER_PROMPT_JUDGE, USER_PROMPT_REFLECT
-from translator.llm_translator import LLMTranslator
+from translator.prompt_budget import count_tokens, count_message_tokens, get_prompt_budget, pack_documents, \
+    pack_errors
+from translator.translation_memory import translation_memory
 from translator.translate_prompt import SYSTEM_PROMPT_NA, USER_PROMPT_NA, \
     SYSTEM_PROMPT_SEG, USER_PROMPT_SEG, SYSTEM_PROMPT_RET, USER_PROMPT_RET, EXAMPLE_PROMPT, JUDGE_INFO_PROMPT
 from utils.constants import DIALECT_MAP, FAILED_TEMPLATE, CHUNK_SIZE, TRANSLATION_ANSWER_PATTERN, \
-    JUDGE_ANSWER_PATTERN, DIALECT_LIST, DIALECT_LIST_RULE
+    JUDGE_ANSWER_PATTERN, DIALECT_LIST, DIALECT_LIST_RULE, BATCH_MAX_WORKERS, BATCH_MAX_IN_FLIGHT, \
+    BATCH_DUMP_INTERVAL, TRANSLATION_MEMORY_ON
+from utils.jsonl_sink import JsonlSink, compact_process_file, unique_sink_path
 from utils.tools import process_err_msg, process_history_text
-from vector_store.chroma_store import ChromaStore
+
+if TYPE_CHECKING:
+    from translator.llm_translator import LLMTranslator
+    from vector_store.chroma_store import ChromaStore
 
 
 # rule translation
@@ -46,7 +55,10 @@ class Translator:
                  top_k: int,
                  history_id: str = None,
                  out_type: str = "file",
-                 out_dir: str = None):
+                 out_dir: str = None,
+                 out_name: str = None,
+                 llm_translator: "LLMTranslator" = None,
+                 vector_db: "ChromaStore" = None):
         """SQL dialect translator
         
         This class is used to convert one SQL dialect to another, supporting retrieval enhancement and history tracking.
@@ -72,6 +84,9 @@ class Translator:
                 - "db": Results saved to database
                 - "file": Results saved to file
             out_dir: Output Directory to dump result
+            out_name: Output file name, generated from the dialects and the current time if None
+            llm_translator: LLM translator shared by several translators, created from model_name if None
+            vector_db: Vector database shared by several translators, created if None
         """
         # Basic configuration
         self.model_name = model_name
@@ -104,17 +119,35 @@ class Translator:
         self.out_type = out_type  # Output type
         self.out_dir = out_dir  # Output directory
         self.out_file = None
+        self.out_sink = None
         if self.out_type == 'file':
             if not os.path.exists(self.out_dir):
                 os.makedirs(self.out_dir)
-            file_name = f"{self.src_dialect}_{self.tgt_dialect}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+            file_name = out_name
+            if file_name is None:
+                file_name = f"{self.src_dialect}_{self.tgt_dialect}_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}.json"
             self.out_file = os.path.join(self.out_dir, file_name)
-            self.init_out_file()
 
         # Initialize core components
-        if model_name is not None and model_name != "":
+        if llm_translator is not None:
+            self.translator = llm_translator
+        elif model_name is not None and model_name != "":
+            from translator.llm_translator import LLMTranslator
             self.translator = LLMTranslator(model_name)  # Initialize LLM translator
-        self.vector_db = ChromaStore()  # Initialize vector database
+        self._vector_db = vector_db  # Vector database, opened on first retrieval
+        self.prompt_tokens = list()  # Prompt tokens of each model request
+
+        # Opened last, a failed initialization leaves no sink behind that close_out_file would never export
+        if self.out_file is not None:
+            self.init_out_file()
+
+    @property
+    def vector_db(self) -> "ChromaStore":
+        # Rule and direct translations never open the vector database
+        if self._vector_db is None:
+            from vector_store.base import get_vector_store
+            self._vector_db = get_vector_store()
+        return self._vector_db
 
     @db_session_manager
     def local_to_global_rewrite(self, max_retry_time=2):
@@ -178,6 +211,8 @@ class Translator:
         current_sql = self.src_sql
         ori_piece, last_time_piece = None, None
         err_msg_list, err_info_list = list(), list()
+        # Fragment translations made in this run, recorded into the translation memory on success
+        memory_candidates = list()
 
         # Locate first fragment to process
         piece, assist_info = locate_node_piece(current_sql, self.tgt_dialect, all_pieces,
@@ -202,6 +237,11 @@ class Translator:
             if last_time_piece is not None:
                 back_flag = self.get_restore_piece_flag(assist_info, piece, last_time_piece, ori_piece)
                 if back_flag:
+                    # The translation reused from the memory does not fit here
+                    for candidate in memory_candidates:
+                        if candidate["piece"] is last_time_piece and candidate["from_memory"]:
+                            translation_memory.record(candidate["fragment"], candidate["translation"],
+                                                      self.src_dialect, self.tgt_dialect, success=False)
                     # Restore to previous state
                     replace_piece(last_time_piece, ori_piece)
                     all_pieces.remove(last_time_piece)
@@ -260,8 +300,22 @@ class Translator:
             # else:
             #     # For non-first attempts, directly use custom conversion method
             #     ans_slice, model_ans = self.rewrite_piece(piece, history=[], err_info_list=err_info_list)
-            # For non-first attempts, directly use custom conversion method
-            ans_slice, model_ans = self.rewrite_piece(piece, history=[], err_info_list=err_info_list)
+            # For the first attempt, reuse the validated translation of the same fragment if any
+            src_fragment = str(piece['Node'])
+            ans_slice = None
+            if TRANSLATION_MEMORY_ON and piece['Count'] == 0:
+                ans_slice = translation_memory.lookup(src_fragment, self.src_dialect, self.tgt_dialect)
+            from_memory = ans_slice is not None
+            if from_memory:
+                model_ans = {"role": "assistant", "content": ans_slice, "Action": "translate",
+                             "Time": str(datetime.now())}
+                self.add_process(content=f"Reuse the validated translation of `{src_fragment}`",
+                                 step_name="Rewrite result", sql=ans_slice, role="assistant",
+                                 is_success=True, error=None)
+            else:
+                # For non-first attempts, directly use custom conversion method
+                ans_slice, model_ans = self.rewrite_piece(piece, history=[], err_info_list=err_info_list)
+            tgt_fragment = ans_slice
 
             # Handle special case for SELECT statements
             if 'select' in ans_slice.lower() and 'select' not in str(piece['Node']).lower():
@@ -295,6 +349,8 @@ class Translator:
                     all_pieces.remove(sub_piece)
             replace_piece(piece, new_piece)
             last_time_piece, ori_piece = new_piece, piece
+            memory_candidates.append({"fragment": src_fragment, "translation": tgt_fragment,
+                                      "keyword": piece['Keyword'], "piece": new_piece, "from_memory": from_memory})
             current_sql = str(root_node)
 
             # Record conversion result
@@ -307,6 +363,7 @@ class Translator:
             if piece is None:
                 # Check for duplicate results
                 if current_sql in sql_ans_list:
+                    self.record_translation_memory(memory_candidates, all_pieces)
                     return current_sql, model_ans_list, used_pieces, lift_histories
 
                 # Use model to judge if need to continue processing
@@ -319,8 +376,18 @@ class Translator:
             if current_sql not in sql_ans_list:
                 sql_ans_list.append(current_sql)
 
+        self.record_translation_memory(memory_candidates, all_pieces)
         return current_sql, model_ans_list, used_pieces, lift_histories
 
+    def record_translation_memory(self, memory_candidates, all_pieces):
+        """Count a success for each fragment translation that is still part of the translated SQL"""
+        if not TRANSLATION_MEMORY_ON:
+            return
+        for candidate in memory_candidates:
+            if any(piece is candidate["piece"] for piece in all_pieces):
+                translation_memory.record(candidate["fragment"], candidate["translation"],
+                                          self.src_dialect, self.tgt_dialect, keyword=candidate["keyword"])
+
     def rewrite_piece(self, piece, history=list(), err_info_list=list()) -> [str, str]:
         """SQL fragment rewriting method
         
@@ -340,6 +407,14 @@ class Translator:
         elif isinstance(piece, str):
             input_sql = piece
 
+        # Prompt tokens left for the errors and documents once the templates and the snippet are in place
+        model_name = self.translator.model_name
+        budget = get_prompt_budget(self.translator.model.model_config) \
+            - self.count_prompt_tokens(history, *self.format_rewrite_prompt(
+                input_sql, document="" if self.retrieval_on else None))
+        # The most recent errors take at most half of it, the documents the rest
+        err_info_list = pack_errors(err_info_list, budget // 2, model_name)
+
         # Build error example prompt
         example = str()
         for item in err_info_list:
@@ -368,41 +443,24 @@ class Translator:
                     example=example
                 ).strip("\n")
             else:  # Not first attempt, use retrieval enhancement
-                # Get similar case description
-                document = self.get_document_description(piece)
+                # Get similar case description within the tokens the errors left
+                document = self.get_document_description(piece, budget=budget - count_tokens(example, model_name))
                 # Use retrieval enhanced prompt template
-                sys_prompt = SYSTEM_PROMPT_RET.format(
-                    src_dialect=DIALECT_MAP[self.src_dialect],
-                    tgt_dialect=DIALECT_MAP[self.tgt_dialect]
-                ).strip("\n")
-                user_prompt = USER_PROMPT_RET.format(
-                    src_dialect=DIALECT_MAP[self.src_dialect],
-                    tgt_dialect=DIALECT_MAP[self.tgt_dialect],
-                    sql=input_sql,
-                    hint=hint,
-                    example=example,
-                    document=document
-                ).strip("\n")
+                sys_prompt, user_prompt = self.format_rewrite_prompt(input_sql, example=example, document=document)
         else:  # Retrieval enhancement not enabled
             # Use normal conversion prompt template
-            sys_prompt = SYSTEM_PROMPT_NA.format(
-                src_dialect=DIALECT_MAP[self.src_dialect],
-                tgt_dialect=DIALECT_MAP[self.tgt_dialect]
-            ).strip("\n")
-            user_prompt = USER_PROMPT_NA.format(
-                src_dialect=DIALECT_MAP[self.src_dialect],
-                tgt_dialect=DIALECT_MAP[self.tgt_dialect],
-                sql=input_sql,
-                example=example
-            ).strip("\n")
+            sys_prompt, user_prompt = self.format_rewrite_prompt(input_sql, example=example)
 
         # Call translator for conversion
         self.add_process(content=process_history_text(user_prompt, role="user", action="translate"),
                          step_name="Rewrite result", sql=input_sql, role="user", is_success=True, error=None)
+        prompt_tokens = self.count_prompt_tokens(history, sys_prompt, user_prompt, action="translate")
+        # A retry must not get the cached answer that just failed the validation back
         answer_raw = self.translator.trans_func(
             history,
             sys_prompt,
-            user_prompt
+            user_prompt,
+            refresh=isinstance(piece, Dict) and piece['Count'] > 0
         )
 
         # Parse model answer using regex
@@ -418,9 +476,48 @@ class Translator:
         answer_raw["Time"] = str(datetime.now())  # Execution time
         answer_raw["SYSTEM_PROMPT"] = sys_prompt  # System prompt
         answer_raw["USER_PROMPT"] = user_prompt  # User prompt
+        answer_raw["Prompt Tokens"] = prompt_tokens  # Prompt tokens
 
         return answer_raw["Answer"], answer_raw
 
+    def format_rewrite_prompt(self, input_sql, example="", document=None):
+        """Build the (system prompt, user prompt) of rewriting input_sql, with the documents if document is not None"""
+        if document is not None:
+            sys_prompt = SYSTEM_PROMPT_RET.format(
+                src_dialect=DIALECT_MAP[self.src_dialect],
+                tgt_dialect=DIALECT_MAP[self.tgt_dialect]
+            ).strip("\n")
+            user_prompt = USER_PROMPT_RET.format(
+                src_dialect=DIALECT_MAP[self.src_dialect],
+                tgt_dialect=DIALECT_MAP[self.tgt_dialect],
+                sql=input_sql,
+                hint="",
+                example=example,
+                document=document
+            ).strip("\n")
+        else:
+            sys_prompt = SYSTEM_PROMPT_NA.format(
+                src_dialect=DIALECT_MAP[self.src_dialect],
+                tgt_dialect=DIALECT_MAP[self.tgt_dialect]
+            ).strip("\n")
+            user_prompt = USER_PROMPT_NA.format(
+                src_dialect=DIALECT_MAP[self.src_dialect],
+                tgt_dialect=DIALECT_MAP[self.tgt_dialect],
+                sql=input_sql,
+                example=example
+            ).strip("\n")
+        return sys_prompt, user_prompt
+
+    def count_prompt_tokens(self, history, sys_prompt, user_prompt, action=None) -> int:
+        """Count the prompt tokens of a model request, the count is recorded as a step of the translation if action is given"""
+        messages = [{"role": "system", "content": sys_prompt}] if sys_prompt is not None else list()
+        messages.extend(history)
+        messages.append({"role": "user", "content": user_prompt})
+        tokens = count_message_tokens(messages, self.translator.model_name)
+        if action is not None:
+            self.prompt_tokens.append({"Action": action, "Prompt Tokens": tokens})
+        return tokens
+
     def do_query_segmentation(self):
         """Get all segments of the SQL statement
         
@@ -434,15 +531,13 @@ class Translator:
         Raises:
             ValueError: Exception thrown when SQL parsing fails
         """
-        # Use ANTLR parser to parse SQL statement
-        root_node, line, col, msg = parse_tree(self.src_sql, self.src_dialect)
+        # Use ANTLR parser to parse SQL statement and get all SQL segments (cached per dialect and SQL)
+        all_pieces, root_node = get_all_piece_by_sql(self.src_sql, self.src_kb_name, self.src_dialect)
         if root_node is None:
             # Throw exception when parsing fails
             raise ValueError(f"Parse error when executing ANTLR parser of {self.src_dialect}.\n"
                              f"The sql is {self.src_sql}")
 
-        # Get all SQL segments
-        all_pieces, root_node = get_all_piece(root_node, self.src_kb_name, self.src_dialect)
         all_pieces = [piece for piece in all_pieces if piece["Type"] != "type"]
 
         # Check if root node is already in segment list
@@ -494,13 +589,14 @@ class Translator:
 
         return back_flag
 
-    def get_document_description(self, piece):
+    def get_document_description(self, piece, budget=None):
         """Get related document description for SQL segment
         
         This method retrieves reference documents related to current SQL segment through vector search.
         
         Args:
             piece: SQL segment dictionary containing keyword and description information
+            budget: Prompt tokens available for the documents, all documents are kept if None
         
         Returns:
             str: Document description in JSON format
@@ -517,10 +613,8 @@ class Translator:
                                    "Type": sub_piece['Type'],
                                    "Detail": sub_piece['Detail']})
 
-        # Store retrieved document information
-        document = list()
-
-        # Process each keyword and description pair
+        # Keep the valid keyword and description pairs
+        pairs = list()
         for key, detail in zip(src_key, src_detail):
             # desc = detail['Description']
             desc = f"{key}--separator--{detail['Detail']}{detail['Description']}"
@@ -528,27 +622,43 @@ class Translator:
             # Skip invalid or root node descriptions
             if desc is None or desc == "The whole SQL snippet above.":
                 continue
+            pairs.append((key, detail, desc))
 
+        # Embed the queries of the piece and its sub-pieces in one batch
+        if self.model_name == "cross-lingual":
+            # Cross-lingual model: use combination of keyword and description for search
+            query_texts = [str(key) + '--separator--' + str(desc) for key, _, desc in pairs]
+        else:
+            # Regular model: use only description for search
+            query_texts = [desc for _, _, desc in pairs]
+        query_embeddings = list()
+        if len(query_texts) != 0:
+            from llm_model.embeddings import embedding_service
+            query_embeddings = embedding_service.embed(query_texts, self.tgt_embedding_model_name)
+
+        # Search the queries of the same content type in one batch
+        search_results = [None] * len(pairs)
+        query_groups = dict()
+        for i, (key, detail, desc) in enumerate(pairs):
+            content_type = "function" if self.model_name == "cross-lingual" else detail['Type']
+            query_groups.setdefault(content_type, list()).append(i)
+        for content_type, indexes in query_groups.items():
+            topk_results = self.vector_db.search_batch(self.tgt_kb_name,
+                                                       [query_embeddings[i].tolist() for i in indexes],
+                                                       content_type=content_type, top_k=self.top_k)
+            for i, topk_result in zip(indexes, topk_results):
+                search_results[i] = topk_result
+
+        # Store retrieved document information
+        document = list()
+
+        # Process each keyword and description pair
+        for (key, detail, desc), topk_result in zip(pairs, search_results):
             # Store search results
             results = list()
             if self.model_name == "cross-lingual":
-                # Cross-lingual model: use combination of keyword and description for search
-                query_embedding = asyncio.run(get_embeddings(
-                    str(key) + '--separator--' + str(desc),
-                    self.tgt_embedding_model_name
-                ))
-                results.extend([ite['content'] for ite in
-                                self.vector_db.search(self.tgt_kb_name, query_embedding.tolist(),
-                                                      content_type="function", top_k=self.top_k)])
+                results.extend([ite['content'] for ite in topk_result])
             else:
-                # Regular model: use only description for search
-                query_embedding = asyncio.run(get_embeddings(
-                    desc,
-                    self.tgt_embedding_model_name
-                ))
-                topk_result = [ite for ite in
-                               self.vector_db.search(self.tgt_kb_name, query_embedding.tolist(),
-                                                     content_type=detail['Type'], top_k=self.top_k)]
                 results.extend(topk_result)
 
             # Deduplication: ensure each keyword appears only once
@@ -569,15 +679,19 @@ class Translator:
             # Build document description
             document.append({
                 # Source dialect segment description
-                f"{DIALECT_MAP[self.src_dialect]} snippet": (
-                    f"`{key}`: {desc.split('--separator--')[-1][:CHUNK_SIZE]}..."
-                ),
-                # Target dialect segment description
-                f"{DIALECT_MAP[self.tgt_dialect]} snippet": [
-                    f"`{tk}`: {tdesc[:CHUNK_SIZE]}" for tk, tdesc in zip(tgt_key, tgt_desc)
-                ]
+                "src": f"`{key}`: {desc.split('--separator--')[-1][:CHUNK_SIZE]}...",
+                # Target dialect segment descriptions, ranked by similarity
+                "tgt": [f"`{tk}`: {tdesc[:CHUNK_SIZE]}" for tk, tdesc in zip(tgt_key, tgt_desc)]
             })
 
+        # Keep the best-ranked descriptions within the budget
+        if budget is not None:
+            document = pack_documents(document, budget, self.translator.model_name)
+        document = [{
+            f"{DIALECT_MAP[self.src_dialect]} snippet": ite["src"],
+            f"{DIALECT_MAP[self.tgt_dialect]} snippet": ite["tgt"]
+        } for ite in document]
+
         # Convert to formatted JSON string
         document = json.dumps(document, indent=4)
 
@@ -671,24 +785,24 @@ class Translator:
                     no = i
                     break
 
-            # Copy model message to avoid modifying original data
-            model_message = copy.deepcopy(model_ans_list[no])
-
-            # Remove action marker
-            model_message.pop("Action")
+            # Only the role and content of the model message are replayed
+            model_message = model_ans_list[no]
 
             # Extract system prompt and user prompt
             sys_prompt = None
             if "SYSTEM_PROMPT" in model_message.keys():
-                sys_prompt = model_message.pop("SYSTEM_PROMPT")
-                user_prompt = model_message.pop("USER_PROMPT")
+                sys_prompt = model_message["SYSTEM_PROMPT"]
+                user_prompt = model_message["USER_PROMPT"]
 
             # Build dialog history
             history.append({
                 "role": "user",
                 "content": user_prompt
             })
-            history.append(model_message)
+            history.append({
+                "role": model_message.get("role", "assistant"),
+                "content": model_message.get("content")
+            })
 
             # Build new user prompt for reflection and evaluation of current conversion result
             user_prompt = USER_PROMPT_REFLECT.format(
@@ -699,6 +813,11 @@ class Translator:
                 snippet=f"`{str(last_time_piece['Node'])}`"
             ).strip("\n")
 
+            # Fall back to the plain judge prompt if the replayed dialog does not fit into the budget of the model
+            if self.count_prompt_tokens(history, sys_prompt, user_prompt) \
+                    > get_prompt_budget(self.translator.model.model_config):
+                history, sys_prompt, user_prompt = list(), None, None
+
         # Call model for judgment
         piece, assist_info, judge_raw = self.model_judge(
             root_node,  # Root node of SQL syntax tree
@@ -758,6 +877,7 @@ class Translator:
         self.add_process(content=process_history_text(user_prompt, role="user", action="judge"),
                          step_name="Rewrite result", sql=current_sql, role="user", is_success=True, error=None)
 
+        prompt_tokens = self.count_prompt_tokens(history, sys_prompt, user_prompt, action="judge")
         answer_raw = self.translator.trans_func(history, sys_prompt, user_prompt)
 
         # Use regular expression to parse model answer
@@ -773,6 +893,7 @@ class Translator:
         answer_raw["Time"] = str(datetime.now())  # Execution time
         answer_raw["SYSTEM_PROMPT"] = sys_prompt  # System prompt
         answer_raw["USER_PROMPT"] = user_prompt  # User prompt
+        answer_raw["Prompt Tokens"] = prompt_tokens  # Prompt tokens
 
         # Initialize return values
         piece, assist_info = None, None
@@ -813,7 +934,7 @@ class Translator:
 
     @db_session_manager
     def direct_rewrite(self):
-        translator = LLMTranslator(self.model_name)
+        translator = self.translator
         history, model_ans_list = list(), list()
 
         sys_prompt = SYSTEM_PROMPT_NA.format(
@@ -845,7 +966,10 @@ class Translator:
         return current_sql, model_ans_list, [], []
 
     def init_out_file(self):
-        res_data = {
+        # The process is appended to a JSON Lines file of its own and exported to out_file by close_out_file,
+        # which the caller must run in a finally clause
+        self.out_sink = JsonlSink(unique_sink_path(self.out_file))
+        self.out_sink.write({
             "info": {
                 "src_dialect": self.src_dialect,
                 "tgt_dialect": self.tgt_dialect,
@@ -853,24 +977,24 @@ class Translator:
                 "model_name": self.model_name,
                 "vector_config": self.vector_config,
                 "tgt_db_config": self.tgt_db_config,
-            },
-            "process_data": []
-        }
-        with open(self.out_file, "w") as wf:
-            json.dump(res_data, wf, indent=4)
+            }
+        })
+
+    def close_out_file(self):
+        """Export the process to out_file as {"info": {...}, "process_data": [...]}"""
+        if self.out_sink is not None:
+            self.out_sink.close()
+            compact_process_file(self.out_sink.path, self.out_file)
+            self.out_sink = None
 
     def add_process(self, content, step_name, sql, role, is_success, error):
         if self.out_type == "file":
             # Add rewrite result record to file
-            with open(self.out_file, "r") as rf:
-                res_data = json.load(rf)
-            res_data["process_data"].append({
+            self.out_sink.write({
                 "role": role, "sql": sql, "content": content,
                 "step_name": step_name, "is_success": is_success,
                 "error": error
             })
-            with open(self.out_file, "w") as wf:
-                json.dump(res_data, wf, indent=4)
 
         elif self.out_type == "db":
             # Add rewrite result record to database
@@ -915,6 +1039,131 @@ class Translator:
         )
 
 
+class BatchTranslator:
+    def __init__(self,
+                 model_name: str,
+                 src_dialect: str,
+                 tgt_dialect: str,
+                 tgt_db_config: dict,
+                 vector_config: dict,
+                 retrieval_on: bool,
+                 top_k: int,
+                 max_retry_time: int = 2,
+                 out_dir: str = None,
+                 max_workers: int = BATCH_MAX_WORKERS,
+                 max_in_flight: int = BATCH_MAX_IN_FLIGHT):
+        """Translate many SQL statements concurrently
+
+        The statements share one LLM translator, one vector database and the connection pool of the
+        target database. At most max_in_flight statements are submitted to the worker pool at a time,
+        and the results are returned in the order of the input.
+
+        Args:
+            model_name, src_dialect, tgt_dialect, tgt_db_config, vector_config, retrieval_on, top_k:
+                Same as Translator
+            max_retry_time: Maximal translation attempts for one segment
+            out_dir: Output Directory to dump the process of each statement
+            max_workers: Number of worker threads
+            max_in_flight: Maximal number of statements submitted but not yet returned
+        """
+        self.model_name = model_name
+        self.src_dialect = src_dialect
+        self.tgt_dialect = tgt_dialect
+        self.tgt_db_config = tgt_db_config
+        self.vector_config = vector_config
+        self.retrieval_on = retrieval_on
+        self.top_k = top_k
+        self.max_retry_time = max_retry_time
+        self.out_dir = out_dir
+        self.max_workers = max_workers
+        self.max_in_flight = max(max_in_flight, max_workers)
+
+        # Shared by all the statements, the workers run in the application context of the caller
+        self.app = current_app._get_current_object()
+        self.llm_translator = None
+        if model_name is not None and model_name != "":
+            from translator.llm_translator import LLMTranslator
+            self.llm_translator = LLMTranslator(model_name)
+        from vector_store.base import get_vector_store
+        self.vector_db = get_vector_store()
+
+        # Output files of the statements are named after the batch and their index in it
+        self.batch_name = f"{src_dialect}_{tgt_dialect}_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}"
+        self.stats_lock = threading.Lock()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.total_latency = 0.0
+        self.start_time = None
+
+    def translate_one(self, no: int, src_sql: str):
+        start_time = time.time()
+        try:
+            with self.app.app_context():
+                translator = Translator(model_name=self.model_name, src_sql=src_sql,
+                                        src_dialect=self.src_dialect, tgt_dialect=self.tgt_dialect,
+                                        tgt_db_config=self.tgt_db_config, vector_config=self.vector_config,
+                                        history_id=None, out_type="file", out_dir=self.out_dir,
+                                        out_name=f"{self.batch_name}_{no}.json",
+                                        retrieval_on=self.retrieval_on, top_k=self.top_k,
+                                        llm_translator=self.llm_translator, vector_db=self.vector_db)
+
+                try:
+                    if not self.tgt_db_config or not self.vector_config:
+                        if not self.model_name and (self.src_dialect in DIALECT_LIST_RULE
+                                                    or self.tgt_dialect not in DIALECT_LIST_RULE):
+                            res = translator.rule_rewrite()
+                        else:
+                            res = translator.direct_rewrite()
+                    else:
+                        res = translator.local_to_global_rewrite(max_retry_time=self.max_retry_time)
+                finally:
+                    translator.close_out_file()
+            success = True
+        except Exception as e:
+            logger.error(f"Batch translation of statement {no} failed: {str(e)}", exc_info=True)
+            res = FAILED_TEMPLATE, [], [], []
+            success = False
+
+        with self.stats_lock:
+            self.completed += 1
+            self.total_latency += time.time() - start_time
+            if not success:
+                self.failed += 1
+        return res
+
+    def run(self, sql_list):
+        """
+        Translate sql_list and yield (translated_sql, model_ans_list, used_pieces, lift_histories)
+        of each statement in the order of sql_list
+        """
+        self.start_time = time.time()
+        futures = deque()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for no, src_sql in enumerate(sql_list):
+                if len(futures) >= self.max_in_flight:
+                    yield futures.popleft().result()
+                futures.append(executor.submit(self.translate_one, no, src_sql))
+                with self.stats_lock:
+                    self.submitted += 1
+            while len(futures) != 0:
+                yield futures.popleft().result()
+
+    def stats(self) -> dict:
+        """Return the throughput statistics of the batch"""
+        with self.stats_lock:
+            elapsed = time.time() - self.start_time if self.start_time is not None else 0.0
+            return {
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "in_flight": self.submitted - self.completed,
+                "elapsed": elapsed,
+                "throughput": self.completed / elapsed if elapsed > 0 else 0.0,
+                "avg_latency": self.total_latency / self.completed if self.completed else 0.0
+            }
+
+
 def parse_args():
     """Parse command line arguments"""
     parser = argparse.ArgumentParser(description='Run Local to Global Dialect Translation.')
@@ -954,16 +1203,27 @@ def parse_args():
 
     parser.add_argument('--out_dir', type=str,
                         help='Output directory to dump translation result')
+    parser.add_argument('--validate_only', action='store_true',
+                        help='Only compile (EXPLAIN / parse) intermediate SQLs on the target database instead of '
+                             'running them, faster but errors raised at execution are missed')
+    parser.add_argument('--max_workers', type=int, default=BATCH_MAX_WORKERS,
+                        help='Number of SQLs translated concurrently')
+    parser.add_argument('--max_in_flight', type=int, default=BATCH_MAX_IN_FLIGHT,
+                        help='Maximal number of SQLs submitted but not yet dumped')
 
     return parser.parse_args()
 
 
 def main():
     args = parse_args()
+    if args.validate_only:
+        from utils.db_connector import set_validate_only
+        set_validate_only(True)
 
     translated_sql_total, model_ans_list_total = list(), list()
     used_pieces_total, lift_histories_total = list(), list()
 
+    from app_factory import create_app
     app = create_app(config_name='PRODUCTION')
     with app.app_context():
         tgt_db_config = None
@@ -972,9 +1232,9 @@ def main():
             tgt_db_config = {
                 "host": args.host,
                 "port": args.port,
-                "user": args.username,
+                "user": args.user,
                 "password": args.password,
-                "db_name": args.database
+                "db_name": args.db_name
             }
 
         vector_config = None
@@ -990,44 +1250,44 @@ def main():
         else:
             sql_list = [args.src_sql]
 
-        for no, src_sql in tqdm(enumerate(sql_list)):
-            translator = Translator(model_name=args.llm_model_name, src_sql=src_sql,
-                                    src_dialect=args.src_dialect, tgt_dialect=args.tgt_dialect,
-                                    tgt_db_config=tgt_db_config, vector_config=vector_config,
-                                    history_id=None, out_type="file", out_dir=args.out_dir,
-                                    retrieval_on=args.retrieval_on, top_k=args.top_k)
-
-            if not tgt_db_config or not vector_config:
-                if not args.llm_model_name and (args.src_dialect in DIALECT_LIST_RULE
-                                                or args.tgt_dialect not in DIALECT_LIST_RULE):
-                    translated_sql, model_ans_list, \
-                        used_pieces, lift_histories = translator.rule_rewrite()
-                else:
-                    translated_sql, model_ans_list, \
-                        used_pieces, lift_histories = translator.direct_rewrite()
-            else:
-                translated_sql, model_ans_list, \
-                    used_pieces, lift_histories = translator.local_to_global_rewrite(max_retry_time=args.max_retry_time)
+        batch_translator = BatchTranslator(model_name=args.llm_model_name,
+                                           src_dialect=args.src_dialect, tgt_dialect=args.tgt_dialect,
+                                           tgt_db_config=tgt_db_config, vector_config=vector_config,
+                                           retrieval_on=args.retrieval_on, top_k=args.top_k,
+                                           max_retry_time=args.max_retry_time, out_dir=args.out_dir,
+                                           max_workers=args.max_workers, max_in_flight=args.max_in_flight)
 
+        progress = tqdm(batch_translator.run(sql_list), total=len(sql_list))
+        for no, (translated_sql, model_ans_list, used_pieces, lift_histories) in enumerate(progress):
             translated_sql_total.append(translated_sql)
-            with open(os.path.join(args.out_dir, "translated_sql_total.json"), "w") as wf:
-                json.dump(translated_sql_total, wf, indent=4)
-
             model_ans_list_total.append(model_ans_list)
-            with open(os.path.join(args.out_dir, "model_ans_list_total.json"), "w") as wf:
-                json.dump(model_ans_list_total, wf, indent=4)
-
             used_pieces_total.append(used_pieces)
-            with open(os.path.join(args.out_dir, "used_pieces_total.json"), "w") as wf:
-                json.dump(used_pieces_total, wf, indent=4)
-
             lift_histories_total.append(lift_histories)
-            with open(os.path.join(args.out_dir, "lift_histories_total.json"), "w") as wf:
-                json.dump(lift_histories_total, wf, indent=4)
+
+            stats = batch_translator.stats()
+            progress.set_postfix(throughput=f"{stats['throughput']:.2f}/s", failed=stats['failed'])
+            if (no + 1) % BATCH_DUMP_INTERVAL == 0 or no + 1 == len(sql_list):
+                dump_total_result(args.out_dir, translated_sql_total, model_ans_list_total,
+                                  used_pieces_total, lift_histories_total)
 
             print(f"The translated SQL is: {translated_sql}")
             print(model_ans_list)
 
+        print(f"Batch translation statistics: {batch_translator.stats()}")
+
+
+def dump_total_result(out_dir, translated_sql_total, model_ans_list_total, used_pieces_total, lift_histories_total):
+    with open(os.path.join(out_dir, "translated_sql_total.json"), "w") as wf:
+        json.dump(translated_sql_total, wf, indent=4)
+
+    with open(os.path.join(out_dir, "model_ans_list_total.json"), "w") as wf:
+        json.dump(model_ans_list_total, wf, indent=4)
+
+    with open(os.path.join(out_dir, "used_pieces_total.json"), "w") as wf:
+        json.dump(used_pieces_total, wf, indent=4)
+
+    with open(os.path.join(out_dir, "lift_histories_total.json"), "w") as wf:
+        json.dump(lift_histories_total, wf, indent=4)
 
 if __name__ == "__main__":
     main()
@@ -3,18 +3,27 @@ import asyncio
 import traceback
 
 from llm_model.llm_manager import llm_manager
+from llm_model.response_cache import llm_response_cache, get_response_cache_key, get_cache_namespace
+from utils.constants import LLM_CACHE_ON, MAX_TOKENS_DEFAULT, TEMPERATURE_DEFAULT
 
 
 class LLMTranslator:
-    def __init__(self, model_name, model_conf=None):
+    def __init__(self, model_name, model_conf=None, use_cache=LLM_CACHE_ON):
         self.model_name = model_name
         self.model_conf = model_conf
+        # Whether to reuse the cached responses of identical deterministic requests
+        self.use_cache = use_cache
         self.model = llm_manager.get_model(self.model_name, self.model_conf)
         self.trans_func = self.chat
         if not self.model:
             raise ValueError(f"Model {self.model_name} not found")
 
-    def chat(self, history: [], sys_prompt, user_prompt):
+    def chat(self, history: [], sys_prompt, user_prompt, use_cache=None, refresh=False):
+        """
+        Chat with the model, deterministic requests are answered from the response cache if use_cache.
+        With refresh, e.g., on the retry of a request whose cached answer failed, the model is asked again
+        and its answer replaces the cached one.
+        """
         if sys_prompt is not None:
             messages = [{"role": "system", "content": sys_prompt}]
         else:
@@ -27,9 +36,22 @@ class LLMTranslator:
                 messages.append(message)
         messages.append({"role": "user", "content": user_prompt})
 
-        # 直接调用模型的chat方法
-        response = self.model.chat(messages)
+        # Only deterministic requests are cached
+        if use_cache is None:
+            use_cache = self.use_cache
+        temperature = self.model.model_config.get('temperature', TEMPERATURE_DEFAULT)
+        if not use_cache or temperature:
+            # 直接调用模型的chat方法
+            return self.model.chat(messages)
 
+        # Namespaced by the configuration of the model instance, not by its name only
+        namespace = get_cache_namespace(self.model.model_config)
+        key = get_response_cache_key(messages, temperature=temperature,
+                                     max_tokens=self.model.model_config.get('max_tokens', MAX_TOKENS_DEFAULT))
+        response = llm_response_cache.get(namespace, key) if not refresh else None
+        if response is None:
+            response = self.model.chat(messages)
+            llm_response_cache.put(namespace, key, response)
         return response
 
     def parse_llm_answer(self, answer, pattern):
@@ -0,0 +1,98 @@
+import threading
+
+import tiktoken
+from typing import Dict, List
+
+from config.logging_config import logger
+from utils.constants import PROMPT_TOKEN_BUDGET, PROMPT_TOKEN_ENCODING, MESSAGE_TOKEN_OVERHEAD
+
+# model name -> tiktoken encoding, None if no encoding can be loaded (e.g., offline without the BPE files)
+encoding_map = dict()
+encoding_lock = threading.Lock()
+
+
+def get_encoding(model_name: str = None):
+    if model_name in encoding_map:
+        return encoding_map[model_name]
+    with encoding_lock:
+        if model_name not in encoding_map:
+            try:
+                encoding = tiktoken.encoding_for_model(model_name)
+            except Exception:
+                # Models unknown to tiktoken (local or non-OpenAI ones) are counted with the default encoding
+                try:
+                    encoding = tiktoken.get_encoding(PROMPT_TOKEN_ENCODING)
+                except Exception as e:
+                    logger.warning(f"Failed to load tiktoken encoding, tokens are estimated: {str(e)}")
+                    encoding = None
+            encoding_map[model_name] = encoding
+    return encoding_map[model_name]
+
+
+def count_tokens(text: str, model_name: str = None) -> int:
+    if not text:
+        return 0
+    encoding = get_encoding(model_name)
+    if encoding is None:
+        # About four characters per token for English text and SQL
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_message_tokens(messages: List[Dict], model_name: str = None) -> int:
+    """Prompt tokens of a chat request, each message costs its content plus a fixed overhead"""
+    return sum(count_tokens(message.get("content"), model_name) + MESSAGE_TOKEN_OVERHEAD for message in messages)
+
+
+def get_prompt_budget(model_config: Dict) -> int:
+    """Prompt tokens allowed for one request to the model, configured by its `prompt_budget`"""
+    return (model_config or dict()).get('prompt_budget') or PROMPT_TOKEN_BUDGET
+
+
+def pack_documents(documents: List[Dict], budget: int, model_name: str = None) -> List[Dict]:
+    """
+    Pack the retrieved documents into the token budget, best-ranked first.
+
+    Args:
+        documents: One document per source snippet, holding the source description ("src") and the
+            descriptions of the retrieved target snippets ranked by similarity ("tgt")
+        budget: Tokens available for the documents
+        model_name: Model whose tokenizer counts the tokens
+
+    Returns:
+        list: The documents with the descriptions that fit, the source descriptions and the top-ranked
+            target descriptions of all snippets are kept before the lower-ranked ones
+    """
+    packed = [{"src": None, "tgt": list()} for _ in documents]
+    # Rank 0 is the source description, rank i the i-th retrieved target description
+    candidates = list()
+    for i, document in enumerate(documents):
+        candidates.append((0, i, document["src"]))
+        for rank, tgt in enumerate(document["tgt"]):
+            candidates.append((rank + 1, i, tgt))
+    candidates.sort(key=lambda item: (item[0], item[1]))
+
+    for rank, i, text in candidates:
+        tokens = count_tokens(text, model_name) + MESSAGE_TOKEN_OVERHEAD
+        if tokens > budget:
+            continue
+        budget -= tokens
+        if rank == 0:
+            packed[i]["src"] = text
+        else:
+            packed[i]["tgt"].append(text)
+    return [document for document in packed if document["src"] is not None or len(document["tgt"]) != 0]
+
+
+def pack_errors(err_info_list: List[Dict], budget: int, model_name: str = None) -> List[Dict]:
+    """Keep the most recent errors that fit into the token budget, in their original order"""
+    packed = list()
+    for item in reversed(err_info_list):
+        tokens = count_tokens(f"-- ERROR: {item['Error']}\n{item['SQL Snippet']}", model_name) \
+                 + MESSAGE_TOKEN_OVERHEAD
+        if tokens > budget:
+            break
+        budget -= tokens
+        packed.append(item)
+    packed.reverse()
+    return packed
@@ -0,0 +1,99 @@
+import os
+import time
+import sqlite3
+import threading
+
+from typing import Optional
+
+from config.logging_config import logger
+from utils.constants import TRANSLATION_MEMORY_PATH, TRANSLATION_MEMORY_MIN_SUCCESS
+
+
+def normalize_fragment(fragment: str) -> str:
+    """Fragments differing only in whitespace share their translations"""
+    return ' '.join(fragment.split())
+
+
+class TranslationMemory:
+    """Persistent memory of the fragment translations validated by successful translations"""
+
+    def __init__(self, path: str = TRANSLATION_MEMORY_PATH, min_success: int = TRANSLATION_MEMORY_MIN_SUCCESS):
+        """
+        Initialize TranslationMemory
+
+        Args:
+            path: SQLite file of the memory, created on first use
+            min_success: Minimal lead of successes over failures for a translation to be reused
+        """
+        self.path = path
+        self.min_success = min_success
+        self.hits = 0
+        self.misses = 0
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _get_conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS translation_memory (
+                    src_dialect TEXT NOT NULL,
+                    tgt_dialect TEXT NOT NULL,
+                    fragment TEXT NOT NULL,
+                    translation TEXT NOT NULL,
+                    keyword TEXT,
+                    success_count INTEGER NOT NULL DEFAULT 0,
+                    failure_count INTEGER NOT NULL DEFAULT 0,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (src_dialect, tgt_dialect, fragment, translation)
+                )""")
+            self._conn.commit()
+        return self._conn
+
+    def lookup(self, fragment: str, src_dialect: str, tgt_dialect: str) -> Optional[str]:
+        """Return the most successful translation of fragment, None if there is no reliable one"""
+        with self._lock:
+            try:
+                row = self._get_conn().execute("""
+                    SELECT translation FROM translation_memory
+                    WHERE src_dialect = ? AND tgt_dialect = ? AND fragment = ? AND success_count - failure_count >= ?
+                    ORDER BY success_count - failure_count DESC, updated_at DESC LIMIT 1""",
+                                               (src_dialect, tgt_dialect, normalize_fragment(fragment),
+                                                self.min_success)).fetchone()
+            except sqlite3.Error as e:
+                logger.error(f"Failed to read translation memory: {str(e)}")
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return row[0]
+
+    def record(self, fragment: str, translation: str, src_dialect: str, tgt_dialect: str,
+               keyword: str = None, success: bool = True):
+        """Count one success (or failure) of translating fragment into translation"""
+        with self._lock:
+            try:
+                conn = self._get_conn()
+                conn.execute("""
+                    INSERT INTO translation_memory VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (src_dialect, tgt_dialect, fragment, translation) DO UPDATE SET
+                        success_count = success_count + excluded.success_count,
+                        failure_count = failure_count + excluded.failure_count,
+                        updated_at = excluded.updated_at""",
+                             (src_dialect, tgt_dialect, normalize_fragment(fragment), translation,
+                              None if keyword is None else str(keyword),
+                              1 if success else 0, 0 if success else 1, time.time()))
+                conn.commit()
+            except sqlite3.Error as e:
+                logger.error(f"Failed to write translation memory: {str(e)}")
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0}
+
+
+# Global translation memory instance
+translation_memory = TranslationMemory()
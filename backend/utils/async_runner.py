@@ -0,0 +1,32 @@
+import asyncio
+import threading
+
+
+class AsyncLoopRunner:
+    """Run coroutines on one event loop living in a background thread"""
+
+    def __init__(self, name: str = "async-loop"):
+        self.name = name
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def get_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None or not self._thread.is_alive():
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever, name=self.name, daemon=True)
+                self._thread.start()
+            return self._loop
+
+    def run(self, coro):
+        """Run coro on the loop of the runner and wait for its result"""
+        return asyncio.run_coroutine_threadsafe(coro, self.get_loop()).result()
+
+    def close(self):
+        with self._lock:
+            if self._loop is not None:
+                self._loop.call_soon_threadsafe(self._loop.stop)
+                self._thread.join()
+                self._loop.close()
+                self._loop = None
@@ -0,0 +1,239 @@
+import os
+import sys
+import json
+import mmap
+import hashlib
+import argparse
+import threading
+
+import numpy as np
+from typing import Dict, Iterator, List, Optional
+
+# File layout: MAGIC, header length (little-endian uint64), JSON header, then 8-byte aligned sections
+# whose offsets in the header are relative to the first 8-byte boundary after the header.
+# Each string column is an offsets section (n + 1 little-endian uint64) and a UTF-8 data section,
+# the type column is dictionary-encoded (uint16 codes into the string table of the header).
+MAGIC = b"CKB\x01"
+FORMAT_VERSION = 1
+STRING_COLUMNS = ["keyword", "description", "detail", "tree", "embedding_text"]
+# Bit of each item field in the per-row presence flags, a field is absent or stored in `rest` if its bit is unset
+FLAG_COLUMNS = ["type", "keyword", "description", "detail", "tree"]
+MISSING_TYPE = 0xFFFF
+
+# path -> ColumnarKB shared by the callers of the process
+kb_map = dict()
+kb_map_lock = threading.Lock()
+
+
+def align(size: int) -> int:
+    return (size + 7) // 8 * 8
+
+
+def get_embedding_text(item: Dict) -> str:
+    return f"{item.get('keyword')}--separator--{item.get('detail')}{item.get('description')}"
+
+
+def is_columnar_kb(path: str) -> bool:
+    try:
+        with open(path, "rb") as rf:
+            return rf.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+def convert_kb_file(json_path: str, out_path: str = None) -> str:
+    """
+    Convert a processed specification document (JSON array of items) into the columnar layout.
+
+    Args:
+        json_path: Path of the JSON document
+        out_path: Path of the columnar file, <json_path without extension>.kbc if None
+
+    Returns:
+        str: Path of the columnar file
+    """
+    if out_path is None:
+        out_path = os.path.splitext(json_path)[0] + ".kbc"
+    with open(json_path, "rb") as rf:
+        content = rf.read()
+    items = json.loads(content)
+    if not isinstance(items, list):
+        raise ValueError(f"JSON content must be in array format, current format: {type(items).__name__}")
+
+    types, type_codes = list(), dict()
+    flags = np.zeros(len(items), dtype=np.uint8)
+    codes = np.full(len(items), MISSING_TYPE, dtype="<u2")
+    columns = {name: list() for name in STRING_COLUMNS + ["rest"]}
+    for i, item in enumerate(items):
+        rest = dict()
+        for bit, name in enumerate(FLAG_COLUMNS):
+            if isinstance(item.get(name), str):
+                flags[i] |= 1 << bit
+            elif name in item:
+                rest[name] = item[name]
+        if flags[i] & 1:
+            if item["type"] not in type_codes:
+                type_codes[item["type"]] = len(types)
+                types.append(item["type"])
+            codes[i] = type_codes[item["type"]]
+        for name in STRING_COLUMNS:
+            if name == "embedding_text":
+                columns[name].append(get_embedding_text(item))
+            else:
+                columns[name].append(item[name] if flags[i] & (1 << FLAG_COLUMNS.index(name)) else "")
+        rest.update({key: value for key, value in item.items() if key not in FLAG_COLUMNS})
+        columns["rest"].append(json.dumps(rest, ensure_ascii=False) if len(rest) != 0 else "")
+
+    sections = [("flags", flags.tobytes()), ("type", codes.tobytes())]
+    for name, values in columns.items():
+        data = [value.encode("utf-8") for value in values]
+        offsets = np.zeros(len(data) + 1, dtype="<u8")
+        np.cumsum([len(value) for value in data], out=offsets[1:])
+        sections.append((f"{name}.offsets", offsets.tobytes()))
+        sections.append((f"{name}.data", b"".join(data)))
+
+    header = {"version": FORMAT_VERSION, "count": len(items), "content_hash": hashlib.sha1(content).hexdigest(),
+              "types": types, "sections": dict()}
+    position = 0
+    for name, data in sections:
+        header["sections"][name] = [position, len(data)]
+        position += align(len(data))
+    header_bytes = json.dumps(header).encode("utf-8")
+
+    tmp_path = out_path + ".tmp"
+    with open(tmp_path, "wb") as wf:
+        wf.write(MAGIC)
+        wf.write(np.array([len(header_bytes)], dtype="<u8").tobytes())
+        wf.write(header_bytes)
+        wf.write(b"\x00" * (align(wf.tell()) - wf.tell()))
+        for name, data in sections:
+            wf.write(data)
+            wf.write(b"\x00" * (align(len(data)) - len(data)))
+    os.replace(tmp_path, out_path)
+    return out_path
+
+
+class ColumnarKB:
+    """Read-only, memory-mapped view of a columnar specification document, shared through the page cache"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ValueError(f"Empty columnar knowledge file: {path}")
+        if self._mm[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f"Not a columnar knowledge file: {path}")
+        header_len = int(np.frombuffer(self._mm, dtype="<u8", count=1, offset=len(MAGIC))[0])
+        header = json.loads(bytes(self._mm[len(MAGIC) + 8:len(MAGIC) + 8 + header_len]))
+        if header.get("version") != FORMAT_VERSION:
+            self.close()
+            raise ValueError(f"Unsupported columnar knowledge file version {header.get('version')}: {path}")
+        self._data_start = align(len(MAGIC) + 8 + header_len)
+        self.count = header["count"]
+        self.content_hash = header["content_hash"]
+        self.types = header["types"]
+        self._sections = header["sections"]
+        self._flags = self._array("flags", np.uint8, self.count)
+        self._type_codes = self._array("type", "<u2", self.count)
+        self._offsets = {name: self._array(f"{name}.offsets", "<u8", self.count + 1)
+                         for name in STRING_COLUMNS + ["rest"]}
+
+    def _array(self, section: str, dtype, count: int) -> np.ndarray:
+        return np.frombuffer(self._mm, dtype=dtype, count=count,
+                             offset=self._data_start + self._sections[section][0])
+
+    def __len__(self) -> int:
+        return self.count
+
+    def get(self, column: str, i: int) -> Optional[str]:
+        """Value of column in row i, None if the item has no such string field"""
+        if column == "type":
+            code = int(self._type_codes[i])
+            return None if code == MISSING_TYPE else self.types[code]
+        if column in FLAG_COLUMNS and not self._flags[i] & (1 << FLAG_COLUMNS.index(column)):
+            return None
+        offsets = self._offsets[column]
+        start = self._data_start + self._sections[f"{column}.data"][0]
+        return self._mm[start + int(offsets[i]):start + int(offsets[i + 1])].decode("utf-8")
+
+    def column(self, column: str) -> Iterator[Optional[str]]:
+        for i in range(self.count):
+            yield self.get(column, i)
+
+    def __getitem__(self, i: int) -> Dict:
+        """Rebuild item i as it was in the JSON document"""
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError(i)
+        item = dict()
+        for name in FLAG_COLUMNS:
+            value = self.get(name, i)
+            if value is not None:
+                item[name] = value
+        rest = self.get("rest", i)
+        if rest:
+            item.update(json.loads(rest))
+        return item
+
+    def __iter__(self) -> Iterator[Dict]:
+        for i in range(self.count):
+            yield self[i]
+
+    def close(self):
+        # The arrays export the buffer of the mapping, they are released before it is closed
+        self._flags = self._type_codes = None
+        self._offsets = dict()
+        if not self._mm.closed:
+            self._mm.close()
+        self._file.close()
+
+
+def open_columnar_kb(path: str) -> ColumnarKB:
+    """Map the columnar file once per process, reopened if it was replaced"""
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    with kb_map_lock:
+        kb, mtime = kb_map.get(path, (None, None))
+        if kb is None or mtime != stat.st_mtime_ns:
+            kb = ColumnarKB(path)
+            kb_map[path] = (kb, stat.st_mtime_ns)
+        return kb
+
+
+def read_kb_items(path: str) -> List[Dict]:
+    """Items of a specification document, either a JSON array or a columnar file"""
+    if is_columnar_kb(path):
+        return list(open_columnar_kb(path))
+    with open(path, "r", encoding="utf-8") as rf:
+        return json.load(rf)
+
+
+def get_kb_file_hash(path: str) -> str:
+    """Content hash of a specification document, the columnar file keeps the hash of its JSON source"""
+    if is_columnar_kb(path):
+        return open_columnar_kb(path).content_hash
+    with open(path, "rb") as rf:
+        return hashlib.sha1(rf.read()).hexdigest()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Convert processed specification documents to the columnar layout.')
+    parser.add_argument('json_paths', type=str, nargs='+', help='JSON documents to convert')
+    parser.add_argument('--out_dir', type=str, default=None,
+                        help='Directory of the columnar files, next to the JSON documents if not given')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    for json_path in args.json_paths:
+        out_path = None
+        if args.out_dir is not None:
+            os.makedirs(args.out_dir, exist_ok=True)
+            out_path = os.path.join(args.out_dir, os.path.splitext(os.path.basename(json_path))[0] + ".kbc")
+        print(f"{json_path} -> {convert_kb_file(json_path, out_path)}", file=sys.stderr)
@@ -3,11 +3,33 @@
 TOP_K = 1
 CHUNK_SIZE = 250
 
+# Prompt tokens of one model request unless the model config sets `prompt_budget`,
+# tiktoken encoding of the models unknown to tiktoken and tokens added by each chat message
+PROMPT_TOKEN_BUDGET = 8000
+PROMPT_TOKEN_ENCODING = "cl100k_base"
+MESSAGE_TOKEN_OVERHEAD = 4
+
+PARSE_CACHE_SIZE = 256
+
+# Knowledge-base pattern trees compiled once per KB content, bump the version when TreeNode changes
+PATTERN_CACHE_DIR = "./instance/pattern_cache"
+PATTERN_CACHE_VERSION = 2
+
 RETRIEVAL_ON = True
 MAX_RETRY_TIME = 2
 
 MAX_TOKENS_DEFAULT = 8192
 TEMPERATURE_DEFAULT = 0.0
+
+# Cloud LLM requests: run on a shared event loop, in-flight requests and requests per minute of one model
+CLOUD_LLM_ASYNC = True
+CLOUD_LLM_MAX_CONCURRENCY = 8
+CLOUD_LLM_RPM = 500
+CLOUD_LLM_MAX_CONNECTIONS = 32
+
+# Local LLM requests: maximal requests generated in one batch, seconds waited for a batch to fill
+LLM_BATCH_MAX_SIZE = 8
+LLM_BATCH_WINDOW = 0.02
 FAILED_TEMPLATE = 'Cannot translate!'
 
 TRANSLATION_ANSWER_PATTERN = r'"Answer":\s*(.*?)\s*,\s*"Reasoning":\s*(.*?),\s*"Confidence":\s*(.*?)\s'
@@ -26,6 +48,69 @@ DIALECT_MAP = {
 
 ORACLE_COMMAND_OPEN = False
 
+# Only compile (EXPLAIN / parse) intermediate SQL on the target database instead of running it.
+# Off by default: compiling misses the errors raised at execution (e.g., type errors of values, failing
+# functions on PostgreSQL and MySQL) that drive the repair loop. Turned on by translate.py --validate_only
+SQL_VALIDATE_ONLY = False
+# Maximal rows fetched from the target database and statement timeout (seconds)
+SQL_MAX_FETCH_ROWS = 1000
+SQL_STATEMENT_TIMEOUT = 30
+# Memoized validation results of intermediate SQL, time to live in seconds
+VALIDATION_CACHE_SIZE = 4096
+VALIDATION_CACHE_TTL = 600
+
+# Connection pool of the target database, one pool per (dialect, host, port, user, db_name)
+DB_POOL_MAX_SIZE = 4
+DB_POOL_IDLE_TIMEOUT = 300
+DB_POOL_CHECKOUT_TIMEOUT = 30
+DB_POOL_PING_INTERVAL = 30
+
+# Batch translation: worker threads, statements submitted but not yet returned, result dump interval
+BATCH_MAX_WORKERS = 4
+BATCH_MAX_IN_FLIGHT = 16
+BATCH_DUMP_INTERVAL = 50
+
+# Translation process written as JSON Lines: records buffered before a write, minimal seconds between fsync
+JSONL_FLUSH_INTERVAL = 16
+JSONL_FSYNC_INTERVAL = 5
+
+# Threads querying the collections of a knowledge base in parallel
+CHROMA_SEARCH_WORKERS = 8
+
+# Embeddings cached in memory (number of texts) and on disk, keyed by (model name, text hash)
+EMBEDDING_CACHE_ON = True
+EMBEDDING_CACHE_SIZE = 20000
+EMBEDDING_CACHE_DIR = "./instance/embedding_cache"
+
+# Responses of deterministic (temperature 0) LLM requests, time to live in seconds
+LLM_CACHE_ON = True
+LLM_CACHE_PATH = "./instance/llm_cache.db"
+LLM_CACHE_TTL = 7 * 24 * 3600
+LLM_CACHE_MAX_ENTRIES = 100000
+
+# Fragment translations validated by successful translations, reused once they succeeded MIN_SUCCESS times
+TRANSLATION_MEMORY_ON = True
+TRANSLATION_MEMORY_PATH = "./instance/translation_memory.db"
+TRANSLATION_MEMORY_MIN_SUCCESS = 1
+
+# Knowledge-base import: characters read at once from a JSON document, items deduplicated and inserted per commit
+JSON_READ_CHUNK_SIZE = 1 << 20
+KB_IMPORT_CHUNK_SIZE = 500
+
+# Vectorization of pending knowledge entries: entries embedded and checkpointed together, embedding threads,
+# chunks submitted but not yet written to the vector database
+VECTORIZE_CHUNK_SIZE = 256
+VECTORIZE_WORKERS = 4
+VECTORIZE_MAX_IN_FLIGHT = 8
+
+# Vector store: "chroma", or "numpy" for an exact in-process index of memory-mapped matrices (small knowledge bases)
+VECTOR_BACKEND = "chroma"
+CHROMA_PERSIST_DIR = "./instance/chroma"
+# Numpy index: vectors stored as "float32" or "int8" (quantized with one scale per vector), rows scored per product
+NUMPY_INDEX_DIR = "./instance/numpy_index"
+NUMPY_INDEX_DTYPE = "float32"
+NUMPY_SEARCH_BLOCK = 256
+
 TRANSLATION_RESULT_TEMP = r"""
 The translated SQL is:
 ```sql
@@ -1,6 +1,8 @@
 import re
 import time
 import logging
+import threading
+from contextlib import contextmanager
 
 import func_timeout
 from func_timeout import func_set_timeout
@@ -12,119 +14,438 @@ import psycopg2
 from psycopg2 import Error
 import oracledb
 
-from utils.constants import ORACLE_COMMAND_OPEN
-
-mysql_conn_map = {}
-mysql_cursor_map = {}
-
-
-def sql_execute(dialect: str, tgt_db_config: dict, sql: str):
+from utils.constants import ORACLE_COMMAND_OPEN, DB_POOL_MAX_SIZE, DB_POOL_IDLE_TIMEOUT, \
+    DB_POOL_CHECKOUT_TIMEOUT, DB_POOL_PING_INTERVAL, SQL_MAX_FETCH_ROWS, SQL_STATEMENT_TIMEOUT, \
+    SQL_VALIDATE_ONLY, VALIDATION_CACHE_SIZE, VALIDATION_CACHE_TTL
+from utils.lru_cache import LRUCache
+
+
+class ConnectionPool:
+    """Thread-safe connection pool of one target database"""
+
+    def __init__(self, dialect: str, db_config: dict, max_size: int = DB_POOL_MAX_SIZE,
+                 idle_timeout: float = DB_POOL_IDLE_TIMEOUT, checkout_timeout: float = DB_POOL_CHECKOUT_TIMEOUT,
+                 ping_interval: float = DB_POOL_PING_INTERVAL):
+        """
+        Initialize ConnectionPool
+
+        Args:
+            dialect: Database dialect, one of pg/mysql/oracle
+            db_config: Target database configuration (host, port, user, password, db_name)
+            max_size: Maximum number of open connections
+            idle_timeout: Idle connections unused for longer than this (seconds) are closed
+            checkout_timeout: Maximum waiting time (seconds) for a free connection
+            ping_interval: Idle connections unused for longer than this (seconds) are checked before reuse
+        """
+        self.dialect = dialect
+        self.db_config = dict(db_config)
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.checkout_timeout = checkout_timeout
+        self.ping_interval = ping_interval
+
+        self._idle = []  # [(connection, last used time)], the most recently used at the end
+        self._size = 0
+        # Set by close, the connections checked out at that time are closed when they are released
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def _connect(self):
+        if self.dialect == 'mysql':
+            return mysql_db_connect(self.db_config)
+        elif self.dialect == 'pg':
+            return pg_db_connect(self.db_config)
+        elif self.dialect == 'oracle':
+            return oracle_db_connect(self.db_config)
+        else:
+            raise ValueError(f"{self.dialect} is not supported")
+
+    def is_alive(self, connection, ping: bool = True) -> bool:
+        """Check whether the connection is still usable, ping the server if required"""
+        try:
+            if self.dialect == 'mysql':
+                if not connection.open:
+                    return False
+                if ping:
+                    connection.ping(reconnect=False)
+            elif self.dialect == 'pg':
+                if connection.closed:
+                    return False
+                if ping:
+                    with connection.cursor() as cursor:
+                        cursor.execute("SELECT 1")
+                    connection.rollback()
+            elif self.dialect == 'oracle':
+                if not connection.is_healthy():
+                    return False
+                if ping:
+                    connection.ping()
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close(connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def _evict_idle(self):
+        now = time.time()
+        alive = []
+        for connection, last_used in self._idle:
+            if now - last_used > self.idle_timeout:
+                self._close(connection)
+                self._size -= 1
+            else:
+                alive.append((connection, last_used))
+        self._idle = alive
+
+    def acquire(self):
+        """Check out a connection exclusively for the calling thread"""
+        deadline = time.time() + self.checkout_timeout
+        with self._cond:
+            self._evict_idle()
+            while True:
+                if self._idle:
+                    connection, last_used = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    connection, last_used = None, None
+                    self._size += 1
+                    break
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise TimeoutError(f"No free {self.dialect} connection to "
+                                       f"{self.db_config['host']}:{self.db_config['port']} "
+                                       f"within {self.checkout_timeout} s")
+                self._cond.wait(remaining)
+
+        if connection is not None:
+            if self.is_alive(connection, ping=time.time() - last_used > self.ping_interval):
+                return connection
+            logging.warning(f"Broken {self.dialect} connection found in the pool, reconnecting")
+            self._close(connection)
+
+        try:
+            return self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, connection, discard: bool = False):
+        """Give the connection back to the pool, close it instead if discard is set or the pool is closed"""
+        with self._cond:
+            if discard or self._closed:
+                self._close(connection)
+                self._size -= 1
+            else:
+                self._idle.append((connection, time.time()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """Check out a connection, discard it on exit if it is broken"""
+        connection = self.acquire()
+        try:
+            yield connection
+        except Exception:
+            self.release(connection, discard=not self.is_alive(connection, ping=False))
+            raise
+        self.release(connection, discard=not self.is_alive(connection, ping=False))
+
+    def close(self):
+        """
+        Drain the pool: the idle connections are closed at once, the checked-out ones once they are released
+        """
+        with self._cond:
+            self._closed = True
+            for connection, _ in self._idle:
+                self._close(connection)
+                self._size -= 1
+            self._idle = []
+
+
+pool_map = {}
+pool_map_lock = threading.Lock()
+
+
+def get_pool_key(dialect: str, db_config: dict):
+    return dialect, db_config["host"], str(db_config["port"]), db_config["user"], db_config["db_name"]
+
+
+def get_pool(dialect: str, db_config: dict) -> ConnectionPool:
+    key = get_pool_key(dialect, db_config)
+    with pool_map_lock:
+        if key not in pool_map:
+            pool_map[key] = ConnectionPool(dialect, db_config)
+        return pool_map[key]
+
+
+def close_pools(dialect: str = None, db_name: str = None):
+    """
+    Drain the pools matching dialect and db_name (all if None) and forget them: their idle connections are
+    closed at once, the connections in use are closed when released, later calls get new pools
+    """
+    with pool_map_lock:
+        for key, pool in list(pool_map.items()):
+            if (dialect is None or key[0] == dialect) and (db_name is None or key[4] == db_name):
+                pool.close()
+                del pool_map[key]
+
+
+def pooled_execute(dialect: str, db_config: dict, execute_func):
+    """
+    Run execute_func(connection) on a pooled connection.
+    Retry once on a fresh connection if the connection turns out to be broken.
+    """
+    pool = get_pool(dialect, db_config)
+    res = None
+    for _ in range(2):
+        with pool.connection() as connection:
+            res = execute_func(connection)
+            if pool.is_alive(connection, ping=False):
+                return res
+        logging.warning(f"{dialect} connection lost while executing, retrying on a new connection")
+    return res
+
+
+# Statements that can be compiled without being executed, other statements are always executed
+PG_EXPLAINABLE_PATTERN = re.compile(r'^[\s(]*(SELECT|WITH|INSERT|UPDATE|DELETE|VALUES|TABLE)\b', re.IGNORECASE)
+MYSQL_EXPLAINABLE_PATTERN = re.compile(r'^[\s(]*(SELECT|WITH|INSERT|UPDATE|DELETE|REPLACE|TABLE)\b', re.IGNORECASE)
+ORACLE_PARSABLE_PATTERN = re.compile(r'^[\s(]*(SELECT|WITH|INSERT|UPDATE|DELETE|MERGE)\b', re.IGNORECASE)
+# Queries whose result can be read through a server-side cursor on PostgreSQL
+PG_CURSOR_PATTERN = re.compile(r'^[\s(]*(SELECT|VALUES|TABLE)\b', re.IGNORECASE)
+# Statements that change the schema, they are committed implicitly on MySQL and Oracle
+DDL_PATTERN = re.compile(r'^[\s(]*(CREATE|ALTER|DROP|TRUNCATE|RENAME)\b', re.IGNORECASE)
+
+# (dialect, db fingerprint, schema generation, sql) -> (flag, error info) of sql_validate
+validation_cache = LRUCache(maxsize=VALIDATION_CACHE_SIZE, ttl=VALIDATION_CACHE_TTL)
+# (host, port, db_name) -> schema generation, bumped by invalidate_validation_cache
+validation_generation = {}
+validation_generation_lock = threading.Lock()
+# Whether sql_validate only compiles the sql, see set_validate_only
+validate_only = SQL_VALIDATE_ONLY
+
+
+def get_db_fingerprint(db_config: dict):
+    # Users with different privileges get different outcomes on the same database
+    return db_config["host"], str(db_config["port"]), db_config["db_name"], db_config["user"]
+
+
+def invalidate_validation_cache(db_config: dict = None):
+    """
+    Drop the memoized validation results of the target database, e.g., after its schema changed.
+    All results are dropped if db_config is None.
+    """
+    if db_config is None:
+        validation_cache.clear()
+    else:
+        fingerprint = get_db_fingerprint(db_config)
+        # The schema is shared by all the users of the database
+        with validation_generation_lock:
+            validation_generation[fingerprint[:3]] = validation_generation.get(fingerprint[:3], 0) + 1
+
+
+def set_validate_only(flag: bool):
+    """
+    Make sql_validate only compile intermediate SQL (EXPLAIN / parse) instead of running it.
+    Cheaper and free of side effects, but the errors raised at execution are no longer seen.
+    """
+    global validate_only
+    validate_only = flag
+
+
+def get_validation_cache_stats() -> dict:
+    return validation_cache.stats()
+
+
+def sql_validate(dialect: str, tgt_db_config: dict, sql: str):
+    """
+    Check whether sql is valid on the target database and return (flag, error info).
+    The outcome is memoized per target database and sql, so that repeated probes of the same
+    intermediate SQL (within or across translations) do not hit the database again.
+    """
+    fingerprint = get_db_fingerprint(tgt_db_config)
+    with validation_generation_lock:
+        generation = validation_generation.get(fingerprint[:3], 0)
+    mode = validate_only
+    key = (dialect, fingerprint, generation, mode, sql.strip().rstrip(';').strip())
+    res = validation_cache.get(key)
+    if res is None:
+        res = sql_execute(dialect, tgt_db_config, sql, validate_only=mode, max_rows=0)
+        # Timeouts depend on the load of the database rather than on the sql
+        if res[0] or 'timeout' not in str(res[1]).lower():
+            validation_cache.put(key, res)
+    return res
+
+
+def sql_execute(dialect: str, tgt_db_config: dict, sql: str, validate_only: bool = False,
+                max_rows: int = SQL_MAX_FETCH_ROWS):
+    """
+    Execute sql on the target database and return (flag, rows or error info).
+    If validate_only is set, the statement is only compiled by the database (EXPLAIN on PostgreSQL and MySQL,
+    parse on Oracle) and never run, the rows are then the plan (or None) instead of the query result.
+    At most max_rows rows are fetched, rows are not returned at all (None) if max_rows is 0.
+    """
     if dialect == 'pg':
-        return pg_sql_execute(tgt_db_config, sql)
+        return pg_sql_execute(tgt_db_config, sql, validate_only, max_rows)
     elif dialect == 'mysql':
-        return mysql_sql_execute(tgt_db_config, sql)
+        res = mysql_sql_execute(tgt_db_config, sql, validate_only, max_rows)
     elif dialect == 'oracle':
-        return oracle_sql_execute(tgt_db_config, sql)
+        res = oracle_sql_execute(tgt_db_config, sql, validate_only=validate_only, max_rows=max_rows)
     else:
         raise ValueError(f"{dialect} is not supported")
+    # DDL is not rolled back on MySQL and Oracle
+    if res[0] and DDL_PATTERN.match(sql):
+        invalidate_validation_cache(tgt_db_config)
+    return res
+
+
+# (host, port) -> statement timeout variable of the MySQL server: max_execution_time (MySQL 5.7.8+, milliseconds),
+# max_statement_time (MariaDB 10.1+, seconds), or None if the server knows neither
+mysql_timeout_variable = {}
+MYSQL_TIMEOUT_VARIABLES = [("max_execution_time", 1000), ("max_statement_time", 1)]
+MYSQL_UNKNOWN_SYSTEM_VARIABLE = 1193
+
+
+def init_mysql_session(connection, db_config):
+    """Abort long statements on the server, through the timeout variable the server supports"""
+    server = (db_config["host"], str(db_config["port"]))
+    with connection.cursor() as cursor:
+        if server in mysql_timeout_variable:
+            variables = [(name, unit) for name, unit in MYSQL_TIMEOUT_VARIABLES
+                         if name == mysql_timeout_variable[server]]
+        else:
+            variables = MYSQL_TIMEOUT_VARIABLES
+        for name, unit in variables:
+            try:
+                cursor.execute(f"SET SESSION {name} = {SQL_STATEMENT_TIMEOUT * unit}")
+                mysql_timeout_variable[server] = name
+                return
+            except pymysql.Error as e:
+                if not e.args or e.args[0] != MYSQL_UNKNOWN_SYSTEM_VARIABLE:
+                    raise
+        if server not in mysql_timeout_variable:
+            logging.warning(f"MySQL server {server[0]}:{server[1]} supports no statement timeout, "
+                            f"validated statements are only bounded by the read timeout and a one-row limit")
+        mysql_timeout_variable[server] = None
 
 
 def mysql_db_connect(db_config):
-    dbname = db_config["db_name"]
     try:
         connection = pymysql.connect(database=db_config["db_name"],
                                      user=db_config["user"],
                                      password=db_config["password"],
                                      host=db_config["host"],
-                                     port=int(db_config["port"]))
-        cursor = connection.cursor()
-        mysql_conn_map[dbname] = connection
-        mysql_cursor_map[dbname] = cursor
-        if connection.open:
-            return connection, cursor
-    except Error as e:
+                                     port=int(db_config["port"]),
+                                     read_timeout=SQL_STATEMENT_TIMEOUT + 10)
+        try:
+            init_mysql_session(connection, db_config)
+        except Exception:
+            connection.close()
+            raise
+        return connection
+    except pymysql.Error as e:
         logging.error(f"Error while connecting to MySQL: {e}")
+        raise
 
 
-def mysql_sql_execute(db_config: dict, sql):
-    db_name = db_config["db_name"]
-    if db_name not in mysql_conn_map:
-        mysql_db_connect(db_config)
-    connection = mysql_conn_map[db_name]
-    cursor = mysql_cursor_map[db_name]
-    try:
-        cursor.execute(sql)
-        rows = cursor.fetchall()
-        connection.rollback()
-        return True, rows
-    except pymysql.Error as e:
-        connection.rollback()
-        return False, e.args[1]
+def mysql_sql_execute(db_config: dict, sql, validate_only=False, max_rows=SQL_MAX_FETCH_ROWS):
+    if validate_only and MYSQL_EXPLAINABLE_PATTERN.match(sql):
+        # The error message keeps the `near '...' at line 1` part of the original statement
+        sql = f"EXPLAIN {sql}"
 
+    server = (db_config["host"], str(db_config["port"]))
 
-def close_mysql_connnect(dbname: str):
-    connection = mysql_conn_map[dbname]
-    cursor = mysql_cursor_map[dbname]
-    if connection.is_connected():
-        cursor.close()
-        connection.close()
-        logging.info("MySQL connection is closed")
+    def execute(connection):
+        # Without a statement timeout, let the server stop a validated query after its first row
+        limit_rows = max_rows == 0 and mysql_timeout_variable.get(server) is None
+        cursor = connection.cursor()
+        try:
+            if limit_rows:
+                cursor.execute("SET SESSION sql_select_limit = 1")
+            cursor.execute(sql)
+            rows = cursor.fetchmany(max_rows) if max_rows else None
+            connection.rollback()
+            return True, rows
+        except pymysql.Error as e:
+            if connection.open:
+                connection.rollback()
+            return False, e.args[1] if len(e.args) > 1 else str(e)
+        finally:
+            if limit_rows and connection.open:
+                # The connection goes back to the pool, it must not keep the limit
+                try:
+                    cursor.execute("SET SESSION sql_select_limit = DEFAULT")
+                except pymysql.Error:
+                    connection.close()
+            cursor.close()
+
+    return pooled_execute('mysql', db_config, execute)
 
 
-pg_conn_map = {}
-pg_cursor_map = {}
+def close_mysql_connnect(dbname: str):
+    close_pools('mysql', dbname)
+    logging.info("MySQL connection is closed")
 
 
 def pg_db_connect(db_config):
-    dbname = db_config["db_name"]
     try:
         connection = psycopg2.connect(database=db_config["db_name"],
                                       user=db_config["user"],
                                       password=db_config["password"],
                                       host=db_config["host"],
-                                      port=db_config["port"])
-
-        cursor = connection.cursor()
-
-        pg_conn_map[dbname] = connection
-        pg_cursor_map[dbname] = cursor
-        if connection:
-            return connection, cursor
-
+                                      port=db_config["port"],
+                                      options=f"-c statement_timeout={SQL_STATEMENT_TIMEOUT * 1000}")
+        return connection
     except (Exception, Error) as error:
         logging.error(f"Error while connecting to PostgreSQL: {error}")
+        raise
 
 
-def pg_sql_execute(db_config: dict, sql):
-    db_name = db_config['db_name']
-    if db_name not in pg_conn_map:
-        pg_db_connect(db_config)
-    connection = pg_conn_map[db_name]
-    cursor = pg_cursor_map[db_name]
-    try:
-        cursor.execute(sql)
-        if cursor.description:
-            rows = cursor.fetchall()
-        else:
-            rows = None
-        connection.rollback()
-        return True, rows
-    except (Exception, Error) as error:
-        connection.rollback()
-        return False, f"Error while executing PostgreSQL query: {error}"
-
+def pg_sql_execute(db_config: dict, sql, validate_only=False, max_rows=SQL_MAX_FETCH_ROWS):
+    explain = validate_only and PG_EXPLAINABLE_PATTERN.match(sql)
+    stream = not explain and PG_CURSOR_PATTERN.match(sql) and not re.search(r'\bINTO\b', sql, re.IGNORECASE)
+    # Put the prefix on its own line, so that the original statement starts at LINE 2 of the error message
+    if explain:
+        sql = f"EXPLAIN\n{sql}"
+    elif stream:
+        sql = f"DECLARE cracksql_cursor NO SCROLL CURSOR FOR\n{sql}"
 
-def close_pg_connect(db_name: str):
-    connection = pg_conn_map[db_name]
-    cursor = pg_cursor_map[db_name]
-    if connection:
-        cursor.close()
-        connection.close()
-        logging.info("PostgreSQL connection is closed")
+    def execute(connection):
+        cursor = connection.cursor()
+        try:
+            cursor.execute(sql)
+            if stream:
+                # Fetch at least one row, so that the query is actually run
+                cursor.execute(f"FETCH FORWARD {max(max_rows, 1)} FROM cracksql_cursor")
+            if cursor.description and max_rows:
+                rows = cursor.fetchmany(max_rows)
+            else:
+                rows = None
+            connection.rollback()
+            return True, rows
+        except (Exception, Error) as error:
+            if not connection.closed:
+                connection.rollback()
+            error = str(error)
+            if explain or stream:
+                error = re.sub(r'^LINE (\d+):', lambda m: f"LINE {int(m.group(1)) - 1}:", error, flags=re.MULTILINE)
+            return False, f"Error while executing PostgreSQL query: {error}"
+        finally:
+            if not connection.closed:
+                cursor.close()
+
+    return pooled_execute('pg', db_config, execute)
 
 
-oracle_conn_map = {}
-oracle_cursor_map = {}
+def close_pg_connect(db_name: str):
+    close_pools('pg', db_name)
+    logging.info("PostgreSQL connection is closed")
 
 
 @func_set_timeout(6)
@@ -149,62 +470,70 @@ def read_output(shell, prompt, timeout=15):
 
 
 def oracle_db_connect(db_config):
-    db_name = db_config["db_name"]  # db_config["user"]
     dsn = f"{db_config['host']}:{db_config['port']}/{db_config['db_name']}"
     connection = oracledb.connect(user=db_config["user"], password=db_config["password"], dsn=dsn)
-    cursor = connection.cursor()
-
-    oracle_cursor_map[db_name] = cursor
-    oracle_conn_map[db_name] = connection
-    return connection, cursor
-
+    connection.call_timeout = SQL_STATEMENT_TIMEOUT * 1000
+    return connection
 
-def oracle_sql_execute(db_config: dict, sql, flag=False):
-    db_name = db_config["db_name"]
-    if db_name not in oracle_conn_map:
-        oracle_db_connect(db_config)
-    connection = oracle_conn_map[db_name]
-    cursor = oracle_cursor_map[db_name]
-    try:
-        cursor.execute(sql.strip(';'))
-        rows = cursor.fetchall()
-        connection.rollback()
-        return True, rows
-    except (Exception, Error) as error:
-        connection.rollback()
-        if ORACLE_COMMAND_OPEN:
-            ssh = paramiko.SSHClient()
-            ssh.load_system_host_keys()
-            ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            ssh.connect("your host", username='your name', password='your password')
 
-            shell = ssh.invoke_shell()
-            shell.send(f'sqlplus {db_config["db_name"]}/{db_config["password"]}@//'
-                       f'{db_config["host"]}:{db_config["port"]}/your service\n')
-
-            time.sleep(2)
-
-            try:
-                read_output(shell, prompt="SQL>")
-
-                shell.send(f"{sql.strip(';')};\n")
-
-                output = read_output(shell, "SQL>")
-                output = output.replace(f"{sql.strip(';')};\r\n", "").replace("\r\n\r\n\r\nSQL>", "")
-            except func_timeout.exceptions.FunctionTimedOut as e:
-                ssh.close()
-                return False, f"Error occurs while executing the query: {error}"
+def oracle_sql_execute(db_config: dict, sql, flag=False, validate_only=False, max_rows=SQL_MAX_FETCH_ROWS):
+    parse_only = validate_only and ORACLE_PARSABLE_PATTERN.match(sql)
 
+    def execute(connection):
+        cursor = connection.cursor()
+        try:
+            if parse_only:
+                # Only parse queries and DML, DDL would be executed by the parse call as well
+                cursor.parse(sql.strip(';'))
+                return True, None
+            # Rows are streamed from the server in batches of arraysize
+            cursor.arraysize = cursor.prefetchrows = max(max_rows, 1)
+            cursor.execute(sql.strip(';'))
+            rows = cursor.fetchmany(max_rows) if max_rows and cursor.description else None
+            connection.rollback()
+            return True, rows
+        except (Exception, Error) as error:
+            if connection.is_healthy():
+                connection.rollback()
+            return False, error
+        finally:
+            if connection.is_healthy():
+                cursor.close()
+
+    flag, res = pooled_execute('oracle', db_config, execute)
+    if flag:
+        return True, res
+
+    error = res
+    if ORACLE_COMMAND_OPEN:
+        ssh = paramiko.SSHClient()
+        ssh.load_system_host_keys()
+        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        ssh.connect("your host", username='your name', password='your password')
+
+        shell = ssh.invoke_shell()
+        shell.send(f'sqlplus {db_config["db_name"]}/{db_config["password"]}@//'
+                   f'{db_config["host"]}:{db_config["port"]}/your service\n')
+
+        time.sleep(2)
+
+        try:
+            read_output(shell, prompt="SQL>")
+
+            shell.send(f"{sql.strip(';')};\n")
+
+            output = read_output(shell, "SQL>")
+            output = output.replace(f"{sql.strip(';')};\r\n", "").replace("\r\n\r\n\r\nSQL>", "")
+        except func_timeout.exceptions.FunctionTimedOut as e:
             ssh.close()
-            return False, output
-        else:
             return False, f"Error occurs while executing the query: {error}"
 
+        ssh.close()
+        return False, output
+    else:
+        return False, f"Error occurs while executing the query: {error}"
+
 
 def close_oracle_connect(db_name: str):
-    connection = oracle_conn_map[db_name]
-    cursor = oracle_cursor_map[db_name]
-    if connection:
-        cursor.close()
-        connection.close()
-        logging.info("Oracle connection is closed")
+    close_pools('oracle', db_name)
+    logging.info("Oracle connection is closed")
@@ -0,0 +1,75 @@
+import json
+
+from typing import Any, IO, Iterator
+
+from utils.constants import JSON_READ_CHUNK_SIZE
+
+WHITESPACE = " \t\n\r"
+
+
+def iter_json_array(file: IO[str], chunk_size: int = JSON_READ_CHUNK_SIZE) -> Iterator[Any]:
+    """
+    Yield the elements of a top-level JSON array one by one, reading the file chunk by chunk.
+
+    Args:
+        file: Text file holding the array
+        chunk_size: Number of characters read at once
+
+    Raises:
+        ValueError: The document is not a JSON array (json.JSONDecodeError for malformed elements)
+    """
+    decoder = json.JSONDecoder()
+    buf, pos, eof = "", 0, False
+
+    def fill() -> bool:
+        nonlocal buf, pos, eof
+        data = file.read(chunk_size)
+        if not data:
+            eof = True
+            return False
+        # Drop the consumed prefix so that the buffer holds at most one chunk plus one element
+        buf = buf[pos:] + data
+        pos = 0
+        return True
+
+    def skip_whitespace():
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in WHITESPACE:
+                pos += 1
+            if pos < len(buf) or not fill():
+                return
+
+    fill()
+    if buf.startswith("﻿"):
+        pos = 1
+    skip_whitespace()
+    if pos >= len(buf) or buf[pos] != "[":
+        raise ValueError("JSON content must be in array format")
+    pos += 1
+    skip_whitespace()
+    if pos < len(buf) and buf[pos] == "]":
+        return
+
+    while True:
+        try:
+            element, end = decoder.raw_decode(buf, pos)
+            # A number cut by the chunk boundary (e.g., "1." of "1.5") is decoded as a shorter one
+            if not eof and (end == len(buf) or buf[end] not in WHITESPACE + ",]"):
+                raise json.JSONDecodeError("Element may continue", buf, end)
+        except json.JSONDecodeError:
+            if eof or not fill():
+                raise
+            continue
+        pos = end
+        yield element
+
+        skip_whitespace()
+        if pos >= len(buf):
+            raise json.JSONDecodeError("Unterminated array", buf, pos)
+        if buf[pos] == "]":
+            return
+        if buf[pos] != ",":
+            raise json.JSONDecodeError("Expecting ',' delimiter", buf, pos)
+        pos += 1
+        skip_whitespace()
@@ -0,0 +1,113 @@
+import os
+import json
+import time
+import uuid
+import threading
+
+from utils.constants import JSONL_FLUSH_INTERVAL, JSONL_FSYNC_INTERVAL
+
+
+class JsonlSink:
+    """Append-only JSON Lines writer with buffered writes and periodic fsync"""
+
+    def __init__(self, path: str, flush_interval: int = JSONL_FLUSH_INTERVAL,
+                 fsync_interval: float = JSONL_FSYNC_INTERVAL):
+        """
+        Initialize JsonlSink
+
+        Args:
+            path: Path of the JSON Lines file, which must not exist yet (see unique_sink_path)
+            flush_interval: Number of buffered records written to the file at once
+            fsync_interval: Minimal time (seconds) between two fsync of the file
+        """
+        self.path = path
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
+        self._buffer = []
+        self._last_fsync = time.time()
+        self._lock = threading.Lock()
+        # Exclusive creation, a sink never writes into the records of another one
+        self._file = open(path, "x", encoding="utf-8")
+
+    def write(self, record: dict):
+        """Append one record"""
+        with self._lock:
+            self._buffer.append(json.dumps(record, ensure_ascii=False) + "\n")
+            if len(self._buffer) >= self.flush_interval:
+                self._flush()
+
+    def _flush(self, fsync: bool = False):
+        if len(self._buffer) != 0:
+            self._file.write("".join(self._buffer))
+            self._buffer = []
+            self._file.flush()
+        if fsync or time.time() - self._last_fsync >= self.fsync_interval:
+            os.fsync(self._file.fileno())
+            self._last_fsync = time.time()
+
+    def flush(self):
+        """Write the buffered records and fsync the file"""
+        with self._lock:
+            if not self._file.closed:
+                self._flush(fsync=True)
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._flush(fsync=True)
+                self._file.close()
+
+
+def unique_sink_path(out_path: str) -> str:
+    """Path of a JSON Lines file next to out_path, distinct for every translator of every process"""
+    return f"{os.path.splitext(out_path)[0]}.{os.getpid()}.{uuid.uuid4().hex[:12]}.jsonl"
+
+
+def read_jsonl(path: str) -> list:
+    """Read the records of a JSON Lines file, a truncated last line left by a crash is skipped"""
+    records = []
+    with open(path, "r", encoding="utf-8") as rf:
+        for line in rf:
+            line = line.strip()
+            if line == "":
+                continue
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                break
+    return records
+
+
+def compact_process_file(jsonl_path: str, out_path: str, remove: bool = True) -> bool:
+    """
+    Export a translation process written as JSON Lines to the layout
+    {"info": {...}, "process_data": [...]}, where the first record holds the info.
+
+    Args:
+        jsonl_path: Path of the JSON Lines file
+        out_path: Path of the exported JSON file, replaced atomically
+        remove: Whether to remove the JSON Lines file after the export
+
+    Returns:
+        bool: False if the JSON Lines file does not exist (anymore), nothing is exported then
+    """
+    try:
+        records = read_jsonl(jsonl_path)
+    except FileNotFoundError:
+        return False
+    res_data = {"info": {}, "process_data": []}
+    if len(records) != 0 and "info" in records[0]:
+        res_data["info"] = records[0]["info"]
+        records = records[1:]
+    res_data["process_data"] = records
+
+    tmp_path = f"{out_path}.{os.getpid()}.{uuid.uuid4().hex[:12]}.tmp"
+    with open(tmp_path, "w") as wf:
+        json.dump(res_data, wf, indent=4)
+    os.replace(tmp_path, out_path)
+    if remove:
+        try:
+            os.remove(jsonl_path)
+        except FileNotFoundError:
+            pass
+    return True
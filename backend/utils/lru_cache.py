@@ -0,0 +1,85 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Bounded, thread-safe LRU cache with hit/miss counters"""
+
+    def __init__(self, maxsize: int = 128, ttl: float = None):
+        """
+        Initialize LRUCache
+
+        Args:
+            maxsize: Maximum number of entries kept, the least recently used entry is evicted first
+            ttl: Time to live (seconds) of an entry, entries never expire if None
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Get the cached value of key, return default on miss"""
+        with self._lock:
+            if key in self._data:
+                value, expire_time = self._data[key]
+                if expire_time is None or expire_time > time.time():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        """Cache value under key"""
+        if self.maxsize <= 0:
+            return
+        expire_time = time.time() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expire_time)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        """Remove key from cache"""
+        with self._lock:
+            if key in self._data:
+                return self._data.pop(key)[0]
+            return default
+
+    def clear(self):
+        """Remove all entries and reset counters"""
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        """Return hit/miss counters of the cache"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hit_rate": self.hits / total if total else 0.0
+            }
+
+    def __len__(self):
+        """Number of stored entries, the expired ones not evicted yet included"""
+        with self._lock:
+            return len(self._data)
+
+    def __contains__(self, key):
+        """Whether key has an unexpired entry, neither the counters nor the recency are updated"""
+        with self._lock:
+            if key not in self._data:
+                return False
+            expire_time = self._data[key][1]
+            return expire_time is None or expire_time > time.time()
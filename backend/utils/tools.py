@@ -8,8 +8,6 @@ import sys
 import traceback
 from typing import List
 
-import openai
-import requests
 
 tf_step = 0
 summary_writer = None
@@ -116,6 +114,9 @@ def send_request(history: [], sys_prompt, prompt, model="gpt-4-turbo"):
         messages.append(message)
     messages.append({"role": "user", "content": prompt})
 
+    import openai
+    import requests
+
     flag = False
     if flag:
         os.environ["OPENAI_API_BASE"] = "your api base for GPT"
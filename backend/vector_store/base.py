@@ -0,0 +1,92 @@
+import re
+import json
+import hashlib
+import threading
+from typing import Dict
+
+from utils.constants import VECTOR_BACKEND, CHROMA_PERSIST_DIR, NUMPY_INDEX_DIR
+
+CONTENT_TYPES = ['function', 'keyword', 'type', 'operator']
+
+# (backend, persist_directory) -> vector store shared by the whole process
+store_map = {}
+store_map_lock = threading.Lock()
+
+
+def convert_distance_to_score(distance: float) -> float:
+    """
+    Convert Chroma's distance value to a similarity score of 0-100
+    Chroma uses cosine distance (1 - cosine_similarity)
+    distance = 0 means completely identical, distance = 2 means completely opposite
+    We convert it to: 0 means completely different, 100 means completely identical
+    """
+
+    if distance is None:
+        return 0
+    # Map distance from [0,2] to [0,100]
+    score = (1 - distance / 2) * 100
+    # Round to two decimal places
+    score = round(score, 2)
+    # Ensure score is within 0-100 range
+    return max(0, min(100, score))
+
+
+def generate_collection_id(kb_name: str, content_type: str) -> str:
+    """Generate collection ID
+    Args:
+        kb_name: Knowledge base name
+        content_type: Content type
+
+    Returns:
+        str: Valid table name
+    """
+    # Use MD5 to hash Chinese names, ensuring table name uniqueness
+    name_hash = hashlib.md5(kb_name.encode('utf-8')).hexdigest()[:8]
+    # Remove all non-alphanumeric characters, convert to lowercase
+    safe_name = re.sub(r'[^a-zA-Z0-9]', '_', kb_name.encode('ascii', 'ignore').decode('ascii').lower())
+    # Combine table name: prefix + safe_name + hash
+    return f"vector_store_{safe_name}_{name_hash}_{content_type}"
+
+
+def make_vector_metadata(content_id: int, kb_id: int, content_type: str, content: str,
+                         content_hash: str, embedding_model: str) -> Dict:
+    """Metadata of the vector of a knowledge entry, content_hash and embedding_model tell when it is stale"""
+    return {
+        'content_id': str(content_id),
+        'knowledge_base_id': str(kb_id),
+        'content_type': content_type,
+        'content': json.dumps(content),
+        'content_hash': content_hash,
+        'embedding_model': embedding_model
+    }
+
+
+def get_vector_store(backend: str = None, persist_directory: str = None):
+    """
+    Get the vector store shared by all the threads of the process, created on first use
+
+    Args:
+        backend: "chroma" (ChromaStore) or "numpy" (NumpyStore, exact in-process search), VECTOR_BACKEND if None
+        persist_directory: Persistence directory, the default one of the backend if None
+
+    Returns:
+        ChromaStore or NumpyStore, both serving add_texts/search/search_batch/delete_by_ids
+    """
+    backend = backend or VECTOR_BACKEND
+    if backend == "chroma":
+        # Only the configured backend is imported, chromadb is heavy
+        from vector_store.chroma_store import get_chroma_store
+        return get_chroma_store(persist_directory or CHROMA_PERSIST_DIR)
+    if backend != "numpy":
+        raise ValueError(f"Unsupported vector backend: {backend}")
+
+    persist_directory = persist_directory or NUMPY_INDEX_DIR
+    store = store_map.get((backend, persist_directory))
+    if store is None:
+        with store_map_lock:
+            store = store_map.get((backend, persist_directory))
+            if store is None:
+                from vector_store.numpy_store import NumpyStore
+                store = NumpyStore(persist_directory)
+                store_map[(backend, persist_directory)] = store
+    return store
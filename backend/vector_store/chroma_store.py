@@ -1,54 +1,33 @@
 import os
-import re
-import hashlib
+import json
+import uuid
+import fcntl
+import heapq
+import threading
 import chromadb
+from itertools import islice
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from chromadb.config import Settings
 from typing import List, Dict, Optional
 
 from config.logging_config import logger
 from chromadb.api.models.Collection import Collection
 from api.utils.retry import retry_on_error
+from utils.constants import CHROMA_SEARCH_WORKERS, CHROMA_PERSIST_DIR
+from vector_store.base import CONTENT_TYPES, convert_distance_to_score, generate_collection_id
 
+# Name of the file mapping the collection IDs to the collections serving them, in the persistence directory
+ALIASES_FILE = "aliases.json"
 
-def convert_distance_to_score(distance: float) -> float:
-    """
-    Convert Chroma's distance value to a similarity score of 0-100
-    Chroma uses cosine distance (1 - cosine_similarity)
-    distance = 0 means completely identical, distance = 2 means completely opposite
-    We convert it to: 0 means completely different, 100 means completely identical
-    """
-
-    if distance is None:
-        return 0
-    # Map distance from [0,2] to [0,100]
-    score = (1 - distance / 2) * 100
-    # Round to two decimal places
-    score = round(score, 2)
-    # Ensure score is within 0-100 range
-    return max(0, min(100, score))
-
-
-def generate_collection_id(kb_name: str, content_type: str) -> str:
-    """Generate collection ID
-    Args:
-        kb_name: Knowledge base name
-        content_type: Content type
-        
-    Returns:
-        str: Valid table name
-    """
-    # Use MD5 to hash Chinese names, ensuring table name uniqueness
-    name_hash = hashlib.md5(kb_name.encode('utf-8')).hexdigest()[:8]
-    # Remove all non-alphanumeric characters, convert to lowercase
-    safe_name = re.sub(r'[^a-zA-Z0-9]', '_', kb_name.encode('ascii', 'ignore').decode('ascii').lower())
-    # Combine table name: prefix + safe_name + hash
-    return f"vector_store_{safe_name}_{name_hash}_{content_type}"
+# Shared by the searches fanning out over the collections of a knowledge base
+search_executor = ThreadPoolExecutor(max_workers=CHROMA_SEARCH_WORKERS, thread_name_prefix="chroma-search")
 
 
 class ChromaStore:
     """Chroma vector storage manager"""
 
-    def __init__(self, persist_directory: str = "./instance/chroma"):
+    def __init__(self, persist_directory: str = CHROMA_PERSIST_DIR):
         """
         Initialize ChromaStore
         
@@ -67,17 +46,86 @@ class ChromaStore:
                 is_persistent=True
             )
         )
+        # collection_id -> Collection, missing collections are not cached
+        self._collections = {}
+        self._collections_lock = threading.Lock()
+        # collection_id -> name of the collection serving it, set when a shadow collection is swapped in
+        self._aliases_file = os.path.join(persist_directory, ALIASES_FILE)
+        self._aliases = {}
+        self._aliases_mtime = None
+        self._aliases_write_lock = threading.Lock()
+
+    def _read_aliases(self) -> Dict[str, str]:
+        try:
+            with open(self._aliases_file, "r", encoding="utf-8") as rf:
+                return json.load(rf)
+        except FileNotFoundError:
+            return {}
+
+    def _resolve(self, collection_id: str) -> str:
+        """Name of the collection serving collection_id, the aliases are reloaded once another process swapped"""
+        try:
+            mtime = os.stat(self._aliases_file).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime != self._aliases_mtime:
+            with self._collections_lock:
+                if mtime != self._aliases_mtime:
+                    self._aliases = self._read_aliases() if mtime is not None else {}
+                    self._aliases_mtime = mtime
+                    self._collections.clear()
+        return self._aliases.get(collection_id, collection_id)
+
+    @contextmanager
+    def _aliases_lock(self):
+        """
+        Serialize the writers of the aliases within and across processes, yield the aliases read from the file
+        under the lock, so that the changes of another process are never overwritten by a stale copy
+        """
+        with self._aliases_write_lock:
+            with open(f"{self._aliases_file}.lock", "a") as lf:
+                fcntl.flock(lf, fcntl.LOCK_EX)
+                try:
+                    yield self._read_aliases()
+                finally:
+                    fcntl.flock(lf, fcntl.LOCK_UN)
+
+    def _dump_aliases(self, aliases: Dict[str, str]):
+        # Called with the aliases lock held, the file is replaced at once for the readers
+        tmp_file = f"{self._aliases_file}.{os.getpid()}.{uuid.uuid4().hex[:8]}.tmp"
+        with open(tmp_file, "w", encoding="utf-8") as wf:
+            json.dump(aliases, wf)
+        os.replace(tmp_file, self._aliases_file)
+        with self._collections_lock:
+            self._aliases = aliases
+            self._aliases_mtime = os.stat(self._aliases_file).st_mtime_ns
+            self._collections.clear()
 
     def _get_collection(self, collection_id: str):
         """Get collection"""
+        name = self._resolve(collection_id)
+        collection = self._collections.get(collection_id)
+        if collection is not None:
+            return collection
         try:
-            return self.client.get_collection(
-                name=collection_id,
+            collection = self.client.get_collection(
+                name=name,
                 embedding_function=None
             )
         except Exception as e:
             logger.error(f"Failed to get collection: {str(e)}")
             return None
+        with self._collections_lock:
+            self._collections[collection_id] = collection
+        return collection
+
+    def _invalidate_collection(self, collection_id: str = None):
+        """Drop the cached handle of the collection, all handles if collection_id is None"""
+        with self._collections_lock:
+            if collection_id is None:
+                self._collections.clear()
+            else:
+                self._collections.pop(collection_id, None)
 
     @retry_on_error(logger_name="ChromaDB")
     def get_or_create_collection(self, collection_id: str, dimension: int = 1536) -> Collection:
@@ -90,37 +138,47 @@ class ChromaStore:
         Returns:
             str: Collection ID
         """
+        name = self._resolve(collection_id)
+        collection = self._collections.get(collection_id)
+        if collection is not None:
+            return collection
         try:
             # First try to get existing collection
             try:
                 collection = self.client.get_collection(
-                    name=collection_id,
+                    name=name,
                     embedding_function=None
                 )
                 logger.info(f"Retrieved existing collection: {collection_id}")
+                with self._collections_lock:
+                    self._collections[collection_id] = collection
                 return collection
             except Exception:
                 # If collection doesn't exist, create a new one
-                metadata = {
-                    "hnsw:space": "cosine",
-                    "dimension": str(dimension),
-                    "hnsw:search_ef": 200,
-                    "hnsw:construction_ef": 200,
-                    "hnsw:M": 32
-                }
-
                 collection = self.client.create_collection(
-                    name=collection_id,
+                    name=name,
                     embedding_function=None,
-                    metadata=metadata
+                    metadata=self._collection_metadata(dimension)
                 )
                 logger.info(f"Created new collection: {collection_id}")
+                with self._collections_lock:
+                    self._collections[collection_id] = collection
 
                 return collection
         except Exception as e:
             logger.error(f"Failed to create collection: {str(e)}")
             raise
 
+    @staticmethod
+    def _collection_metadata(dimension: int) -> Dict:
+        return {
+            "hnsw:space": "cosine",
+            "dimension": str(dimension),
+            "hnsw:search_ef": 200,
+            "hnsw:construction_ef": 200,
+            "hnsw:M": 32
+        }
+
     def _validate_inputs(self, texts: List[str], embeddings: List[List[float]], ids: Optional[List[str]] = None):
         """Validate input data consistency"""
         if len(texts) != len(embeddings):
@@ -137,9 +195,10 @@ class ChromaStore:
             embeddings: List[List[float]],
             metadatas: Optional[List[Dict]] = None,
             ids: Optional[List[str]] = None,
-            batch_size: int = 100
+            batch_size: int = 100,
+            upsert: bool = False
     ):
-        """Add texts to vector database"""
+        """Add texts to vector database, the vectors of existing ids are replaced if upsert"""
         self._validate_inputs(texts, embeddings, ids)
         collection_id = generate_collection_id(kb_name, content_type)
         collection = self.get_or_create_collection(collection_id)
@@ -148,16 +207,100 @@ class ChromaStore:
             existing_count = collection.count()
             ids = [str(i) for i in range(existing_count, existing_count + len(texts))]
 
+        try:
+            self.write_collection(collection, texts, embeddings, metadatas, ids, batch_size, upsert)
+        finally:
+            # Let the readers get a fresh handle of the modified collection
+            self._invalidate_collection(collection_id)
+
+    @staticmethod
+    def write_collection(collection: Collection, texts: List[str], embeddings: List[List[float]],
+                         metadatas: Optional[List[Dict]], ids: List[str], batch_size: int = 100,
+                         upsert: bool = False):
+        """Write texts to the collection itself, e.g., a shadow collection"""
         # Add in batches to avoid memory overflow
+        write = collection.upsert if upsert else collection.add
         for i in range(0, len(texts), batch_size):
             end_idx = min(i + batch_size, len(texts))
-            collection.add(
+            write(
                 embeddings=embeddings[i:end_idx],
                 documents=texts[i:end_idx],
                 metadatas=metadatas[i:end_idx] if metadatas else None,
                 ids=ids[i:end_idx]
             )
 
+    def get_vectors(self, kb_name: str, content_type: str, ids: Optional[List[str]] = None,
+                    include: List[str] = None, batch_size: int = 1000) -> Dict[str, list]:
+        """
+        Read the vectors of a collection page by page
+
+        Args:
+            kb_name: Knowledge base name
+            content_type: Content type
+            ids: Vector IDs to read, all the vectors if None
+            include: Fields read besides the IDs, the metadatas if None
+            batch_size: Vectors read at once
+
+        Returns:
+            Dict[str, list]: 'ids' and one list per included field, empty if the collection does not exist
+        """
+        include = include or ["metadatas"]
+        res = {"ids": [], **{field: [] for field in include}}
+        collection = self._get_collection(generate_collection_id(kb_name, content_type))
+        if not collection:
+            return res
+        if ids is not None:
+            pages = [{"ids": ids[i:i + batch_size]} for i in range(0, len(ids), batch_size)]
+        else:
+            pages = ({"limit": batch_size, "offset": offset} for offset in range(0, collection.count(), batch_size))
+        for page in pages:
+            results = collection.get(include=include, **page)
+            res["ids"].extend(results["ids"])
+            for field in include:
+                res[field].extend(results[field])
+        return res
+
+    def create_shadow_collection(self, kb_name: str, content_type: str, dimension: int = 1536) -> Collection:
+        """Create an empty collection to be filled and then swapped in for the collection of the content type"""
+        collection_id = generate_collection_id(kb_name, content_type)
+        # Collection names are limited to 63 characters
+        name = f"{collection_id[:50]}_{uuid.uuid4().hex[:8]}"
+        return self.client.create_collection(
+            name=name,
+            embedding_function=None,
+            metadata=self._collection_metadata(dimension)
+        )
+
+    def drop_shadow_collection(self, collection: Collection):
+        try:
+            self.client.delete_collection(collection.name)
+        except Exception as e:
+            logger.error(f"Failed to delete shadow collection {collection.name}: {str(e)}")
+
+    def swap_collections(self, kb_name: str, shadows: Dict[str, Collection]):
+        """
+        Serve the content types of the knowledge base by their shadow collections, all at once
+
+        Args:
+            kb_name: Knowledge base name
+            shadows: content type -> shadow collection, the collections of the other content types are kept
+        """
+        old_names = []
+        with self._aliases_lock() as aliases:
+            for content_type, collection in shadows.items():
+                collection_id = generate_collection_id(kb_name, content_type)
+                old_names.append(aliases.get(collection_id, collection_id))
+                aliases[collection_id] = collection.name
+            self._dump_aliases(aliases)
+
+        # The searches running on the old collections retry on the new ones
+        for name in old_names:
+            try:
+                self.client.delete_collection(name)
+            except Exception:
+                # The content type had no collection yet
+                pass
+
     @retry_on_error(logger_name="ChromaDB")
     def search(
             self,
@@ -170,32 +313,66 @@ class ChromaStore:
             **kwargs
     ) -> List[Dict]:
         """Search by knowledge base name and content type"""
+        return self._search_batch(kb_name, [query_embedding], content_type, top_k, None,
+                                  where, where_document, **kwargs)[0]
 
-        collection_ids = []
+    @retry_on_error(logger_name="ChromaDB")
+    def search_batch(
+            self,
+            kb_name: str,
+            query_embeddings: List[List[float]],
+            content_type: str = None,
+            top_k: int = 5,
+            where: Optional[Dict] = None,
+            where_document: Optional[Dict] = None,
+            **kwargs
+    ) -> List[List[Dict]]:
+        """Search many query embeddings at once
 
-        if not content_type:
-            # Get all content types
-            content_types = ['function', 'keyword', 'type', 'operator']
-            for content_type in content_types:
-                collection_ids.append(generate_collection_id(kb_name, content_type))
-        else:
-            collection_ids.append(generate_collection_id(kb_name, content_type))
+        Args:
+            kb_name: Knowledge base name
+            query_embeddings: Query embeddings
+            content_type: Content type, all the content types are searched if None
+            top_k: Number of results returned for each query
 
-        results_all = []
-        for collection_id in collection_ids:
+        Returns:
+            List[List[Dict]]: Top-k results of each query, sorted by score
+        """
+        return self._search_batch(kb_name, query_embeddings, content_type, top_k, top_k,
+                                  where, where_document, **kwargs)
+
+    def _search_batch(self, kb_name: str, query_embeddings: List[List[float]], content_type: Optional[str],
+                      top_k: int, limit: Optional[int], where: Optional[Dict], where_document: Optional[Dict],
+                      **kwargs) -> List[List[Dict]]:
+        if len(query_embeddings) == 0:
+            return []
+
+        content_types = [content_type] if content_type else CONTENT_TYPES
+        collections = []
+        for content_type in content_types:
+            collection_id = generate_collection_id(kb_name, content_type)
             collection = self._get_collection(collection_id)
-            if not collection:
-                continue
+            if collection:
+                collections.append((collection_id, collection))
+
+        def query(item) -> List[List[Dict]]:
+            collection_id, collection = item
             try:
                 results = collection.query(
-                    query_embeddings=[query_embedding],
+                    query_embeddings=query_embeddings,
                     n_results=top_k,
                     where=where,
                     include=["documents", "metadatas", "distances"],
                     where_document=where_document,
                     **kwargs
                 )
-                results_all.extend([
+            except Exception as e:
+                logger.error(f"Search failed: {str(e)}")
+                # The collection may have been deleted or recreated, get it again on retry
+                self._invalidate_collection(collection_id)
+                raise
+            return [
+                [
                     {
                         'content': doc,
                         'metadata': meta if meta else {},
@@ -203,19 +380,26 @@ class ChromaStore:
                         'id': id_
                     }
                     for doc, meta, distance, id_ in zip(
-                        results['documents'][0],
-                        results['metadatas'][0] if results['metadatas'] else [None] * len(results['documents'][0]),
-                        results['distances'][0] if results['distances'] else [None] * len(results['documents'][0]),
-                        results['ids'][0]
+                        results['documents'][i],
+                        results['metadatas'][i] if results['metadatas'] else [None] * len(results['documents'][i]),
+                        results['distances'][i] if results['distances'] else [None] * len(results['documents'][i]),
+                        results['ids'][i]
                     )
-                ])
-            except Exception as e:
-                logger.error(f"Search failed: {str(e)}")
-                raise
+                ]
+                for i in range(len(query_embeddings))
+            ]
 
-        # Sort by score
-        results_all.sort(key=lambda x: x['score'], reverse=True)
+        if len(collections) > 1:
+            results_by_collection = list(search_executor.map(query, collections))
+        else:
+            results_by_collection = [query(item) for item in collections]
 
+        # The results of each collection are sorted by distance, merge them by score
+        results_all = []
+        for i in range(len(query_embeddings)):
+            merged = heapq.merge(*[results[i] for results in results_by_collection],
+                                 key=lambda x: x['score'], reverse=True)
+            results_all.append(list(islice(merged, limit)))
         return results_all
 
     @retry_on_error(logger_name="ChromaDB")
@@ -234,8 +418,36 @@ class ChromaStore:
     @retry_on_error(logger_name="ChromaDB")
     def delete_collection(self, kb_name: str):
         """Delete collection"""
+        collection_ids = [generate_collection_id(kb_name, content_type) for content_type in CONTENT_TYPES]
         try:
-            for content_type in ['function', 'keyword', 'type', 'operator']:
-                self.client.delete_collection(generate_collection_id(kb_name, content_type))
+            with self._aliases_lock() as aliases:
+                try:
+                    for collection_id in collection_ids:
+                        try:
+                            self.client.delete_collection(aliases.get(collection_id, collection_id))
+                        finally:
+                            self._invalidate_collection(collection_id)
+                finally:
+                    remaining = {collection_id: name for collection_id, name in aliases.items()
+                                 if collection_id not in collection_ids}
+                    if remaining != aliases:
+                        self._dump_aliases(remaining)
         except Exception as e:
             logger.error(f"Failed to delete collection: {str(e)}")
+
+
+# persist_directory -> ChromaStore shared by the whole process
+store_map = {}
+store_map_lock = threading.Lock()
+
+
+def get_chroma_store(persist_directory: str = CHROMA_PERSIST_DIR) -> ChromaStore:
+    """Get the ChromaStore of persist_directory shared by all the threads of the process, created on first use"""
+    store = store_map.get(persist_directory)
+    if store is None:
+        with store_map_lock:
+            store = store_map.get(persist_directory)
+            if store is None:
+                store = ChromaStore(persist_directory)
+                store_map[persist_directory] = store
+    return store
@@ -0,0 +1,657 @@
+import os
+import sys
+import json
+import mmap
+import fcntl
+import heapq
+import argparse
+import threading
+
+import numpy as np
+from itertools import islice
+from contextlib import contextmanager
+from typing import List, Dict, Optional
+
+from config.logging_config import logger
+from utils.columnar_kb import align
+from utils.constants import NUMPY_INDEX_DIR, NUMPY_INDEX_DTYPE, NUMPY_SEARCH_BLOCK
+from vector_store.base import CONTENT_TYPES, convert_distance_to_score, generate_collection_id
+
+# File layout: MAGIC, the committed length of the file (little-endian uint64), then the segments appended by
+# the writes up to the committed length, bytes past it are left by an interrupted write and ignored.
+# A segment is its header length (uint64), a JSON header holding the ids, documents and metadatas of its
+# vectors and the ids it deletes, then from the next 8-byte boundary the scales (float32, one per vector,
+# int8 segments only) and the row-major matrix of the unit-normalized vectors, 8-byte aligned as well.
+MAGIC = b"NVX\x02\x00\x00\x00\x00"
+FORMAT_VERSION = 2
+FILE_HEADER_SIZE = len(MAGIC) + 8
+DTYPES = ["float32", "int8"]
+
+
+def normalize(embeddings) -> np.ndarray:
+    """Unit-normalize the vectors, so that the dot product is the cosine similarity"""
+    matrix = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+def quantize(matrix: np.ndarray):
+    """Symmetric int8 quantization with one scale per vector, matrix[i] ~ quantized[i] * scales[i]"""
+    scales = np.abs(matrix).max(axis=1) / 127
+    scales[scales == 0] = 1
+    return np.round(matrix / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+
+def match_where(metadata: Dict, where: Dict) -> bool:
+    """Metadata filter of the equality subset of the Chroma syntax, e.g., {"content_type": "function"}"""
+    for key, value in where.items():
+        if isinstance(value, dict):
+            if list(value.keys()) != ["$eq"]:
+                raise ValueError(f"Unsupported where clause of the numpy vector store: {where}")
+            value = value["$eq"]
+        if (metadata or {}).get(key) != value:
+            return False
+    return True
+
+
+def read_committed_length(rf) -> int:
+    rf.seek(0)
+    head = rf.read(FILE_HEADER_SIZE)
+    if len(head) != FILE_HEADER_SIZE or head[:len(MAGIC)] != MAGIC:
+        raise ValueError(f"Not a vector collection file of version {FORMAT_VERSION}: {rf.name}")
+    return int(np.frombuffer(head, dtype="<u8", count=1, offset=len(MAGIC))[0])
+
+
+def write_committed_length(wf, length: int):
+    wf.seek(len(MAGIC))
+    wf.write(np.array([length], dtype="<u8").tobytes())
+
+
+class Segment:
+    """Vectors written to a collection at once, with the ids deleted by the write"""
+
+    def __init__(self, ids: List[str], documents: List[str], metadatas: List[Dict],
+                 matrix: Optional[np.ndarray] = None, scales: Optional[np.ndarray] = None,
+                 deleted: Optional[List[str]] = None):
+        self.ids = ids
+        self.documents = documents
+        self.metadatas = metadatas
+        # [count, dimension] float32 or int8, None if the segment only deletes
+        self.matrix = matrix
+        self.scales = scales
+        self.deleted = deleted or []
+
+    def dump(self, wf):
+        """Write the segment at the current position of wf, an 8-byte boundary"""
+        header = {"dtype": str(self.matrix.dtype) if self.matrix is not None else None,
+                  "count": len(self.ids), "dimension": self.matrix.shape[1] if self.matrix is not None else 0,
+                  "ids": self.ids, "documents": self.documents, "metadatas": self.metadatas,
+                  "deleted": self.deleted}
+        header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+        sections = []
+        if self.matrix is not None:
+            if self.scales is not None:
+                sections.append(np.ascontiguousarray(self.scales, dtype="<f4").tobytes())
+            sections.append(np.ascontiguousarray(self.matrix).tobytes())
+
+        wf.write(np.array([len(header_bytes)], dtype="<u8").tobytes())
+        wf.write(header_bytes)
+        wf.write(b"\x00" * (align(len(header_bytes)) - len(header_bytes)))
+        for data in sections:
+            wf.write(data)
+            wf.write(b"\x00" * (align(len(data)) - len(data)))
+
+    @classmethod
+    def load(cls, mm: mmap.mmap, offset: int):
+        """Read the segment at offset of the mapped file, return it and the offset of the next segment"""
+        header_len = int(np.frombuffer(mm, dtype="<u8", count=1, offset=offset)[0])
+        header = json.loads(bytes(mm[offset + 8:offset + 8 + header_len]))
+        offset = align(offset + 8 + header_len)
+        count, dimension = header["count"], header["dimension"]
+        matrix, scales = None, None
+        if header["dtype"] is not None:
+            # The arrays keep the mapping alive
+            if header["dtype"] == "int8":
+                scales = np.frombuffer(mm, dtype="<f4", count=count, offset=offset)
+                offset += align(count * 4)
+            matrix = np.frombuffer(mm, dtype="<f4" if header["dtype"] == "float32" else np.int8,
+                                   count=count * dimension, offset=offset).reshape(count, dimension)
+            offset += align(matrix.nbytes)
+        return cls(header["ids"], header["documents"], header["metadatas"], matrix, scales,
+                   header["deleted"]), offset
+
+
+class VectorCollection:
+    """Vectors of one collection, never modified: a write returns a new collection, so searches need no lock
+
+    The rows are those of the segments in write order, a row is dead once its id is deleted or written again.
+    """
+
+    def __init__(self, name: str, dtype: str):
+        self.name = name
+        self.dtype = dtype
+        self.dimension = None
+        # [(first row, matrix, scales)] of the segments holding vectors
+        self.parts = []
+        self.ids = []
+        self.documents = []
+        self.metadatas = []
+        self.alive = np.zeros(0, dtype=bool)
+        # id -> its live row
+        self.rows = {}
+
+    @classmethod
+    def empty(cls, name: str, dtype: str) -> "VectorCollection":
+        return cls(name, dtype)
+
+    def count(self) -> int:
+        return len(self.rows)
+
+    def dead_count(self) -> int:
+        return len(self.ids) - len(self.rows)
+
+    def extend(self, segments: List[Segment]) -> "VectorCollection":
+        """Collection with the segments applied in order, the lists of this collection are copied"""
+        collection = VectorCollection(self.name, self.dtype)
+        collection.dimension = self.dimension
+        collection.parts = list(self.parts)
+        collection.ids, collection.documents, collection.metadatas = \
+            list(self.ids), list(self.documents), list(self.metadatas)
+        collection.rows = dict(self.rows)
+        dead = []
+        for segment in segments:
+            for id_ in segment.deleted:
+                row = collection.rows.pop(id_, None)
+                if row is not None:
+                    dead.append(row)
+            if segment.matrix is None:
+                continue
+            if len(collection.parts) == 0:
+                collection.dtype, collection.dimension = str(segment.matrix.dtype), segment.matrix.shape[1]
+            start = len(collection.ids)
+            for i, id_ in enumerate(segment.ids):
+                if id_ in collection.rows:
+                    dead.append(collection.rows[id_])
+                collection.rows[id_] = start + i
+            collection.parts.append((start, segment.matrix, segment.scales))
+            collection.ids.extend(segment.ids)
+            collection.documents.extend(segment.documents)
+            collection.metadatas.extend(segment.metadatas)
+        collection.alive = np.ones(len(collection.ids), dtype=bool)
+        collection.alive[:len(self.alive)] = self.alive
+        collection.alive[dead] = False
+        return collection
+
+    def make_segment(self, ids: List[str], embeddings, documents: List[str], metadatas: Optional[List[Dict]],
+                     upsert: bool = False) -> Optional[Segment]:
+        """Segment adding the vectors, those of existing ids replace the old ones if upsert and are skipped
+        otherwise. None if nothing is added"""
+        new_rows = {id_: i for i, id_ in enumerate(ids) if upsert or id_ not in self.rows}
+        if len(new_rows) == 0:
+            return None
+        order = list(new_rows.values())
+        matrix = normalize([embeddings[i] for i in order])
+        if self.dimension is not None and matrix.shape[1] != self.dimension:
+            raise ValueError(f"Vector dimension {matrix.shape[1]} does not match the collection "
+                             f"dimension {self.dimension}")
+        scales = None
+        if self.dtype == "int8":
+            matrix, scales = quantize(matrix)
+        return Segment([ids[i] for i in order], [documents[i] for i in order],
+                       [metadatas[i] if metadatas else None for i in order], matrix, scales)
+
+    def make_delete_segment(self, ids: List[str]) -> Optional[Segment]:
+        """Segment deleting the vectors of the ids, None if none of them exists"""
+        deleted = [id_ for id_ in dict.fromkeys(ids) if id_ in self.rows]
+        return Segment([], [], [], deleted=deleted) if len(deleted) != 0 else None
+
+    def _gather(self, rows: List[int]):
+        """Stored vectors (and scales) of the rows"""
+        rows = np.asarray(rows, dtype=np.int64)
+        starts = np.array([start for start, _, _ in self.parts], dtype=np.int64)
+        part_index = np.searchsorted(starts, rows, side="right") - 1
+        matrix = np.empty((len(rows), self.dimension), dtype=self.parts[0][1].dtype)
+        scales = np.empty(len(rows), dtype=np.float32) if self.parts[0][2] is not None else None
+        for p in np.unique(part_index).tolist():
+            start, part_matrix, part_scales = self.parts[p]
+            selected = part_index == p
+            local_rows = rows[selected] - start
+            matrix[selected] = part_matrix[local_rows]
+            if scales is not None:
+                scales[selected] = part_scales[local_rows]
+        return matrix, scales
+
+    def embeddings(self, rows: List[int]) -> np.ndarray:
+        """Unit-normalized float32 vectors of the rows"""
+        matrix, scales = self._gather(rows)
+        matrix = matrix.astype(np.float32)
+        if scales is not None:
+            matrix *= scales[:, None]
+        return matrix
+
+    def compact_segment(self) -> Optional[Segment]:
+        """Single segment holding the live rows, None if there is none"""
+        rows = np.flatnonzero(self.alive).tolist()
+        if len(rows) == 0:
+            return None
+        matrix, scales = self._gather(rows)
+        return Segment([self.ids[row] for row in rows], [self.documents[row] for row in rows],
+                       [self.metadatas[row] for row in rows], matrix, scales)
+
+    def query(self, queries: np.ndarray, top_k: int, mask: Optional[np.ndarray] = None):
+        """
+        Exact top-k search of unit-normalized queries
+
+        Returns:
+            (rows, similarities): [len(queries), k] arrays, sorted by decreasing cosine similarity
+        """
+        valid = self.alive if mask is None else self.alive & mask
+        k = min(top_k, int(valid.sum()))
+        if k <= 0:
+            return np.empty((len(queries), 0), dtype=np.int64), np.empty((len(queries), 0), dtype=np.float32)
+
+        similarities = np.empty((len(queries), len(self.ids)), dtype=np.float32)
+        # Score the rows block by block, an int8 block is widened to float32 for the matrix product
+        for start, matrix, scales in self.parts:
+            for offset in range(0, len(matrix), NUMPY_SEARCH_BLOCK):
+                end = min(offset + NUMPY_SEARCH_BLOCK, len(matrix))
+                block = matrix[offset:end].astype(np.float32, copy=False)
+                similarities[:, start + offset:start + end] = queries @ block.T
+                if scales is not None:
+                    similarities[:, start + offset:start + end] *= scales[offset:end]
+        similarities[:, ~valid] = -np.inf
+
+        top = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+        top_similarities = np.take_along_axis(similarities, top, axis=1)
+        order = np.argsort(-top_similarities, axis=1, kind="stable")
+        return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_similarities, order, axis=1)
+
+    def dump(self, path: str):
+        """Write the live rows to a new file as a single segment"""
+        segment = self.compact_segment()
+        with open(path, "wb") as wf:
+            wf.write(MAGIC)
+            wf.write(np.array([0], dtype="<u8").tobytes())
+            if segment is not None:
+                segment.dump(wf)
+            write_committed_length(wf, wf.seek(0, os.SEEK_END))
+
+    @staticmethod
+    def append(path: str, segment: Segment):
+        """Append the segment to the file and commit it, the readers see either the old or the new length"""
+        with open(path, "r+b") as f:
+            length = read_committed_length(f)
+            # Drop what an interrupted write left
+            f.seek(length)
+            f.truncate()
+            segment.dump(f)
+            new_length = f.tell()
+            f.flush()
+            os.fsync(f.fileno())
+            write_committed_length(f, new_length)
+            f.flush()
+            os.fsync(f.fileno())
+
+    @classmethod
+    def load(cls, path: str, name: str, dtype: str, base=None):
+        """
+        Map the collection file, the vectors stay in the page cache shared by the processes
+
+        Args:
+            base: (collection, committed length, inode) loaded before from the file, only the segments
+                committed since are read if the file is still the same
+
+        Returns:
+            (collection, committed length, inode)
+        """
+        with open(path, "rb") as rf:
+            inode = os.fstat(rf.fileno()).st_ino
+            length = read_committed_length(rf)
+            if base is not None and base[2] == inode and base[1] <= length:
+                collection, offset = base[0], base[1]
+            else:
+                collection, offset = cls.empty(name, dtype), FILE_HEADER_SIZE
+            if offset == length:
+                return collection, length, inode
+            mm = mmap.mmap(rf.fileno(), length, access=mmap.ACCESS_READ)
+        segments = []
+        while offset < length:
+            segment, offset = Segment.load(mm, offset)
+            segments.append(segment)
+        return collection.extend(segments), length, inode
+
+
+class ShadowCollection:
+    """Vectors collected for a collection before they are swapped in"""
+
+    def __init__(self, collection_id: str):
+        self.collection_id = collection_id
+        self.name = f"{collection_id}_shadow"
+        self.ids, self.texts, self.embeddings, self.metadatas = [], [], [], []
+
+
+class NumpyStore:
+    """Exact in-process vector storage: one memory-mapped file per collection, searched by matrix products
+
+    A write appends a segment to the collection file and commits it by updating the length in the file header,
+    under a per-collection file lock so that the writers of several processes do not lose each other's vectors.
+    Readers map only the segments committed since their last read. Once the rows replaced or deleted outnumber
+    the live ones, the collection is compacted into a new file, so that filling or rewriting a collection by
+    chunks costs I/O linear in its size.
+    """
+
+    def __init__(self, persist_directory: str = NUMPY_INDEX_DIR, dtype: str = NUMPY_INDEX_DTYPE):
+        """
+        Initialize NumpyStore
+
+        Args:
+            persist_directory: Persistence directory
+            dtype: Precision of the stored vectors, "float32" or "int8" (a quarter of the memory, approximate scores)
+        """
+        if dtype not in DTYPES:
+            raise ValueError(f"Unsupported vector dtype: {dtype}, expected one of {DTYPES}")
+        self.persist_directory = persist_directory
+        self.dtype = dtype
+        os.makedirs(persist_directory, exist_ok=True)
+        # collection_id -> (VectorCollection, (inode, size, mtime) of its file, committed length, inode),
+        # extended by the segments another process appended, reloaded once it replaced the file
+        self._collections = {}
+        self._lock = threading.RLock()
+
+    def _path(self, collection_id: str) -> str:
+        return os.path.join(self.persist_directory, f"{collection_id}.vec")
+
+    def _get_collection(self, collection_id: str) -> Optional[VectorCollection]:
+        path = self._path(collection_id)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        version = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        cached = self._collections.get(collection_id)
+        if cached is not None and cached[1] == version:
+            return cached[0]
+        with self._lock:
+            cached = self._collections.get(collection_id)
+            collection, length, inode = VectorCollection.load(path, collection_id, self.dtype,
+                                                              cached[0:1] + cached[2:] if cached is not None else None)
+            self._collections[collection_id] = (collection, version, length, inode)
+        return collection
+
+    @contextmanager
+    def _write_lock(self, collection_ids: List[str]):
+        """
+        Serialize the writers of the collections within and across processes, held from reading
+        the collections to replacing their files. Searches read the files without locking.
+        """
+        with self._lock:
+            lock_files = []
+            try:
+                # Taken in a fixed order, so that writers of several collections do not deadlock
+                for collection_id in sorted(set(collection_ids)):
+                    lf = open(f"{self._path(collection_id)}.lock", "a")
+                    lock_files.append(lf)
+                    fcntl.flock(lf, fcntl.LOCK_EX)
+                yield
+            finally:
+                for lf in reversed(lock_files):
+                    fcntl.flock(lf, fcntl.LOCK_UN)
+                    lf.close()
+
+    def _replace(self, collections: Dict[str, VectorCollection]):
+        """Write the collections, the files are replaced one right after another once all are written.
+        Called with the write lock of the collections held."""
+        with self._lock:
+            tmp_paths = {}
+            try:
+                for collection_id, collection in collections.items():
+                    tmp_paths[collection_id] = f"{self._path(collection_id)}.{os.getpid()}.tmp"
+                    collection.dump(tmp_paths[collection_id])
+                for collection_id, tmp_path in tmp_paths.items():
+                    os.replace(tmp_path, self._path(collection_id))
+            finally:
+                for tmp_path in tmp_paths.values():
+                    if os.path.isfile(tmp_path):
+                        os.remove(tmp_path)
+            for collection_id in collections.keys():
+                self._collections.pop(collection_id, None)
+
+    def _write(self, collection_id: str, collection: VectorCollection, segment: Segment):
+        """Append the segment to the collection, or compact the collection once most of its rows are dead.
+        Called with the write lock of the collection held."""
+        updated = collection.extend([segment])
+        if not os.path.isfile(self._path(collection_id)) or updated.dead_count() > updated.count():
+            self._replace({collection_id: updated})
+        else:
+            VectorCollection.append(self._path(collection_id), segment)
+
+    def _validate_inputs(self, texts: List[str], embeddings: List[List[float]], ids: Optional[List[str]] = None):
+        """Validate input data consistency"""
+        if len(texts) != len(embeddings):
+            raise ValueError("Number of texts does not match number of vectors")
+        if ids and len(ids) != len(texts):
+            raise ValueError("Number of IDs does not match number of texts")
+
+    def add_texts(
+            self,
+            kb_name: str,
+            content_type: str,
+            texts: List[str],
+            embeddings: List[List[float]],
+            metadatas: Optional[List[Dict]] = None,
+            ids: Optional[List[str]] = None,
+            batch_size: int = 100,
+            upsert: bool = False
+    ):
+        """Add texts to vector database, the vectors of existing ids are replaced if upsert
+
+        Each call appends one segment, batch_size is kept for the interface of ChromaStore.
+        """
+        self._validate_inputs(texts, embeddings, ids)
+        if len(texts) == 0:
+            return
+        collection_id = generate_collection_id(kb_name, content_type)
+        with self._write_lock([collection_id]):
+            collection = self._get_collection(collection_id) or VectorCollection.empty(collection_id, self.dtype)
+            if not ids:
+                ids = [str(i) for i in range(collection.count(), collection.count() + len(texts))]
+            segment = collection.make_segment(ids, embeddings, texts, metadatas, upsert)
+            if segment is not None:
+                self._write(collection_id, collection, segment)
+
+    def search(
+            self,
+            kb_name: str,
+            query_embedding: List[float],
+            content_type: str = None,
+            top_k: int = 5,
+            where: Optional[Dict] = None,
+            where_document: Optional[Dict] = None,
+            **kwargs
+    ) -> List[Dict]:
+        """Search by knowledge base name and content type"""
+        return self._search_batch(kb_name, [query_embedding], content_type, top_k, None,
+                                  where, where_document)[0]
+
+    def search_batch(
+            self,
+            kb_name: str,
+            query_embeddings: List[List[float]],
+            content_type: str = None,
+            top_k: int = 5,
+            where: Optional[Dict] = None,
+            where_document: Optional[Dict] = None,
+            **kwargs
+    ) -> List[List[Dict]]:
+        """Search many query embeddings at once
+
+        Args:
+            kb_name: Knowledge base name
+            query_embeddings: Query embeddings
+            content_type: Content type, all the content types are searched if None
+            top_k: Number of results returned for each query
+
+        Returns:
+            List[List[Dict]]: Top-k results of each query, sorted by score
+        """
+        return self._search_batch(kb_name, query_embeddings, content_type, top_k, top_k,
+                                  where, where_document)
+
+    def _search_batch(self, kb_name: str, query_embeddings: List[List[float]], content_type: Optional[str],
+                      top_k: int, limit: Optional[int], where: Optional[Dict],
+                      where_document: Optional[Dict]) -> List[List[Dict]]:
+        if len(query_embeddings) == 0:
+            return []
+        if where_document:
+            raise ValueError("where_document is not supported by the numpy vector store")
+        queries = normalize(query_embeddings)
+
+        content_types = [content_type] if content_type else CONTENT_TYPES
+        results_by_collection = []
+        for content_type in content_types:
+            collection = self._get_collection(generate_collection_id(kb_name, content_type))
+            if not collection or collection.count() == 0:
+                continue
+            mask = None
+            if where:
+                mask = np.array([match_where(metadata, where) for metadata in collection.metadatas], dtype=bool)
+            rows, similarities = collection.query(queries, top_k, mask)
+            results_by_collection.append([
+                [
+                    {
+                        'content': collection.documents[row],
+                        'metadata': collection.metadatas[row] or {},
+                        # Cosine distance, as in the Chroma collections
+                        'score': convert_distance_to_score(1 - float(similarity)),
+                        'id': collection.ids[row]
+                    }
+                    for row, similarity in zip(rows[i].tolist(), similarities[i].tolist())
+                ]
+                for i in range(len(query_embeddings))
+            ])
+
+        # The results of each collection are sorted by similarity, merge them by score
+        results_all = []
+        for i in range(len(query_embeddings)):
+            merged = heapq.merge(*[results[i] for results in results_by_collection],
+                                 key=lambda x: x['score'], reverse=True)
+            results_all.append(list(islice(merged, limit)))
+        return results_all
+
+    def delete_by_ids(self, kb_name: str, content_type: str, ids: List[str]):
+        """Delete vectors by ID"""
+        collection_id = generate_collection_id(kb_name, content_type)
+        with self._write_lock([collection_id]):
+            collection = self._get_collection(collection_id)
+            if not collection:
+                return
+            segment = collection.make_delete_segment(ids)
+            if segment is not None:
+                self._write(collection_id, collection, segment)
+
+    def delete_collection(self, kb_name: str):
+        """Delete collection"""
+        with self._write_lock([generate_collection_id(kb_name, content_type) for content_type in CONTENT_TYPES]):
+            for content_type in CONTENT_TYPES:
+                collection_id = generate_collection_id(kb_name, content_type)
+                self._collections.pop(collection_id, None)
+                try:
+                    os.remove(self._path(collection_id))
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logger.error(f"Failed to delete collection: {str(e)}")
+
+    def get_vectors(self, kb_name: str, content_type: str, ids: Optional[List[str]] = None,
+                    include: List[str] = None, batch_size: int = 1000) -> Dict[str, list]:
+        """
+        Read the vectors of a collection
+
+        Args:
+            kb_name: Knowledge base name
+            content_type: Content type
+            ids: Vector IDs to read, all the vectors if None
+            include: Fields read besides the IDs ("metadatas", "documents", "embeddings"), the metadatas if None
+            batch_size: Kept for the interface of ChromaStore
+
+        Returns:
+            Dict[str, list]: 'ids' and one list per included field, empty if the collection does not exist
+        """
+        include = include or ["metadatas"]
+        collection = self._get_collection(generate_collection_id(kb_name, content_type))
+        if not collection:
+            return {"ids": [], **{field: [] for field in include}}
+        if ids is None:
+            rows = np.flatnonzero(collection.alive).tolist()
+        else:
+            rows = [collection.rows[id_] for id_ in ids if id_ in collection.rows]
+        res = {"ids": [collection.ids[row] for row in rows]}
+        for field in include:
+            if field == "embeddings":
+                res[field] = list(collection.embeddings(rows)) if len(rows) != 0 else []
+            else:
+                res[field] = [getattr(collection, field)[row] for row in rows]
+        return res
+
+    def create_shadow_collection(self, kb_name: str, content_type: str, dimension: int = 1536) -> ShadowCollection:
+        """Create an empty collection to be filled and then swapped in for the collection of the content type"""
+        return ShadowCollection(generate_collection_id(kb_name, content_type))
+
+    @staticmethod
+    def write_collection(collection: ShadowCollection, texts: List[str], embeddings: List[List[float]],
+                         metadatas: Optional[List[Dict]], ids: List[str], batch_size: int = 100,
+                         upsert: bool = False):
+        """Write texts to a shadow collection"""
+        collection.ids.extend(ids)
+        collection.texts.extend(texts)
+        collection.embeddings.extend(embeddings)
+        collection.metadatas.extend(metadatas if metadatas else [None] * len(ids))
+
+    def drop_shadow_collection(self, collection: ShadowCollection):
+        collection.ids, collection.texts, collection.embeddings, collection.metadatas = [], [], [], []
+
+    def swap_collections(self, kb_name: str, shadows: Dict[str, ShadowCollection]):
+        """
+        Serve the content types of the knowledge base by their shadow collections
+
+        Args:
+            kb_name: Knowledge base name
+            shadows: content type -> shadow collection, the collections of the other content types are kept
+        """
+        collections = {}
+        for shadow in shadows.values():
+            collection = VectorCollection.empty(shadow.collection_id, self.dtype)
+            segment = collection.make_segment(shadow.ids, shadow.embeddings, shadow.texts, shadow.metadatas,
+                                              upsert=True)
+            collections[shadow.collection_id] = collection.extend([segment] if segment is not None else [])
+        with self._write_lock(list(collections.keys())):
+            self._replace(collections)
+
+    def copy_from(self, store, kb_name: str) -> int:
+        """Copy the vectors of a knowledge base from another store (e.g., a ChromaStore), without re-embedding"""
+        copied = 0
+        for content_type in CONTENT_TYPES:
+            vectors = store.get_vectors(kb_name, content_type, include=["embeddings", "documents", "metadatas"])
+            if len(vectors["ids"]) != 0:
+                self.add_texts(kb_name, content_type, vectors["documents"], vectors["embeddings"],
+                               vectors["metadatas"], vectors["ids"], upsert=True)
+                copied += len(vectors["ids"])
+        return copied
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Copy the vectors of knowledge bases from Chroma to the numpy store.')
+    parser.add_argument('kb_names', type=str, nargs='+', help='Knowledge bases to copy')
+    parser.add_argument('--chroma_dir', type=str, default=None, help='Chroma persistence directory')
+    parser.add_argument('--out_dir', type=str, default=NUMPY_INDEX_DIR, help='Numpy store persistence directory')
+    parser.add_argument('--dtype', type=str, default=NUMPY_INDEX_DTYPE, choices=DTYPES, help='Stored precision')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    from vector_store.base import get_vector_store
+    args = parse_args()
+    chroma_store = get_vector_store("chroma", args.chroma_dir)
+    numpy_store = NumpyStore(args.out_dir, args.dtype)
+    for kb_name in args.kb_names:
+        print(f"{kb_name}: {numpy_store.copy_from(chroma_store, kb_name)} vectors", file=sys.stderr)
@@ -55,6 +55,7 @@ DO_NOT_REPLACE_MODULES = [
     'decimal', 'fractions', 'numbers', 'statistics', 'pickle', 'codecs', 'platform',
     'io', 'enum', 'string', 'calendar', 'zlib', 'gzip', 'tarfile', 'zipfile',
     'struct', 'array', 'heapq', 'bisect', 'weakref', 'abc', 'typing', 'importlib',
+    'contextlib', 'sqlite3', 'httpx', 'queue', 'mmap', 'fcntl',
     # Common third-party libraries
     'flask', 'flask_cors', 'flask_migrate', 'flask_sqlalchemy', 'flask_caching',
     'sqlalchemy', 'pymysql', 'requests', 'numpy', 'pandas', 'sklearn', 'torch',
@@ -64,46 +65,74 @@ DO_NOT_REPLACE_MODULES = [
     'wheel', 'virtualenv', 'pytz', 'chardet', 'idna', 'certifi', 'urllib3',
     'tqdm', 'packaging', 'antlr4', 'flask_apscheduler', 'langchain_openai', 
     'langchain_community', 'tenacity', 'langchain_core', 'langchain_community', 
-    'psycopg2', 'sqlalchemy', 'cx_Oracle', 'paramiko', 'func_timeout', 'oracledb'
+    'psycopg2', 'sqlalchemy', 'cx_Oracle', 'paramiko', 'func_timeout', 'oracledb',
+    'PIL', 'fastapi', 'pydantic', 'uvicorn',
+    # Sibling modules of the generated ANTLR parsers, imported without their package
+    'MySqlParser', 'PlSqlLexerBase', 'PlSqlParser', 'PostgreSQLLexer', 'PostgreSQLParser'
 ]
 
 # Import replacement rules
 IMPORT_REPLACEMENTS = {
-    # Import from any module
-    r'^from ([\w\.]+) import (.*)': 
+    # Import from any module, including the lazy imports inside functions
+    r'^([ \t]*)from (\w[\w\.]*) import (.*)': 
         lambda match: process_from_import(match),
     
     # Direct import of module
-    r'^import ([\w\.]+)(.*)': 
+    r'^([ \t]*)import ([\w\.]+)(.*)': 
         lambda match: process_import(match),
 }
 
 def process_from_import(match):
     """Process from xxx import yyy style imports"""
-    module = match.group(1)
-    imports = match.group(2)
+    indent = match.group(1)
+    module = match.group(2)
+    imports = match.group(3)
     
     # Check if it's a module that should not be replaced
     if any(module == lib or module.startswith(f"{lib}.") for lib in DO_NOT_REPLACE_MODULES):
-        return f"from {module} import {imports}"
+        return f"{indent}from {module} import {imports}"
     
     # Simplified import replacement logic, remove the creation of a stub
-    return f"from cracksql.{module} import {imports}"
+    return f"{indent}from cracksql.{module} import {imports}"
 
 def process_import(match):
     """Process import xxx style imports"""
-    module = match.group(1)
-    rest = match.group(2)
+    indent = match.group(1)
+    module = match.group(2)
+    rest = match.group(3)
     
     # Check if it's a module that should not be replaced
     if any(module == lib or module.startswith(f"{lib}.") for lib in DO_NOT_REPLACE_MODULES):
-        return f"import {module}{rest}"
+        return f"{indent}import {module}{rest}"
     
     # Create a valid alias (remove dot)
     alias = module.replace(".", "_")
     
     # Simplified import replacement logic, remove the creation of a stub
-    return f"import cracksql.{module} as {alias}{rest}"
+    return f"{indent}import cracksql.{module} as {alias}{rest}"
+
+def is_local_module(base_dir: str, module: str) -> bool:
+    """Check whether the module belongs to the package, i.e., its top-level package is under base_dir"""
+    top = module.split(".")[0]
+    return os.path.isdir(os.path.join(base_dir, top)) or os.path.isfile(os.path.join(base_dir, f"{top}.py"))
+
+def find_unknown_imports(base_dir: str, files: List[str]) -> List[str]:
+    """
+    Find the imported modules that would be rewritten to cracksql.xxx although they are not part of the package,
+    i.e., stdlib or third-party modules missing from DO_NOT_REPLACE_MODULES (lazy imports included)
+    """
+    unknown = []
+    for file_path in files:
+        with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+            content = f.read()
+        for match in re.finditer(r'^[ \t]*(?:from (\w[\w\.]*) import|import ([\w\.]+))', content, flags=re.MULTILINE):
+            module = match.group(1) or match.group(2)
+            if any(module == lib or module.startswith(f"{lib}.") for lib in DO_NOT_REPLACE_MODULES):
+                continue
+            if not is_local_module(base_dir, module):
+                line = content.count("\n", 0, match.start()) + 1
+                unknown.append(f"{file_path}:{line}: {module}")
+    return unknown
 
 def get_files_to_process(base_dir: str, patterns: List[str]) -> List[str]:
     """Get the list of files to process based on patterns"""
@@ -175,6 +204,14 @@ def main():
     # Get files to process
     files = get_files_to_process(base_dir, FILE_PATTERNS)
     print(f"Found {len(files)} files to process")
+
+    # Every module not in the package must be listed in DO_NOT_REPLACE_MODULES, checked before any file is modified
+    unknown = find_unknown_imports(base_dir, files)
+    if unknown:
+        print("Imports of modules neither in the package nor in DO_NOT_REPLACE_MODULES:")
+        for entry in unknown:
+            print(f"  - {entry}")
+        sys.exit(1)
     
     # Process each file
     for file_path in files: